@@ -12,5 +12,11 @@ import os
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'adentro_schedule.settings')
+os.environ.setdefault('ASYNC_VIEWS', '1')
 
 application = get_asgi_application()
+
+# поток живых обновлений расписаний обслуживается перед Django (см. schedule_app/sse.py)
+from schedule_app.sse import with_live_updates  # noqa: E402
+
+application = with_live_updates(application)
@@ -0,0 +1,92 @@
+"""
+Чтение отчетов с реплики и настройка соединений SQLite.
+
+Страницы расписания и выгрузки (views.py) помечаются replica_reads: пока они выполняются, включая
+отдачу потокового ответа, ReplicaRouter отправляет чтения на базу DATABASE_REPLICA (см. settings.py),
+а запись всегда идет в основную. Без реплики все запросы идут в основную базу. Данные, которые кэшируются
+дольше запроса (волонтерская матрица, см. matrix_cache.py), читаются из основной базы внутри primary_reads:
+отстающая реплика сохранила бы в кэше устаревшую копию.
+
+При открытии соединения SQLite переключается в режим WAL: читатели не блокируют запись и наоборот,
+поэтому сохранение в админке не ждет, пока строится отчет. Соединение с репликой открывается только для чтения
+"""
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import wraps
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+
+reading_replica = ContextVar('reading_replica', default=False)
+
+
+def on_replica(iterator):
+    """
+    Потоковый ответ читается уже после выхода из view, поэтому признак ставится на каждый фрагмент
+    """
+    iterator = iter(iterator)
+    while True:
+        token = reading_replica.set(True)
+        try:
+            chunk = next(iterator)
+        except StopIteration:
+            return
+        finally:
+            reading_replica.reset(token)
+        yield chunk
+
+
+def replica_reads(view):
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        token = reading_replica.set(True)
+        try:
+            response = view(request, *args, **kwargs)
+        finally:
+            reading_replica.reset(token)
+        if response.streaming:
+            response.streaming_content = on_replica(response.streaming_content)
+        return response
+
+    return wrapper
+
+
+@contextmanager
+def primary_reads():
+    token = reading_replica.set(False)
+    try:
+        yield
+    finally:
+        reading_replica.reset(token)
+
+
+class ReplicaRouter:
+    def db_for_read(self, model, **hints):
+        if settings.DATABASE_REPLICA and reading_replica.get():
+            return settings.DATABASE_REPLICA
+        return None
+
+    def db_for_write(self, model, **hints):
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # реплика - копия основной базы
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db != settings.DATABASE_REPLICA
+
+
+@receiver(connection_created)
+def configure_sqlite(sender, connection, **kwargs):
+    if connection.vendor != 'sqlite' or connection.is_in_memory_db():
+        return
+    with connection.cursor() as cursor:
+        if connection.alias == settings.DATABASE_REPLICA:
+            cursor.execute('PRAGMA query_only = ON')
+        elif settings.DATABASE_WAL:
+            # режим WAL хранится в файле базы, synchronous - настройка соединения
+            cursor.execute('PRAGMA journal_mode = WAL')
+            cursor.execute('PRAGMA synchronous = NORMAL')
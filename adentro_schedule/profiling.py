@@ -0,0 +1,212 @@
+"""
+Профилирование запросов, включается переменной окружения PROFILING=1 (см. settings.py).
+
+ProfilingMiddleware замеряет для каждого запроса время целиком, время и число SQL-запросов,
+повторяющиеся запросы (одинаковый SQL без учета параметров - признак N+1) и время рендеринга шаблонов.
+Замеры отдаются в заголовке Server-Timing и копятся в памяти процесса по имени URL: последние
+PROFILING_WINDOW запросов каждого имени. Сводка с p50/p95/p99 - на странице profiling_stats.
+
+Запросы к базе перехватываются execute_wrapper соединения, данные текущего запроса лежат в contextvar,
+поэтому учитываются и запросы из пула потоков асинхронных страниц (sync_to_async копирует контекст).
+Обертка ставится при открытии соединения и на соединения потока, обрабатывающего запрос
+"""
+import asyncio
+import threading
+import time
+from collections import Counter, defaultdict, deque
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.contrib.admin.views.decorators import staff_member_required
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.http import Http404, JsonResponse
+
+current = ContextVar('profiling_recorder', default=None)
+
+PERCENTILES = (50, 95, 99)
+
+
+class Recorder:
+    """
+    Замеры одного запроса. Время - в секундах
+    """
+    __slots__ = ('started', 'queries', 'db_time', 'template_time', 'template_depth', 'statements')
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.queries = 0
+        self.db_time = 0.0
+        self.template_time = 0.0
+        self.template_depth = 0
+        self.statements = Counter()
+
+    def add_query(self, sql, elapsed):
+        self.queries += 1
+        self.db_time += elapsed
+        self.statements[sql] += 1
+
+    @property
+    def duplicates(self):
+        return sum(count - 1 for count in self.statements.values() if count > 1)
+
+    def top_duplicate(self):
+        sql, count = self.statements.most_common(1)[0] if self.statements else (None, 0)
+        return (sql, count) if count > 1 else (None, 0)
+
+
+def record_query(execute, sql, params, many, context):
+    recorder = current.get()
+    if recorder is None:
+        return execute(sql, params, many, context)
+
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        recorder.add_query(sql, time.perf_counter() - started)
+
+
+def install_wrapper(connection, **kwargs):
+    if record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(record_query)
+
+
+def instrument_templates():
+    """
+    Замер рендеринга шаблонов верхнего уровня; время запросов к базе из шаблона в него не входит
+    """
+    from django.template.base import Template
+
+    if getattr(Template.render, 'profiled', False):
+        return
+    original = Template.render
+
+    def render(self, context):
+        recorder = current.get()
+        if recorder is None or recorder.template_depth:
+            return original(self, context)
+
+        recorder.template_depth += 1
+        db_time = recorder.db_time
+        started = time.perf_counter()
+        try:
+            return original(self, context)
+        finally:
+            recorder.template_time += time.perf_counter() - started - (recorder.db_time - db_time)
+            recorder.template_depth -= 1
+
+    render.profiled = True
+    Template.render = render
+
+
+class Stats:
+    """
+    Скользящее окно замеров по имени URL
+    """
+
+    def __init__(self, window):
+        self.lock = threading.Lock()
+        self.samples = defaultdict(lambda: deque(maxlen=window))
+        self.duplicates = {}
+
+    def add(self, name, recorder, total):
+        sample = (total, recorder.db_time, recorder.template_time, recorder.queries, recorder.duplicates)
+        sql, count = recorder.top_duplicate()
+        with self.lock:
+            self.samples[name].append(sample)
+            if sql is not None and count >= self.duplicates.get(name, (None, 0))[1]:
+                self.duplicates[name] = (sql, count)
+
+    def clear(self):
+        with self.lock:
+            self.samples.clear()
+            self.duplicates.clear()
+
+    def summary(self):
+        with self.lock:
+            samples = {name: list(values) for name, values in self.samples.items()}
+            duplicates = dict(self.duplicates)
+
+        result = {}
+        for name, values in sorted(samples.items()):
+            totals = sorted(value[0] for value in values)
+            count = len(values)
+            result[name] = {
+                'count': count,
+                **{f'p{p}_ms': totals[min(count - 1, count * p // 100)] * 1000 for p in PERCENTILES},
+                'db_ms': sum(value[1] for value in values) / count * 1000,
+                'template_ms': sum(value[2] for value in values) / count * 1000,
+                'queries': sum(value[3] for value in values) / count,
+                'max_duplicates': max(value[4] for value in values),
+                'worst_duplicate': dict(zip(('sql', 'count'), duplicates[name])) if name in duplicates else None,
+            }
+        return result
+
+
+stats = Stats(getattr(settings, 'PROFILING_WINDOW', 1000))
+
+
+def server_timing(recorder, total):
+    app = max(0.0, total - recorder.db_time - recorder.template_time)
+    return ', '.join([f'total;dur={total * 1000:.1f}',
+                      f'db;dur={recorder.db_time * 1000:.1f};desc="{recorder.queries} queries / '
+                      f'{recorder.duplicates} duplicates"',
+                      f'tpl;dur={recorder.template_time * 1000:.1f}',
+                      f'app;dur={app * 1000:.1f}'])
+
+
+class ProfilingMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.is_async = asyncio.iscoroutinefunction(get_response)
+        if self.is_async:
+            # Django 3.2 определяет асинхронный middleware по этому признаку
+            self._is_coroutine = asyncio.coroutines._is_coroutine
+
+        connection_created.connect(install_wrapper, dispatch_uid='profiling_install_wrapper')
+        instrument_templates()
+
+    def start(self):
+        for connection in connections.all():
+            install_wrapper(connection)
+        recorder = Recorder()
+        return recorder, current.set(recorder)
+
+    def finish(self, request, response, recorder):
+        total = time.perf_counter() - recorder.started
+        response['Server-Timing'] = server_timing(recorder, total)
+
+        match = request.resolver_match
+        if match is not None and match.url_name:
+            stats.add(match.view_name, recorder, total)
+        return response
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+
+        recorder, token = self.start()
+        try:
+            response = self.get_response(request)
+        finally:
+            current.reset(token)
+        return self.finish(request, response, recorder)
+
+    async def __acall__(self, request):
+        recorder, token = self.start()
+        try:
+            response = await self.get_response(request)
+        finally:
+            current.reset(token)
+        return self.finish(request, response, recorder)
+
+
+@staff_member_required
+def stats_view(request):
+    if not settings.PROFILING:
+        raise Http404
+    return JsonResponse(stats.summary())
@@ -57,6 +57,15 @@ MIDDLEWARE = [
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
 
+# PROFILING=1 включает замеры запросов: заголовок Server-Timing и сводка по URL (adentro_schedule/profiling.py),
+# PROFILING_WINDOW - сколько последних запросов каждого URL учитывается в сводке
+
+PROFILING = os.getenv('PROFILING') == '1'
+PROFILING_WINDOW = int(os.getenv('PROFILING_WINDOW', 1000))
+
+if PROFILING:
+    MIDDLEWARE.insert(0, 'adentro_schedule.profiling.ProfilingMiddleware')
+
 ROOT_URLCONF = 'adentro_schedule.urls'
 
 TEMPLATES = [
@@ -82,13 +91,70 @@ WSGI_APPLICATION = 'adentro_schedule.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/3.2/ref/settings/#databases
 
+# DATABASE_CONN_MAX_AGE - сколько секунд соединение живет между запросами (0 - закрывается после каждого),
+# DATABASE_TIMEOUT - сколько секунд ждать снятия блокировки записи SQLite,
+# DATABASE_WAL=0 отключает режим WAL. DATABASE_REPLICA_NAME - файл реплики, с которой читают страницы
+# расписания и выгрузки (adentro_schedule/db.py); копию поддерживает внешний инструмент репликации
+
+DATABASE_CONN_MAX_AGE = int(os.getenv('DATABASE_CONN_MAX_AGE', 60))
+DATABASE_TIMEOUT = int(os.getenv('DATABASE_TIMEOUT', 20))
+DATABASE_WAL = os.getenv('DATABASE_WAL', '1') == '1'
+DATABASE_REPLICA = None
+
 DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
+        'NAME': os.getenv('DATABASE_NAME', BASE_DIR / 'db.sqlite3'),
+        'CONN_MAX_AGE': DATABASE_CONN_MAX_AGE,
+        'OPTIONS': {'timeout': DATABASE_TIMEOUT},
     }
 }
 
+if os.getenv('DATABASE_REPLICA_NAME'):
+    DATABASE_REPLICA = 'replica'
+    DATABASES[DATABASE_REPLICA] = {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': os.getenv('DATABASE_REPLICA_NAME'),
+        'CONN_MAX_AGE': DATABASE_CONN_MAX_AGE,
+        'OPTIONS': {'timeout': DATABASE_TIMEOUT},
+        'TEST': {'MIRROR': 'default'},
+    }
+
+DATABASE_ROUTERS = ['adentro_schedule.db.ReplicaRouter']
+
+
+# Cache
+# https://docs.djangoproject.com/en/3.2/topics/cache/
+# locmem живет внутри процесса: при нескольких воркерах задайте CACHE_DIR, чтобы кэш был общим
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    }
+}
+
+if os.getenv('CACHE_DIR'):
+    CACHES['default'] = {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': os.getenv('CACHE_DIR'),
+    }
+
+
+# Async views
+# ASYNC_VIEWS включается в asgi.py; ASYNC_ORM_CONCURRENCY ограничивает одновременные обращения к базе,
+# ASYNC_SPOOL_MAX_SIZE - размер архива выгрузки, который держится в памяти до сброса во временный файл
+
+ASYNC_VIEWS = os.getenv('ASYNC_VIEWS') == '1'
+ASYNC_ORM_CONCURRENCY = int(os.getenv('ASYNC_ORM_CONCURRENCY', 8))
+ASYNC_SPOOL_MAX_SIZE = 8 * 1024 * 1024
+
+
+# Live updates
+# Брокер публикации изменений расписаний для server-sent events (schedule_app/live.py).
+# LocalBroker работает внутри одного процесса ASGI-сервера
+
+LIVE_BROKER = os.getenv('LIVE_BROKER', 'schedule_app.live.LocalBroker')
+
 
 # Password validation
 # https://docs.djangoproject.com/en/3.2/ref/settings/#auth-password-validators
@@ -16,7 +16,10 @@ Including another URLconf
 from django.contrib import admin
 from django.urls import path, include
 
+from adentro_schedule import profiling
+
 urlpatterns = [
     path('admin/', admin.site.urls),
+    path('_profiling/stats', profiling.stats_view, name='profiling_stats'),
     path('', include('schedule_app.urls')),
 ]
@@ -0,0 +1,22 @@
+"""
+Бенчмарки горячих путей приложения. Запуск: python -m benchmarks.<модуль>
+Данные генерирует benchmarks.fixtures, сводный прогон всех путей - benchmarks.hot_paths
+"""
+import os
+
+
+def setup_django(database=':memory:'):
+    """
+    Настройка Django на отдельной базе SQLite со схемой, созданной по моделям
+    """
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'adentro_schedule.settings')
+    os.environ.setdefault('SECRET_KEY', 'benchmark')
+
+    import django
+    from django.conf import settings
+
+    settings.DATABASES['default']['NAME'] = database
+    django.setup()
+
+    from django.core.management import call_command
+    call_command('migrate', run_syncdb=True, verbosity=0)
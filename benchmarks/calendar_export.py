@@ -0,0 +1,87 @@
+"""
+Сравнение выгрузки в формат Google Calendar: stdlib-сериализатор против прежнего пути через pandas.
+Измеряются время импорта и прирост RSS процесса, пиковая память и скорость формирования CSV.
+Выводы обоих путей сверяются побайтно.
+
+python -m benchmarks.calendar_export [количество строк]
+"""
+import datetime
+import json
+import subprocess
+import sys
+import time
+import tracemalloc
+from types import SimpleNamespace
+
+from schedule_app import serializers
+
+# ru_maxrss наследуется дочерним процессом от родителя, поэтому RSS читается из /proc (Linux)
+IMPORT_PROBE = """
+import resource, time
+def rss_kb():
+    with open('/proc/self/statm') as statm:
+        return int(statm.read().split()[1]) * resource.getpagesize() // 1024
+before = rss_kb()
+started = time.perf_counter()
+import {module}
+elapsed = time.perf_counter() - started
+print(elapsed, rss_kb() - before)
+"""
+
+
+def make_activities(count):
+    start = datetime.datetime(2022, 5, 1, 9, 0, 0)
+    for i in range(count):
+        activity = SimpleNamespace(name=f'Активность {i}', description=None if i % 3 else f'Описание, "{i}"')
+        start_dt = start + datetime.timedelta(minutes=30 * i)
+        yield SimpleNamespace(pk=i, activity=activity, start_dt=start_dt,
+                              end_dt=start_dt + datetime.timedelta(hours=1))
+
+
+def pandas_csv(activities):
+    import pandas as pd
+
+    data = [dict(zip(serializers.GOOGLE_CALENDAR_HEADER, serializers.google_calendar_row(activity)))
+            for activity in activities]
+    return pd.DataFrame(data, dtype=str).to_csv(index=False, header=True)
+
+
+def measure_import(module):
+    output = subprocess.run([sys.executable, '-c', IMPORT_PROBE.format(module=module)],
+                            capture_output=True, text=True, check=True).stdout.split()
+    return {'import_seconds': float(output[0]), 'import_rss_kb': int(output[1])}
+
+
+def measure_run(func, activities):
+    func(activities[:10])
+
+    tracemalloc.start()
+    started = time.perf_counter()
+    output = func(activities)
+    elapsed = time.perf_counter() - started
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return output, {'seconds': elapsed, 'rows_per_second': len(activities) / elapsed, 'peak_bytes': peak}
+
+
+def main(count=10000):
+    activities = list(make_activities(count))
+    results = {'rows': count}
+
+    stdlib_output, results['stdlib'] = measure_run(serializers.google_calendar_csv, activities)
+    results['stdlib'].update(measure_import('schedule_app.serializers'))
+
+    try:
+        pandas_output, results['pandas'] = measure_run(pandas_csv, activities)
+    except ImportError:
+        results['pandas'] = None
+    else:
+        results['pandas'].update(measure_import('pandas'))
+        results['identical_output'] = pandas_output == stdlib_output
+
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    main(*map(int, sys.argv[1:]))
@@ -0,0 +1,128 @@
+"""
+Одновременные назначения: несколько потоков-координаторов назначают одних и тех же людей
+на пересекающиеся активности в файловой базе SQLite.
+
+Режим assign - проверка и запись через schedule_app.assignment.assign (одна транзакция с блокировкой людей),
+режим unlocked - как раньше: проверка, затем сохранение без общей транзакции.
+Считаются успешные назначения, отказы проверки, ошибки блокировки, двойные бронирования
+после прогона и пропускная способность.
+
+python -m benchmarks.concurrent_assign [--writers N] [--attempts N] [--persons N] [--mode assign|unlocked]
+"""
+import argparse
+import datetime
+import json
+import os
+import random
+import tempfile
+import threading
+import time
+
+from benchmarks import setup_django
+from benchmarks.fixtures import START, generate
+
+DAY_START = START + datetime.timedelta(days=1)
+DURATIONS = (30, 60, 90)
+
+
+def unlocked(row, person_pks):
+    from schedule_app import models
+    from schedule_app.validation import AssignmentValidator
+
+    persons = list(models.Person.objects.filter(pk__in=person_pks))
+    AssignmentValidator(row.event, row.activity, row.start_dt, row.end_dt, instance=row).validate(persons)
+    row.save()
+    row.person.set(persons)
+
+
+def writer(event, activities, person_pks, attempts, seed, mode, results):
+    from django.core.exceptions import ValidationError
+    from django.db import OperationalError, connection
+    import schedule_app.assignment as assignment
+    from schedule_app import models
+
+    rnd = random.Random(seed)
+    counts = {'assigned': 0, 'rejected': 0, 'locked': 0}
+    for _ in range(attempts):
+        start_dt = DAY_START + datetime.timedelta(minutes=30 * rnd.randrange(16))
+        row = models.ActivityOnEvent(event=event, activity=rnd.choice(activities), start_dt=start_dt,
+                                     end_dt=start_dt + datetime.timedelta(minutes=rnd.choice(DURATIONS)))
+        persons = rnd.sample(person_pks, 2)
+        try:
+            if mode == 'assign':
+                assignment.assign(row, persons)
+            else:
+                unlocked(row, persons)
+        except ValidationError:
+            counts['rejected'] += 1
+        except OperationalError:
+            counts['locked'] += 1
+        else:
+            counts['assigned'] += 1
+    connection.close()
+    results.append(counts)
+
+
+def double_bookings(event):
+    from schedule_app import models
+    from schedule_app.intervals import conflicts
+
+    owners, starts, ends = [], [], []
+    for person_pk, start_dt, end_dt in models.ActivityOnEvent.person.through.objects \
+            .filter(activityonevent__event=event) \
+            .values_list('person_id', 'activityonevent__start_dt', 'activityonevent__end_dt'):
+        owners.append(person_pk)
+        starts.append(start_dt)
+        ends.append(end_dt)
+    return sum(len(pairs) for pairs in conflicts(starts, ends, owners).values())
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Одновременные назначения людей на активности')
+    parser.add_argument('--writers', type=int, default=8)
+    parser.add_argument('--attempts', type=int, default=50)
+    parser.add_argument('--persons', type=int, default=6)
+    parser.add_argument('--mode', choices=('assign', 'unlocked'), default='assign')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        setup_django(os.path.join(directory, 'concurrent.sqlite3'))
+        import schedule_app.constants as const
+        from django.db import connections
+        from schedule_app import models
+
+        # ожидание блокировки записи вместо ошибки при очереди писателей
+        connections.databases['default']['OPTIONS']['timeout'] = 30
+
+        event = generate(persons=args.persons, slots=10, fill_rate=0, exclusion_rate=0, volunteer_share=1.0,
+                         seed=args.seed)
+        models.Person.objects.update(free_time_limit=datetime.timedelta(days=1))
+        activities = list(models.Activity.objects.filter(category__activity_type__name=const.VOLUNTEER))
+        person_pks = list(event.get_roster().values_list('pk', flat=True))
+        connections.close_all()
+
+        results = []
+        threads = [threading.Thread(target=writer, args=(event, activities, person_pks, args.attempts,
+                                                         args.seed + i, args.mode, results))
+                   for i in range(args.writers)]
+        started = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - started
+
+        totals = {key: sum(counts[key] for counts in results) for key in ('assigned', 'rejected', 'locked')}
+        print(json.dumps({'mode': args.mode,
+                          'writers': args.writers,
+                          'attempts': args.writers * args.attempts,
+                          **totals,
+                          'seconds': elapsed,
+                          'attempts_per_second': args.writers * args.attempts / elapsed,
+                          'double_bookings': double_bookings(event)}, indent=2))
+        connections.close_all()
+
+
+if __name__ == '__main__':
+    main()
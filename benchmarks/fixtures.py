@@ -0,0 +1,89 @@
+"""
+Детерминированный генератор данных для бенчмарков: мероприятие, люди, категории, активности и расписание.
+При одинаковых параметрах и seed база получается одной и той же, поэтому результаты
+можно сравнивать между коммитами.
+
+Параметры:
+    persons - количество людей (все приезжают на мероприятие, см. Event.get_roster)
+    slots - количество активностей в расписании
+    overlap - плотность пересечений: среднее число активностей, идущих одновременно.
+              Определяет длину мероприятия
+    exclusion_rate - доля людей, исключивших одну из волонтерских категорий
+    fill_rate - доля мест на волонтерских активностях, занятых при генерации (без проверки правил)
+    volunteer_share - доля волонтерских активностей, остальные делятся между официальным и прочим расписанием
+"""
+import datetime
+import math
+import random
+
+START = datetime.datetime(2022, 5, 1, 8, 0, 0)
+DURATIONS = (60, 90, 120)
+STEP_MINUTES = 30
+
+
+def generate(persons=300, slots=1000, overlap=4.0, exclusion_rate=0.3, fill_rate=0.5, volunteer_share=0.8,
+             seed=0, start=START, title='Бенчмарк'):
+    import schedule_app.constants as const
+    import schedule_app.workload as workload
+    from schedule_app import models
+
+    rnd = random.Random(seed)
+
+    span = slots * sum(DURATIONS) / len(DURATIONS) / overlap
+    days = max(1, math.ceil(span / (24 * 60)))
+    end = start + datetime.timedelta(days=days)
+    event = models.Event.objects.create(title=title, start_date=start.date(),
+                                        end_date=start.date() + datetime.timedelta(days=days - 1))
+
+    categories = {}
+    for name, _ in const.ACTIVITY_TYPE_CHOICES:
+        activity_type, _ = models.ActivityType.objects.get_or_create(name=name)
+        count = 8 if name == const.VOLUNTEER else 2
+        categories[name] = [models.Category.objects.create(name=f'{title}: категория {i}',
+                                                           activity_type=activity_type,
+                                                           time_coefficient=rnd.choice(['1.0', '1.2', '1.5']))
+                            for i in range(count)]
+    activities = {name: [models.Activity.objects.create(name=f'{title}: активность {i}',
+                                                        category=rnd.choice(type_categories),
+                                                        need_peoples=rnd.randint(1, 3))
+                         for i in range(40 if name == const.VOLUNTEER else 10)]
+                  for name, type_categories in categories.items()}
+
+    first_pk = models.Person.objects.order_by('-pk').values_list('pk', flat=True).first() or 0
+    models.Person.objects.bulk_create(
+        models.Person(first_name=f'Имя{i}', last_name=f'Фамилия{i}', night_man=rnd.random() < 0.2,
+                      free_time_limit=datetime.timedelta(hours=rnd.choice([6, 8, 10, 12])),
+                      arrival_datetime=start + datetime.timedelta(hours=rnd.randint(0, 12)),
+                      departure_datetime=end - datetime.timedelta(hours=rnd.randint(0, 12)))
+        for i in range(persons))
+    person_pks = list(models.Person.objects.filter(pk__gt=first_pk).order_by('pk').values_list('pk', flat=True))
+
+    through = models.Person.excluded_categories.through
+    through.objects.bulk_create(through(person_id=person_pk, category_id=rnd.choice(categories[const.VOLUNTEER]).pk)
+                                for person_pk in person_pks if rnd.random() < exclusion_rate)
+
+    steps = max(1, int(span) // STEP_MINUTES)
+    other_types = [name for name in categories if name != const.VOLUNTEER]
+    rows = []
+    for _ in range(slots):
+        activity_type = const.VOLUNTEER if rnd.random() < volunteer_share else rnd.choice(other_types)
+        activity = rnd.choice(activities[activity_type])
+        start_dt = start + datetime.timedelta(minutes=STEP_MINUTES * rnd.randrange(steps))
+        end_dt = start_dt + datetime.timedelta(minutes=rnd.choice(DURATIONS))
+        rows.append(models.ActivityOnEvent(event=event, activity=activity, activity_type_name=activity_type,
+                                           accounted_duration=activity.category.accounted_duration(end_dt - start_dt),
+                                           start_dt=start_dt, end_dt=end_dt))
+    models.ActivityOnEvent.objects.bulk_create(rows)
+
+    through = models.ActivityOnEvent.person.through
+    assignments = []
+    for row in models.ActivityOnEvent.objects.filter(event=event).select_related('activity').order_by('pk'):
+        need = row.activity.need_peoples or 0
+        count = round(need * fill_rate) if row.activity_type_name == const.VOLUNTEER else rnd.randint(0, 2)
+        assignments += [through(activityonevent_id=row.pk, person_id=person_pk)
+                        for person_pk in rnd.sample(person_pks, min(count, len(person_pks)))]
+    through.objects.bulk_create(assignments)
+
+    # bulk_create не отправляет сигналы, хранимая нагрузка считается здесь
+    workload.recompute([event.pk])
+    return event
@@ -0,0 +1,213 @@
+"""
+Горячие пути приложения на данных из benchmarks.fixtures: страницы расписания, JSON-окно матрицы и покрытие,
+выгрузки, список и форма ActivityOnEvent в админке, сохранение ActivityOnEventForm, utils.is_intersects
+и подбор свободных людей (finder.py).
+
+Для каждого пути записываются число запросов к базе, время (медиана и минимум по повторам)
+и пиковая память по tracemalloc. Кэш очищается перед каждым повтором, кроме путей с суффиксом _warm.
+Результат - JSON, который можно сравнивать между коммитами.
+
+python -m benchmarks.hot_paths [--persons N] [--slots N] [--overlap X] [--exclusion-rate X]
+                               [--repeat N] [--output файл.json]
+"""
+import argparse
+import datetime
+import json
+import statistics
+import subprocess
+import time
+import tracemalloc
+
+from benchmarks import setup_django
+from benchmarks.fixtures import generate
+
+INTERSECTS_PAIRS = 20000
+
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def measure(func, repeat, cold=True):
+    """
+    Первый прогон - под tracemalloc и с подсчетом запросов, затем repeat прогонов только на время
+    """
+    from django.core.cache import cache
+    from django.db import connection, reset_queries
+    from django.test.utils import CaptureQueriesContext
+
+    if cold:
+        cache.clear()
+    # журнал запросов ограничен по длине, после генерации данных он заполнен
+    reset_queries()
+    tracemalloc.start()
+    with CaptureQueriesContext(connection) as context:
+        func()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    timings = []
+    for _ in range(repeat):
+        if cold:
+            cache.clear()
+        started = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - started)
+
+    return {'queries': len(context.captured_queries),
+            'seconds': statistics.median(timings),
+            'min_seconds': min(timings),
+            'peak_bytes': peak}
+
+
+def get(client, url, params=None):
+    def func():
+        response = client.get(url, params or {})
+        assert response.status_code == 200, (url, response.status_code)
+        if response.streaming:
+            b''.join(response.streaming_content)
+    return func
+
+
+def form_save(event):
+    """
+    Проверка и сохранение новой активности через форму админки; изменения откатываются
+    """
+    import schedule_app.constants as const
+    import schedule_app.workload as workload
+    from django.db import transaction
+    from schedule_app import forms, models
+
+    activity = models.Activity.objects.filter(category__activity_type__name=const.VOLUNTEER) \
+        .select_related('category').first()
+    excluded = set(models.Person.excluded_categories.through.objects.filter(category=activity.category)
+                   .values_list('person_id', flat=True))
+    totals = workload.get_totals(event.pk)
+    persons = sorted((person for person in event.get_roster() if person.pk not in excluded),
+                     key=lambda person: (totals.get(person.pk, datetime.timedelta(0)), person.pk))[:3]
+
+    last_end = models.ActivityOnEvent.objects.filter(event=event).order_by('-end_dt')[0].end_dt
+    data = {'event': event.pk, 'activity': activity.pk, 'person': [person.pk for person in persons],
+            'start_dt': last_end, 'end_dt': last_end + datetime.timedelta(hours=1)}
+
+    def func():
+        with transaction.atomic():
+            form = forms.ActivityOnEventForm(data=data)
+            assert form.is_valid(), form.errors
+            form.save()
+            transaction.set_rollback(True)
+    return func
+
+
+def intersects(event):
+    from schedule_app import models
+    from schedule_app.utils import is_intersects
+
+    slots = list(models.ActivityOnEvent.objects.filter(event=event).order_by('start_dt')[:1000])
+    pairs = [(slots[i % len(slots)], slots[(i * 7 + 1) % len(slots)]) for i in range(INTERSECTS_PAIRS)]
+
+    def func():
+        for checked, other in pairs:
+            is_intersects(checked.start_dt, checked.end_dt, other, checked)
+    return func
+
+
+def admin_candidates(client, event):
+    from django.urls import reverse
+    import schedule_app.constants as const
+    from schedule_app import models
+
+    row = models.ActivityOnEvent.objects.filter(event=event, activity_type_name=const.VOLUNTEER).order_by('pk').first()
+    params = {'event': event.pk, 'activity': row.activity_id, 'object': row.pk,
+              'start_dt_0': row.start_dt.strftime('%d.%m.%Y'), 'start_dt_1': row.start_dt.strftime('%H:%M'),
+              'end_dt_0': row.end_dt.strftime('%d.%m.%Y'), 'end_dt_1': row.end_dt.strftime('%H:%M')}
+    return get(client, reverse('admin:schedule_app_activityonevent_candidates'), params)
+
+
+def free_windows(event, person):
+    from schedule_app.finder import FreeSlotFinder
+
+    def func():
+        FreeSlotFinder.for_event(event).free_windows(person.pk)
+    return func
+
+
+def cases(event, client):
+    from django.urls import reverse
+
+    person = event.get_roster().filter(activityonevent__event=event).first()
+    volunteer_url = reverse('volunteer_schedule', args=(event.pk,))
+    data_url = reverse('volunteer_schedule_data', args=(event.pk,))
+    person_url = reverse('download_person_schedule', args=(event.pk, person.pk))
+    first_day = datetime.datetime.combine(event.start_date, datetime.time.min)
+
+    return {
+        'events': (get(client, reverse('events')), True),
+        'volunteer_schedule': (get(client, volunteer_url), True),
+        'volunteer_schedule_warm': (get(client, volunteer_url), False),
+        'volunteer_schedule_data': (get(client, data_url, {'start': first_day.isoformat(),
+                                                           'end': (first_day + datetime.timedelta(days=1))
+                                                           .isoformat()}), True),
+        'volunteer_schedule_data_warm': (get(client, data_url, {'offset': 50}), False),
+        'coverage': (get(client, reverse('coverage', args=(event.pk,)), {'format': 'json'}), True),
+        'official_schedule': (get(client, reverse('official_schedule', args=(event.pk,))), True),
+        'other_schedule': (get(client, reverse('other_schedule', args=(event.pk,))), True),
+        'person': (get(client, reverse('person', args=(event.pk, person.pk))), True),
+        'download_all': (get(client, reverse('download', args=(event.pk,))), True),
+        'download_person': (get(client, person_url), True),
+        'download_person_ics': (get(client, person_url, {'format': 'ics'}), True),
+        'activity_on_event_form_save': (form_save(event), True),
+        'is_intersects': (intersects(event), True),
+        'admin_changelist': (get(client, reverse('admin:schedule_app_activityonevent_changelist')), True),
+        'admin_changelist_filtered': (get(client, reverse('admin:schedule_app_activityonevent_changelist'),
+                                          {'event__id__exact': event.pk, 'person': person.pk}), True),
+        'admin_change_form': (get(client, reverse('admin:schedule_app_activityonevent_change',
+                                                  args=(event.activityonevent_set.earliest('pk').pk,))), True),
+        'admin_candidates': (admin_candidates(client, event), True),
+        'admin_candidates_warm': (admin_candidates(client, event), False),
+        'free_windows_warm': (free_windows(event, person), False),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Бенчмарк горячих путей')
+    parser.add_argument('--persons', type=int, default=300)
+    parser.add_argument('--slots', type=int, default=1000)
+    parser.add_argument('--overlap', type=float, default=4.0)
+    parser.add_argument('--exclusion-rate', type=float, default=0.3)
+    parser.add_argument('--fill-rate', type=float, default=0.5)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--output', help='файл для JSON, по умолчанию - stdout')
+    args = parser.parse_args()
+
+    setup_django()
+    from django.contrib.auth.models import User
+    from django.test import Client
+    from django.test.utils import setup_test_environment
+
+    setup_test_environment()
+    event = generate(persons=args.persons, slots=args.slots, overlap=args.overlap,
+                     exclusion_rate=args.exclusion_rate, fill_rate=args.fill_rate, seed=args.seed)
+    client = Client()
+    client.force_login(User.objects.create_superuser('admin', 'admin@example.com', 'admin'))
+
+    paths = cases(event, client)
+    results = {'revision': git_revision(),
+               'params': dict(vars(args), output=None),
+               'paths': {name: measure(func, args.repeat, cold) for name, (func, cold) in paths.items()}}
+
+    output = json.dumps(results, indent=2, default=str)
+    if args.output:
+        with open(args.output, 'w') as file:
+            file.write(output)
+    else:
+        print(output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,76 @@
+"""
+Проверка пересечений: прежний utils.is_intersects (namedtuple на каждый вызов, минуты по модулю 60)
+против intervals.overlaps и пакетного intervals.overlapping_pairs.
+
+Все пары активностей сгенерированного расписания проверяются попарно каждой скалярной функцией
+и одним вызовом пакетной. Дополнительно считаются пары, в которых прежняя функция ошибается.
+
+python -m benchmarks.intervals [активностей]
+"""
+import json
+import sys
+import time
+from collections import namedtuple
+
+from benchmarks import setup_django
+from benchmarks.fixtures import generate
+
+
+def legacy_is_intersects(start_dt, end_dt, activity, checked_activity):
+    Range = namedtuple('Range', ['start', 'end'])
+
+    r1 = Range(start=start_dt, end=end_dt)
+    r2 = Range(start=activity.start_dt, end=activity.end_dt)
+    if r1.start > r2.end or r1.end < r2.start:
+        return False
+
+    latest_start = max(r1.start, r2.start)
+    earliest_end = min(r1.end, r2.end)
+    delta = ((earliest_end - latest_start).total_seconds() // 60) % 60
+
+    overlap = max(0, delta)
+    if overlap > 0 and checked_activity != activity and checked_activity.pk != activity.pk:
+        return True
+    return False
+
+
+def timed(func):
+    started = time.perf_counter()
+    result = func()
+    return result, time.perf_counter() - started
+
+
+def main(slots=1000):
+    setup_django()
+    from schedule_app import intervals, models
+    from schedule_app.availability import load_slots
+
+    event = generate(persons=10, slots=slots, fill_rate=0)
+    rows = sorted(load_slots(event.pk), key=lambda slot: slot.pk)
+    pairs = [(i, j) for i in range(len(rows)) for j in range(i + 1, len(rows))]
+    checked = models.ActivityOnEvent(pk=0)
+
+    legacy, legacy_seconds = timed(lambda: {(i, j) for i, j in pairs
+                                            if legacy_is_intersects(rows[i].start_dt, rows[i].end_dt, rows[j],
+                                                                    checked)})
+    scalar, scalar_seconds = timed(lambda: {(i, j) for i, j in pairs
+                                            if intervals.overlaps(rows[i].start_dt, rows[i].end_dt,
+                                                                  rows[j].start_dt, rows[j].end_dt)})
+    batch, batch_seconds = timed(lambda: set(intervals.overlapping_pairs([row.start_dt for row in rows],
+                                                                         [row.end_dt for row in rows])))
+
+    print(json.dumps({'slots': len(rows),
+                      'pairs_checked': len(pairs),
+                      'overlapping_pairs': len(scalar),
+                      'legacy_seconds': legacy_seconds,
+                      'scalar_seconds': scalar_seconds,
+                      'batch_seconds': batch_seconds,
+                      'scalar_speedup': legacy_seconds / scalar_seconds,
+                      'batch_speedup': legacy_seconds / batch_seconds,
+                      'legacy_missed': len(scalar - legacy),
+                      'legacy_false': len(legacy - scalar),
+                      'batch_equal': batch == scalar}, indent=2))
+
+
+if __name__ == '__main__':
+    main(*map(int, sys.argv[1:]))
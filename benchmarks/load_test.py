@@ -0,0 +1,141 @@
+"""
+Нагрузочный тест страниц расписания: WSGI (manage.py runserver) против ASGI (uvicorn, если установлен).
+
+Поднимает локальный сервер на заполненной временной базе и обстреливает его асинхронным клиентом
+с заданным числом одновременных соединений. Результат - запросы в секунду и перцентили задержки.
+
+python -m benchmarks.load_test [одновременных запросов] [секунд на сервер]
+"""
+import asyncio
+import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+from benchmarks import setup_django
+from benchmarks.fixtures import generate
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def prepare(database):
+    setup_django(database)
+    from django.contrib.auth.models import User
+    from django.contrib.sessions.backends.db import SessionStore
+
+    event = generate(persons=100, slots=300)
+
+    user = User.objects.create_superuser('admin', 'admin@example.com', 'admin')
+    session = SessionStore()
+    session['_auth_user_id'] = str(user.pk)
+    session['_auth_user_backend'] = 'django.contrib.auth.backends.ModelBackend'
+    session['_auth_user_hash'] = user.get_session_auth_hash()
+    session.create()
+
+    person_pks = list(event.get_schedule().values_list('person', flat=True).distinct().exclude(person=None))
+    paths = [f'/{event.pk}/{person_pk}' for person_pk in person_pks[:20]]
+    paths += [f'/{event.pk}/official_schedule', f'/{event.pk}/other_schedule']
+    return session.session_key, paths
+
+
+def server_commands(port):
+    commands = {'wsgi': [sys.executable, 'manage.py', 'runserver', f'127.0.0.1:{port}', '--noreload']}
+    try:
+        import uvicorn  # noqa: F401
+    except ImportError:
+        pass
+    else:
+        commands['asgi'] = [sys.executable, '-m', 'uvicorn', 'adentro_schedule.asgi:application',
+                            '--host', '127.0.0.1', '--port', str(port), '--log-level', 'warning']
+    return commands
+
+
+async def wait_for_port(port, timeout=20):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            _, writer = await asyncio.open_connection('127.0.0.1', port)
+        except OSError:
+            await asyncio.sleep(0.2)
+        else:
+            writer.close()
+            return
+    raise RuntimeError(f'Сервер на порту {port} не запустился')
+
+
+async def fetch(port, path, session_key):
+    reader, writer = await asyncio.open_connection('127.0.0.1', port)
+    writer.write(f'GET {path} HTTP/1.1\r\nHost: 127.0.0.1\r\nCookie: sessionid={session_key}\r\n'
+                 f'Connection: close\r\n\r\n'.encode())
+    await writer.drain()
+    status_line = await reader.readline()
+    await reader.read()
+    writer.close()
+    return int(status_line.split()[1])
+
+
+async def load(port, paths, session_key, concurrency, duration):
+    latencies = []
+    errors = 0
+    deadline = time.monotonic() + duration
+
+    async def worker(offset):
+        nonlocal errors
+        i = offset
+        while time.monotonic() < deadline:
+            started = time.perf_counter()
+            try:
+                status = await fetch(port, paths[i % len(paths)], session_key)
+            except OSError:
+                status = None
+            if status == 200:
+                latencies.append(time.perf_counter() - started)
+            else:
+                errors += 1
+            i += concurrency
+
+    started = time.monotonic()
+    await asyncio.gather(*(worker(i) for i in range(concurrency)))
+    elapsed = time.monotonic() - started
+
+    latencies.sort()
+
+    def percentile(p):
+        return latencies[min(len(latencies) - 1, int(len(latencies) * p))] if latencies else None
+
+    return {'requests': len(latencies), 'errors': errors, 'rps': len(latencies) / elapsed,
+            'p50': percentile(0.5), 'p99': percentile(0.99)}
+
+
+def main(concurrency=32, duration=10):
+    with tempfile.TemporaryDirectory() as directory:
+        database = os.path.join(directory, 'load_test.sqlite3')
+        session_key, paths = prepare(database)
+        env = dict(os.environ, DATABASE_NAME=database, SECRET_KEY='benchmark')
+
+        results = {'concurrency': concurrency, 'duration': duration}
+        port = free_port()
+        for name, command in server_commands(port).items():
+            server = subprocess.Popen(command, cwd=ROOT, env=env, stdout=subprocess.DEVNULL,
+                                      stderr=subprocess.DEVNULL)
+            try:
+                asyncio.run(wait_for_port(port))
+                results[name] = asyncio.run(load(port, paths, session_key, concurrency, duration))
+            finally:
+                server.terminate()
+                server.wait()
+
+        print(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    main(*map(int, sys.argv[1:]))
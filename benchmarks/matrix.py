@@ -0,0 +1,61 @@
+"""
+Сборка волонтерской матрицы: коды статусов в array('b') против списков строк с вызовом get_status на каждую ячейку.
+
+Сравниваются время заполнения всех столбцов и память, занятая статусами после сборки.
+
+python -m benchmarks.matrix [активностей] [людей]
+"""
+import json
+import sys
+import time
+import tracemalloc
+
+from benchmarks import setup_django
+from benchmarks.fixtures import generate
+
+
+def measure(fill, columns):
+    tracemalloc.start()
+    started = time.perf_counter()
+    statuses = [fill(slot, busy) for slot, busy in columns]
+    elapsed = time.perf_counter() - started
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {'seconds': elapsed, 'bytes': size, 'cells': sum(len(column) for column in statuses)}
+
+
+def main(slots=2000, persons=1000):
+    setup_django()
+    import schedule_app.constants as const
+    from schedule_app.availability import VolunteerMatrix, get_status
+
+    event = generate(persons=persons, slots=slots, overlap=16, volunteer_share=1.0)
+
+    started = time.perf_counter()
+    matrix = VolunteerMatrix.for_event(event)
+    build = time.perf_counter() - started
+
+    columns = [(column.slot, matrix.busy_persons(column.slot)) for column in matrix.columns]
+
+    def strings(slot, busy):
+        return [const.STATUSES[get_status(person, slot, busy)] for person in matrix.persons]
+
+    codes = measure(matrix.person_index.statuses, columns)
+    baseline = measure(strings, columns)
+    equal = all(list(matrix.person_index.statuses(slot, busy)) == [const.STATUSES.index(status)
+                                                                    for status in strings(slot, busy)]
+                for slot, busy in columns)
+
+    print(json.dumps({'slots': slots,
+                      'persons': len(matrix.persons),
+                      'columns': len(columns),
+                      'build_seconds': build,
+                      'codes': codes,
+                      'strings': baseline,
+                      'speedup': baseline['seconds'] / codes['seconds'] if codes['seconds'] else None,
+                      'memory_ratio': baseline['bytes'] / codes['bytes'] if codes['bytes'] else None,
+                      'equal': equal}, indent=2))
+
+
+if __name__ == '__main__':
+    main(*map(int, sys.argv[1:]))
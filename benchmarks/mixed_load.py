@@ -0,0 +1,141 @@
+"""
+Смешанная нагрузка на файловую базу SQLite: потоки-читатели запрашивают отчеты (страницы расписания
+и архив всех расписаний), потоки-писатели сохраняют людей, как в админке.
+
+Режимы:
+    delete - прежний журнал отката: чтение отчета держит блокировку, сохранение ждет его окончания
+    wal - режим WAL (по умолчанию, см. adentro_schedule/db.py)
+    wal-replica - WAL и чтение отчетов через отдельное соединение реплики (здесь - тот же файл)
+
+Для каждого режима - запросы и сохранения в секунду, задержки сохранения (p50/p95/max) и ошибки блокировки.
+Каждый режим запускается в отдельном процессе, потому что настройки базы читаются при старте.
+
+python -m benchmarks.mixed_load [--readers N] [--writers N] [--seconds N] [--mode delete|wal|wal-replica]
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+from benchmarks import setup_django
+from benchmarks.fixtures import generate
+
+MODES = ('delete', 'wal', 'wal-replica')
+
+
+def reader(client, urls, deadline, results):
+    from django.db import connections
+
+    count = errors = 0
+    while time.perf_counter() < deadline:
+        for url in urls:
+            response = client.get(url)
+            if response.status_code != 200:
+                errors += 1
+            elif response.streaming:
+                b''.join(response.streaming_content)
+            count += 1
+    connections.close_all()
+    results.append({'reads': count, 'read_errors': errors})
+
+
+def writer(person_pks, deadline, results):
+    from django.db import OperationalError, connections
+    from schedule_app import models
+
+    latencies, errors, i = [], 0, 0
+    while time.perf_counter() < deadline:
+        person = models.Person.objects.get(pk=person_pks[i % len(person_pks)])
+        person.night_man = not person.night_man
+        started = time.perf_counter()
+        try:
+            person.save()
+        except OperationalError:
+            errors += 1
+        else:
+            latencies.append(time.perf_counter() - started)
+        i += 1
+        time.sleep(0.01)
+    connections.close_all()
+    results.append({'latencies': latencies, 'write_errors': errors})
+
+
+def run(mode, readers, writers, seconds):
+    with tempfile.TemporaryDirectory() as directory:
+        database = os.path.join(directory, 'mixed.sqlite3')
+        os.environ['DATABASE_WAL'] = '0' if mode == 'delete' else '1'
+        os.environ['DATABASE_TIMEOUT'] = '5'
+        if mode == 'wal-replica':
+            os.environ['DATABASE_REPLICA_NAME'] = database
+        setup_django(database)
+
+        from django.contrib.auth.models import User
+        from django.db import connections
+        from django.test import Client
+        from django.test.utils import setup_test_environment
+        from django.urls import reverse
+
+        setup_test_environment()
+        event = generate(persons=200, slots=600)
+        user = User.objects.create_superuser('admin', 'admin@example.com', 'admin')
+        urls = [reverse('download', args=(event.pk,)), reverse('official_schedule', args=(event.pk,)),
+                reverse('volunteer_schedule', args=(event.pk,))]
+        person_pks = list(event.get_roster().values_list('pk', flat=True))
+        connections.close_all()
+
+        clients = []
+        for _ in range(readers):
+            client = Client()
+            client.force_login(user)
+            clients.append(client)
+        connections.close_all()
+
+        results = []
+        deadline = time.perf_counter() + seconds
+        threads = [threading.Thread(target=reader, args=(client, urls, deadline, results)) for client in clients]
+        threads += [threading.Thread(target=writer, args=(person_pks[i::writers], deadline, results))
+                    for i in range(writers)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        latencies = sorted(latency for result in results for latency in result.get('latencies', ()))
+        return {'mode': mode,
+                'reads_per_second': sum(result.get('reads', 0) for result in results) / seconds,
+                'writes_per_second': len(latencies) / seconds,
+                'write_p50_ms': statistics.median(latencies) * 1000 if latencies else None,
+                'write_p95_ms': latencies[int(len(latencies) * 0.95)] * 1000 if latencies else None,
+                'write_max_ms': latencies[-1] * 1000 if latencies else None,
+                'read_errors': sum(result.get('read_errors', 0) for result in results),
+                'write_errors': sum(result.get('write_errors', 0) for result in results)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Одновременные отчеты и сохранения в SQLite')
+    parser.add_argument('--readers', type=int, default=4)
+    parser.add_argument('--writers', type=int, default=2)
+    parser.add_argument('--seconds', type=int, default=10)
+    parser.add_argument('--mode', choices=MODES, help='один режим; по умолчанию - все по очереди')
+    args = parser.parse_args()
+
+    if args.mode:
+        print(json.dumps(run(args.mode, args.readers, args.writers, args.seconds)))
+        return
+
+    results = []
+    for mode in MODES:
+        output = subprocess.run([sys.executable, '-m', 'benchmarks.mixed_load', '--mode', mode,
+                                 '--readers', str(args.readers), '--writers', str(args.writers),
+                                 '--seconds', str(args.seconds)], capture_output=True, text=True, check=True)
+        results.append(json.loads(output.stdout.splitlines()[-1]))
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,74 @@
+"""
+Планы запросов расписания на заполненной базе: EXPLAIN QUERY PLAN должен показывать поиск по индексам,
+а не полный просмотр таблиц расписания и людей.
+
+python -m benchmarks.query_plans [количество активностей]
+"""
+import datetime
+import json
+import os
+import sys
+import tempfile
+import time
+
+from benchmarks import setup_django
+from benchmarks.fixtures import generate
+
+INDEXED_TABLES = ('schedule_app_activityonevent', 'schedule_app_person')
+
+
+def seed(slots):
+    """
+    Половина активностей в текущем мероприятии, половина - в прошлом, чтобы фильтр по мероприятию был избирательным
+    """
+    event = generate(persons=slots // 20, slots=slots // 2, overlap=8, title='Бенчмарк')
+    generate(persons=slots // 20, slots=slots - slots // 2, overlap=8, seed=1, title='Прошлое',
+             start=datetime.datetime(2021, 5, 1, 8, 0, 0))
+    return event
+
+
+def queries(event):
+    import schedule_app.common as common
+    import schedule_app.constants as const
+    from schedule_app import models
+
+    slot = models.ActivityOnEvent.objects.filter(event=event).first()
+    return {
+        'full_schedule': common.get_full_schedule(event.pk),
+        'volunteer_schedule': common.get_volunteer_schedule(event.pk),
+        'official_schedule': common.get_official_schedule(event.pk),
+        'other_schedule': common.get_other_schedule(event.pk),
+        'not_arrived_persons': models.Person.objects.filter(arrival_datetime__gte=slot.start_dt),
+        'departed_persons': models.Person.objects.filter(departure_datetime__lte=slot.end_dt),
+        'event_roster': event.get_roster(),
+        'event_assignments': common.get_assignments(event),
+        'volunteer_slots': models.ActivityOnEvent.objects.filter(event=event, activity_type_name=const.VOLUNTEER)
+        .order_by('start_dt', 'end_dt').values_list('pk', 'start_dt', 'end_dt'),
+    }
+
+
+def full_scans(plan):
+    return [line for line in plan.splitlines()
+            if 'SCAN' in line and 'USING' not in line and any(table in line for table in INDEXED_TABLES)]
+
+
+def main(slots=10000):
+    with tempfile.TemporaryDirectory() as directory:
+        setup_django(os.path.join(directory, 'benchmark.sqlite3'))
+        event = seed(slots)
+
+        results = {'slots': slots, 'queries': {}}
+        for name, queryset in queries(event).items():
+            plan = queryset.explain()
+            started = time.perf_counter()
+            list(queryset)
+            results['queries'][name] = {'seconds': time.perf_counter() - started,
+                                        'plan': plan.splitlines(),
+                                        'full_scans': full_scans(plan)}
+
+        results['uses_indexes'] = not any(query['full_scans'] for query in results['queries'].values())
+        print(json.dumps(results, indent=2, ensure_ascii=False))
+
+
+if __name__ == '__main__':
+    main(*map(int, sys.argv[1:]))
@@ -0,0 +1,49 @@
+"""
+Время работы и заполненность автоматического распределения волонтеров.
+
+python -m benchmarks.solver [активностей] [людей]
+"""
+import json
+import sys
+import time
+
+from benchmarks import setup_django
+from benchmarks.fixtures import generate
+
+
+def check(assigner):
+    """
+    Проверка решения: нет пересечений и превышения лимита времени
+    """
+    violations = 0
+    for candidate in assigner.candidates.values():
+        if candidate.used > candidate.free_time_limit:
+            violations += 1
+        for (_, end, _), (start, _, _) in zip(candidate.busy, candidate.busy[1:]):
+            if start < end:
+                violations += 1
+    return violations
+
+
+def main(slots=1000, persons=300):
+    setup_django()
+    from schedule_app.solver import AutoAssigner
+
+    event = generate(persons=persons, slots=slots, overlap=16, fill_rate=0, volunteer_share=1.0)
+
+    assigner = AutoAssigner(event)
+    started = time.perf_counter()
+    assignments = assigner.solve()
+    elapsed = time.perf_counter() - started
+
+    print(json.dumps({'slots': slots,
+                      'persons': persons,
+                      'seats': sum(slot.need_peoples for slot in assigner.slots),
+                      'assigned': sum(len(person_pks) for person_pks in assignments.values()),
+                      'fill_rate': assigner.fill_rate(),
+                      'seconds': elapsed,
+                      'violations': check(assigner)}, indent=2))
+
+
+if __name__ == '__main__':
+    main(*map(int, sys.argv[1:]))
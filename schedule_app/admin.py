@@ -1,6 +1,24 @@
+import datetime
+import io
+
 from django.contrib import admin
+from django.contrib.admin.widgets import AutocompleteSelect
+from django.core.exceptions import PermissionDenied, ValidationError
+from django.core.paginator import Paginator
+from django.db import DatabaseError, connections
+from django.db.models import Count, IntegerField, OuterRef, Q, Subquery
+from django.db.models.functions import Coalesce
+from django.forms import SplitDateTimeField
+from django.http import Http404, JsonResponse
+from django.shortcuts import get_object_or_404, redirect
+from django.template.response import TemplateResponse
+from django.urls import path, reverse
+from django.utils.functional import cached_property
 
 from schedule_app import forms, models
+from schedule_app.finder import FreeSlotFinder
+from schedule_app.importer import import_schedule
+from schedule_app.solver import auto_assign
 
 
 @admin.display(description='Категории')
@@ -16,15 +34,219 @@ class ActivityTypeAdmin(admin.ModelAdmin):
     list_display = ('name',)
 
 
+def estimated_count(queryset):
+    """
+    Число строк таблицы по статистике базы (pg_class в PostgreSQL, sqlite_stat1 после ANALYZE в SQLite)
+    или None, если статистики нет
+    """
+    connection = connections[queryset.db]
+    table = queryset.model._meta.db_table
+    if connection.vendor == 'postgresql':
+        sql, params = 'SELECT reltuples::bigint FROM pg_class WHERE oid = %s::regclass', [table]
+    elif connection.vendor == 'sqlite':
+        sql, params = 'SELECT stat FROM sqlite_stat1 WHERE tbl = %s LIMIT 1', [table]
+    else:
+        return None
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute(sql, params)
+            row = cursor.fetchone()
+    except DatabaseError:
+        return None
+    if row is None or row[0] is None:
+        return None
+    return int(str(row[0]).split()[0])
+
+
+class EstimatedCountPaginator(Paginator):
+    """
+    Для списка без фильтров на большой таблице число строк берется из статистики базы вместо COUNT(*).
+    Точный подсчет идет без аннотаций столбцов списка: на число строк они не влияют
+    """
+    threshold = 10000
+
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        if not queryset.query.where:
+            estimate = estimated_count(queryset)
+            if estimate is not None and estimate >= self.threshold:
+                return estimate
+        return queryset.model._default_manager.filter(pk__in=queryset.order_by().values('pk')).count()
+
+
+class AutocompleteFilter(admin.SimpleListFilter):
+    """
+    Фильтр с поиском вместо полного списка: в боковой панели только выбранное значение,
+    варианты подгружаются по мере ввода (ActivityOnEventAdmin.lookup_view)
+    """
+    template = 'admin/schedule_app/autocomplete_filter.html'
+    model = None
+    search_fields = ()
+    page_size = 20
+
+    def has_output(self):
+        return True
+
+    def lookups(self, request, model_admin):
+        self.lookup_url = reverse('admin:schedule_app_activityonevent_lookup', args=(self.parameter_name,))
+        self.selected = None
+        if self.value():
+            self.selected = self.model.objects.filter(pk=self.value()).first() if self.value().isdigit() else None
+        return [(self.selected.pk, str(self.selected))] if self.selected is not None else []
+
+    def queryset(self, request, queryset):
+        if self.value():
+            return queryset.filter(**{self.parameter_name: self.value()})
+        return queryset
+
+    @classmethod
+    def choices_queryset(cls, request):
+        return cls.model.objects.all()
+
+    @classmethod
+    def search(cls, request, term):
+        queryset = cls.choices_queryset(request)
+        for word in term.split():
+            queryset = queryset.filter(Q(*(Q(**{f'{field}__icontains': word}) for field in cls.search_fields),
+                                         _connector=Q.OR))
+        return queryset.order_by(*cls.search_fields, 'pk')
+
+
+class ActivityFilter(AutocompleteFilter):
+    title = 'Активность'
+    parameter_name = 'activity'
+    model = models.Activity
+    search_fields = ('name',)
+
+
+class RosterPersonFilter(AutocompleteFilter):
+    """
+    Фильтр по людям: при выбранном мероприятии предлагаются только люди из его состава
+    """
+    title = 'Кто занимается'
+    parameter_name = 'person'
+    model = models.Person
+    search_fields = ('last_name', 'first_name')
+
+    def lookups(self, request, model_admin):
+        lookups = super().lookups(request, model_admin)
+        if request.GET.get('event__id__exact'):
+            self.lookup_url += f'?event={request.GET["event__id__exact"]}'
+        return lookups
+
+    @classmethod
+    def choices_queryset(cls, request):
+        event = models.Event.objects.filter(pk=request.GET['event']).first() \
+            if request.GET.get('event', '').isdigit() else None
+        return event.get_roster() if event is not None else models.Person.objects.all()
+
+
+class AccountedDurationFilter(admin.SimpleListFilter):
+    """
+    Фильтр по хранимому учетному времени (ActivityOnEvent.accounted_duration)
+    """
+    title = 'Учетное время'
+    parameter_name = 'accounted'
+    ranges = {'lt1': (None, 1), '1-2': (1, 2), '2-4': (2, 4), 'gte4': (4, None)}
+
+    def lookups(self, request, model_admin):
+        return (('lt1', 'до часа'), ('1-2', '1 - 2 часа'), ('2-4', '2 - 4 часа'), ('gte4', '4 часа и больше'))
+
+    def queryset(self, request, queryset):
+        if self.value() not in self.ranges:
+            return queryset
+        low, high = self.ranges[self.value()]
+        if low is not None:
+            queryset = queryset.filter(accounted_duration__gte=datetime.timedelta(hours=low))
+        if high is not None:
+            queryset = queryset.filter(accounted_duration__lt=datetime.timedelta(hours=high))
+        return queryset
+
+
 @admin.display(description='Общее расписание')
 class ActivityOnEventAdmin(admin.ModelAdmin):
     # TODO https://realpython.com/customize-django-admin-python/#changing-how-models-are-edited
-    # TODO рядом с duration отображать колонку "учетное время", куда выводить
-    #  с учетом коэффициента категории и доп. времени в ней
     form = forms.ActivityOnEventForm
-    list_display = ('activity', 'get_activity_type', 'event', 'start_dt', 'end_dt', 'duration')
-    list_filter = ('event', 'activity__category__activity_type', 'activity', 'person')
+    list_display = ('activity', 'get_activity_type', 'event', 'start_dt', 'end_dt', 'duration', 'accounted_duration',
+                    'get_persons_count')
+    # тип берется из копии в activity_type_name, без джойнов категории и типа
+    list_filter = ('event', 'activity_type_name', ActivityFilter, RosterPersonFilter, AccountedDurationFilter)
+    list_select_related = ('activity', 'event')
+    autocomplete_fields = ('activity', 'person')
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
     save_as = True
+    actions = ('fill_automatically',)
+    candidates_limit = 15
+
+    @property
+    def media(self):
+        # select2 для фильтров с поиском в списке
+        return super().media + AutocompleteSelect(self.model._meta.get_field('activity'), self.admin_site).media
+
+    def get_queryset(self, request):
+        persons = models.ActivityOnEvent.person.through.objects.filter(activityonevent=OuterRef('pk')) \
+            .order_by().values('activityonevent').annotate(count=Count('*')).values('count')
+        return super().get_queryset(request) \
+            .annotate(persons_count=Coalesce(Subquery(persons, output_field=IntegerField()), 0))
+
+    def get_urls(self):
+        return [path('candidates/', self.admin_site.admin_view(self.candidates_view),
+                     name='schedule_app_activityonevent_candidates'),
+                path('lookup/<str:parameter>/', self.admin_site.admin_view(self.lookup_view),
+                     name='schedule_app_activityonevent_lookup')] + super().get_urls()
+
+    def lookup_view(self, request, parameter):
+        """
+        Варианты для фильтров с поиском в формате select2
+        """
+        if not self.has_view_permission(request):
+            raise PermissionDenied
+        filters = {list_filter.parameter_name: list_filter for list_filter in self.list_filter
+                   if isinstance(list_filter, type) and issubclass(list_filter, AutocompleteFilter)}
+        if parameter not in filters:
+            raise Http404
+        list_filter = filters[parameter]
+
+        page_size = list_filter.page_size
+        page = int(request.GET['page']) if request.GET.get('page', '').isdigit() else 1
+        start = (page - 1) * page_size
+        objects = list(list_filter.search(request, request.GET.get('term', ''))[start:start + page_size + 1])
+        return JsonResponse({'results': [{'id': str(obj.pk), 'text': str(obj)} for obj in objects[:page_size]],
+                             'pagination': {'more': len(objects) > page_size}})
+
+    def candidates_view(self, request):
+        """
+        Подсказка для поля людей: свободные на активность люди по значениям формы (см. finder.py)
+        """
+        if not (self.has_add_permission(request) or self.has_change_permission(request)):
+            raise PermissionDenied
+        params = request.GET
+        try:
+            event = models.Event.objects.get(pk=params['event'])
+            activity = models.Activity.objects.select_related('category__activity_type').get(pk=params['activity'])
+            dt_field = SplitDateTimeField()
+            start_dt = dt_field.clean([params.get('start_dt_0'), params.get('start_dt_1')])
+            end_dt = dt_field.clean([params.get('end_dt_0'), params.get('end_dt_1')])
+            slot_pk = int(params['object']) if params.get('object') else None
+        except (KeyError, ValueError, ValidationError, models.Event.DoesNotExist, models.Activity.DoesNotExist):
+            return JsonResponse({'candidates': []})
+
+        finder = FreeSlotFinder.for_event(event)
+        slot = finder.make_slot(activity, start_dt, end_dt, pk=slot_pk)
+        ranked = finder.candidates_for(slot, limit=self.candidates_limit)
+        persons = models.Person.objects.in_bulk([pk for pk, _ in ranked])
+        return JsonResponse({'candidates': [{'pk': pk, 'name': str(persons[pk]), 'cost': round(value, 2)}
+                                            for pk, value in ranked if pk in persons]})
+
+    @admin.action(description='Заполнить автоматически', permissions=['change'])
+    def fill_automatically(self, request, queryset):
+        for event in models.Event.objects.filter(pk__in=queryset.values('event')):
+            slot_pks = queryset.filter(event=event).values_list('pk', flat=True)
+            assigner, assignments = auto_assign(event, slot_pks=slot_pks)
+            added = sum(len(person_pks) for person_pks in assignments.values())
+            self.message_user(request, f'{event}: назначено {added}, заполненность {assigner.fill_rate():.0%}')
 
     @staticmethod
     @admin.display(description='Дата начала')
@@ -36,9 +258,13 @@ class ActivityOnEventAdmin(admin.ModelAdmin):
     def end_date_time(obj):
         return obj.end_dt.strftime("%Y-%m-%d %H:%M:%S")
 
-    @admin.display(description='Тип')
+    @admin.display(description='Тип', ordering='activity_type_name')
     def get_activity_type(self, obj):
-        return obj.activity.category.activity_type
+        return obj.get_activity_type_name_display()
+
+    @admin.display(description='Людей', ordering='persons_count')
+    def get_persons_count(self, obj):
+        return obj.persons_count
 
 
 @admin.display(description='Активности')
@@ -47,6 +273,7 @@ class ActivityAdmin(admin.ModelAdmin):
     list_display = ('name', 'category', 'get_activity_type')
 
     list_filter = ('category', 'category__activity_type')
+    search_fields = ('name',)
 
     @admin.display(description='Тип')
     def get_activity_type(self, obj):
@@ -57,12 +284,63 @@ class ActivityAdmin(admin.ModelAdmin):
 class PersonAdmin(admin.ModelAdmin):
     form = forms.PersonForm
     list_display = ('first_name', 'last_name')
+    search_fields = ('last_name', 'first_name', 'email')
 
 
 @admin.display(description='Мероприятия')
 class EventAdmin(admin.ModelAdmin):
     form = forms.EventForm
     list_display = ('title', 'start_date', 'end_date')
+    filter_horizontal = ('participants',)
+
+    def get_urls(self):
+        return [path('<int:pk>/import/', self.admin_site.admin_view(self.import_view),
+                     name='schedule_app_event_import')] + super().get_urls()
+
+    def import_view(self, request, pk):
+        """
+        Загрузка CSV с людьми и расписанием (см. importer.py); при ошибках показывается полный список
+        """
+        event = get_object_or_404(models.Event, pk=pk)
+        if not self.has_change_permission(request, event):
+            return redirect('admin:index')
+
+        errors = []
+        form = forms.ScheduleImportForm(request.POST or None, request.FILES or None)
+        if request.method == 'POST' and form.is_valid():
+            files = {name: io.TextIOWrapper(form.cleaned_data[name].file, encoding='utf-8-sig', newline='')
+                     for name in ('persons', 'schedule') if form.cleaned_data[name]}
+            try:
+                persons, activities, slots, assignments = import_schedule(event, files.get('persons'),
+                                                                          files.get('schedule'))
+            except ValidationError as e:
+                errors = e.messages
+            except UnicodeDecodeError:
+                errors = ['Файлы должны быть в кодировке UTF-8']
+            else:
+                self.message_user(request, f'Создано: людей {persons}, активностей {activities}, '
+                                           f'слотов {slots}, назначений {assignments}')
+                return redirect('admin:schedule_app_event_change', event.pk)
+
+        context = {**self.admin_site.each_context(request), 'opts': self.model._meta, 'original': event,
+                   'title': f'Импорт расписания: {event}', 'form': form, 'errors': errors}
+        return TemplateResponse(request, 'admin/schedule_app/event/import.html', context)
+
+
+@admin.display(description='Нагрузка')
+class WorkloadAdmin(admin.ModelAdmin):
+    list_display = ('person', 'event', 'accounted_time', 'get_free_time_limit')
+    list_filter = ('event',)
+    list_select_related = ('person', 'event')
+    ordering = ('-accounted_time',)
+    readonly_fields = ('event', 'person', 'accounted_time')
+
+    @admin.display(description='Лимит свободного времени')
+    def get_free_time_limit(self, obj):
+        return obj.person.free_time_limit
+
+    def has_add_permission(self, request):
+        return False
 
 
 admin.site.register(models.Category, CategoryAdmin)
@@ -71,3 +349,4 @@ admin.site.register(models.Activity, ActivityAdmin)
 admin.site.register(models.Person, PersonAdmin)
 admin.site.register(models.Event, EventAdmin)
 admin.site.register(models.ActivityOnEvent, ActivityOnEventAdmin)
+admin.site.register(models.Workload, WorkloadAdmin)
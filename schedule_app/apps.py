@@ -4,3 +4,7 @@ from django.apps import AppConfig
 class ScheduleAppConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'schedule_app'
+
+    def ready(self):
+        import adentro_schedule.db  # noqa: F401 настройка соединений SQLite
+        import schedule_app.signals  # noqa: F401
@@ -0,0 +1,54 @@
+"""
+Назначение людей на активности без двойных бронирований при одновременной работе координаторов.
+
+Проверка (validation.AssignmentValidator) и запись выполняются в одной транзакции, а люди блокируются
+до чтения их расписаний: второй координатор, назначающий тех же людей, ждет фиксации первого
+и проверяет уже с учетом его назначений.
+
+На базах с SELECT ... FOR UPDATE блокируются строки людей по возрастанию pk, поэтому встречные
+назначения не блокируют друг друга навсегда. SQLite его не поддерживает: там пустой UPDATE людей
+берет блокировку записи на всю базу, и чтобы она бралась до любых чтений, assign открывает
+собственную транзакцию. В админке форма проверяется и сохраняется внутри транзакции changeform_view,
+и на SQLite проигравший из двух одновременных запросов получает ошибку формы с просьбой сохранить еще раз
+вместо двойного назначения
+"""
+from django.db import connection, transaction
+from django.db.models import F
+
+from schedule_app import models
+from schedule_app.validation import AssignmentValidator
+
+
+def lock_persons(person_pks):
+    """
+    Блокировка людей до конца текущей транзакции
+    """
+    person_pks = sorted(set(person_pks))
+    if not person_pks:
+        return
+    persons = models.Person.objects.filter(pk__in=person_pks)
+    if connection.features.has_select_for_update:
+        list(persons.select_for_update().order_by('pk').values_list('pk', flat=True))
+    else:
+        persons.update(updated_at=F('updated_at'))
+
+
+@transaction.atomic
+def assign(activity_on_event, person_pks):
+    """
+    Проверка и сохранение activity_on_event с людьми person_pks (полный состав).
+    ValidationError, если назначение нарушает правила; тогда ничего не сохраняется
+    """
+    person_pks = set(person_pks)
+    lock_persons(person_pks)
+
+    # люди читаются после блокировки, чтобы лимиты и даты были актуальными
+    persons = list(models.Person.objects.filter(pk__in=person_pks))
+    validator = AssignmentValidator(activity_on_event.event, activity_on_event.activity,
+                                    activity_on_event.start_dt, activity_on_event.end_dt,
+                                    instance=activity_on_event)
+    validator.validate(persons)
+
+    activity_on_event.save()
+    activity_on_event.person.set(persons)
+    return activity_on_event
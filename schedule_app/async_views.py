@@ -0,0 +1,101 @@
+"""
+Асинхронные версии страниц расписания и выгрузок для запуска под ASGI.
+
+ORM в Django 3.2 синхронный, поэтому работа с базой и рендеринг выполняются в пуле потоков
+через sync_to_async, не блокируя цикл событий. Число одновременных обращений к базе
+ограничено семафором (ASYNC_ORM_CONCURRENCY), чтобы всплеск запросов не исчерпал соединения
+"""
+import asyncio
+import tempfile
+import weakref
+
+from asgiref.sync import sync_to_async
+
+from django.conf import settings
+from django.db import close_old_connections
+from django.http import FileResponse
+
+from schedule_app import views
+
+# семафор привязан к циклу событий, поэтому создается для каждого цикла отдельно
+_semaphores = weakref.WeakKeyDictionary()
+
+
+def get_semaphore():
+    loop = asyncio.get_running_loop()
+    if loop not in _semaphores:
+        _semaphores[loop] = asyncio.Semaphore(settings.ASYNC_ORM_CONCURRENCY)
+    return _semaphores[loop]
+
+
+def closing_connections(func):
+    """
+    Потоки пула не проходят через request_finished, соединения с базой закрываются здесь
+    """
+
+    def wrapper(*args, **kwargs):
+        try:
+            return func(*args, **kwargs)
+        finally:
+            close_old_connections()
+
+    return wrapper
+
+
+async def run_sync(func, *args, **kwargs):
+    async with get_semaphore():
+        return await sync_to_async(closing_connections(func), thread_sensitive=False)(*args, **kwargs)
+
+
+def spool_response(response):
+    """
+    Django 3.2 под ASGI читает потоковый ответ прямо в цикле событий, а генератор архива обращается к базе.
+    Архив собирается в потоке во временный файл (в памяти до ASYNC_SPOOL_MAX_SIZE), у каждого запроса свой
+    """
+    if not response.streaming:
+        return response
+
+    spool = tempfile.SpooledTemporaryFile(max_size=settings.ASYNC_SPOOL_MAX_SIZE)
+    for chunk in response.streaming_content:
+        spool.write(chunk)
+    spool.seek(0)
+
+    spooled = FileResponse(spool, content_type=response['Content-Type'])
+    spooled['Content-Disposition'] = response['Content-Disposition']
+    return spooled
+
+
+def spooled_download_all(request, pk):
+    return spool_response(views.download_all(request, pk))
+
+
+async def download_all(request, pk):
+    return await run_sync(spooled_download_all, request, pk)
+
+
+async def download_person(request, event_pk, person_pk):
+    return await run_sync(views.download_person, request, event_pk, person_pk)
+
+
+async def show_person_schedule(request, event_pk, person_pk):
+    return await run_sync(views.show_person_schedule, request, event_pk, person_pk)
+
+
+async def show_official_schedule(request, pk):
+    return await run_sync(views.show_official_schedule, request, pk)
+
+
+async def show_other_schedule(request, pk):
+    return await run_sync(views.show_other_schedule, request, pk)
+
+
+async def show_volunteer_schedule(request, pk):
+    return await run_sync(views.show_volunteer_schedule, request, pk)
+
+
+async def volunteer_schedule_data(request, pk):
+    return await run_sync(views.volunteer_schedule_data, request, pk)
+
+
+async def show_coverage(request, pk):
+    return await run_sync(views.show_coverage, request, pk)
@@ -0,0 +1,334 @@
+"""
+Движок доступности волонтеров.
+
+Активности мероприятия и назначения на них загружаются один раз и сортируются по времени начала.
+Пересечения ищутся бинарным поиском по отсортированному списку, а не попарным сравнением
+всех активностей мероприятия.
+
+Статусы хранятся кодами из const.STATUSES в array('b'), по массиву на столбец. Столбец заполняется
+копированием шаблона (доступен / неизвестно) и точечной простановкой кодов: отсутствующие люди
+находятся бинарным поиском по датам приезда и отъезда, занятые и участники - по своим pk
+"""
+import bisect
+import datetime
+from array import array
+from collections import defaultdict
+
+import schedule_app.common as common
+import schedule_app.constants as const
+import schedule_app.models as models
+import schedule_app.utils as utils
+import schedule_app.workload as workload
+
+
+class Slot:
+    """
+    Активность на мероприятии в объеме, достаточном для проверки пересечений
+    """
+    __slots__ = ('pk', 'start_dt', 'end_dt', 'person_pks', 'is_volunteer')
+
+    def __init__(self, pk, start_dt, end_dt, person_pks, is_volunteer=False):
+        self.pk = pk
+        self.start_dt = start_dt
+        self.end_dt = end_dt
+        self.person_pks = person_pks
+        self.is_volunteer = is_volunteer
+
+
+def load_slots(event_pk):
+    """
+    Интервалы всех активностей мероприятия с участниками, без загрузки самих активностей
+    """
+    person_pks = defaultdict(set)
+    assignments = models.ActivityOnEvent.person.through.objects \
+        .filter(activityonevent__event__pk=event_pk) \
+        .values_list('activityonevent_id', 'person_id')
+    for slot_pk, person_pk in assignments:
+        person_pks[slot_pk].add(person_pk)
+
+    rows = models.ActivityOnEvent.objects.filter(event__pk=event_pk) \
+        .values_list('pk', 'start_dt', 'end_dt', 'activity_type_name')
+    return [Slot(pk=pk, start_dt=start_dt, end_dt=end_dt, person_pks=person_pks[pk],
+                 is_volunteer=activity_type == const.VOLUNTEER)
+            for pk, start_dt, end_dt, activity_type in rows]
+
+
+class ScheduleIndex:
+    """
+    Активности мероприятия, отсортированные по времени начала.
+    Кандидаты на пересечение с интервалом лежат в окне [начало - макс. продолжительность, конец]
+    """
+
+    def __init__(self, slots):
+        self.slots = sorted(slots, key=lambda slot: (slot.start_dt, slot.end_dt, slot.pk))
+        self.starts = [slot.start_dt for slot in self.slots]
+        self.max_duration = max((slot.end_dt - slot.start_dt for slot in self.slots),
+                                default=datetime.timedelta(0))
+        self.by_pk = {slot.pk: slot for slot in self.slots}
+
+    def overlapping(self, slot):
+        lo = bisect.bisect_left(self.starts, slot.start_dt - self.max_duration)
+        hi = bisect.bisect_right(self.starts, slot.end_dt)
+
+        for other in self.slots[lo:hi]:
+            if other.end_dt < slot.start_dt:
+                continue
+            if utils.is_intersects(start_dt=other.start_dt, end_dt=other.end_dt, activity=slot,
+                                   checked_activity=other):
+                yield other
+
+    def get(self, pk):
+        return self.by_pk.get(pk)
+
+
+class Column:
+    """
+    Столбец матрицы: волонтерская активность, ее заголовки, число требуемых и назначенных людей
+    и коды статусов всех людей относительно нее
+    """
+    __slots__ = ('slot', 'activity_dt', 'activity_name', 'need_peoples', 'need', 'assigned', 'duration_with_coef',
+                 'statuses')
+
+    def __init__(self, slot, activity_dt, activity_name, need_peoples, need, assigned, duration_with_coef, statuses):
+        self.slot = slot
+        self.activity_dt = activity_dt
+        self.activity_name = activity_name
+        self.need_peoples = need_peoples
+        self.need = need
+        self.assigned = assigned
+        self.duration_with_coef = duration_with_coef
+        self.statuses = statuses
+
+    @property
+    def filled(self):
+        # как в заголовке need_peoples (utils.need_peoples_transform)
+        return self.assigned == self.need
+
+
+class Row:
+    """
+    Строка окна матрицы: человек, коды его статусов по столбцам окна и суммарное учетное время в секундах
+    """
+    __slots__ = ('person', 'statuses', 'duration')
+
+    def __init__(self, person, statuses, duration):
+        self.person = person
+        self.statuses = statuses
+        self.duration = duration
+
+
+def is_absent(person, slot):
+    """
+    Человек еще не приехал к началу активности или уже уехал до ее окончания
+    """
+    return any([person.arrival_datetime is not None and person.arrival_datetime >= slot.start_dt,
+                person.departure_datetime is not None and person.departure_datetime <= slot.end_dt])
+
+
+def get_status(person, slot, busy):
+    if person.pk in slot.person_pks:
+        return const.PARTICIPATES_CODE
+    if person.pk in busy or is_absent(person, slot):
+        return const.UNAVAILABLE_CODE
+    if not person.arrive_and_depart_filled():
+        return const.UNKNOWN_CODE
+    return const.AVAILABLE_CODE
+
+
+class PersonIndex:
+    """
+    Строки матрицы: позиции людей по pk и позиции, отсортированные по датам приезда и отъезда
+    """
+
+    def __init__(self, persons):
+        self.positions = {person.pk: i for i, person in enumerate(persons)}
+        self.template = array('b', (const.AVAILABLE_CODE if person.arrive_and_depart_filled() else const.UNKNOWN_CODE
+                                    for person in persons))
+
+        arrivals = sorted((person.arrival_datetime, i) for i, person in enumerate(persons)
+                          if person.arrival_datetime is not None)
+        departures = sorted((person.departure_datetime, i) for i, person in enumerate(persons)
+                            if person.departure_datetime is not None)
+        self.arrival_dts = [dt for dt, _ in arrivals]
+        self.arrival_positions = [i for _, i in arrivals]
+        self.departure_dts = [dt for dt, _ in departures]
+        self.departure_positions = [i for _, i in departures]
+
+    def absent(self, slot):
+        """
+        Позиции людей, для которых is_absent(person, slot)
+        """
+        lo = bisect.bisect_left(self.arrival_dts, slot.start_dt)
+        hi = bisect.bisect_right(self.departure_dts, slot.end_dt)
+        return self.arrival_positions[lo:] + self.departure_positions[:hi]
+
+    def statuses(self, slot, busy):
+        """
+        Коды статусов всех людей относительно активности, то же, что get_status по каждому человеку
+        """
+        statuses = array('b', self.template)
+        for i in self.absent(slot):
+            statuses[i] = const.UNAVAILABLE_CODE
+        for pk in busy:
+            if pk in self.positions:
+                statuses[self.positions[pk]] = const.UNAVAILABLE_CODE
+        for pk in slot.person_pks:
+            if pk in self.positions:
+                statuses[self.positions[pk]] = const.PARTICIPATES_CODE
+        return statuses
+
+
+class VolunteerMatrix:
+    """
+    Матрица "люди x волонтерские активности" со статусами участия и суммарным учетным временем.
+    Поддерживает точечное обновление: пересчитываются только затронутые столбцы и строки
+    """
+
+    def __init__(self, event, schedule, persons):
+        self.event = event
+        # строки упорядочены по pk, см. refresh_persons
+        self.persons = sorted(persons, key=lambda person: person.pk)
+
+        slots = []
+        volunteer_activities = []
+        for activity in schedule:
+            slot = Slot(pk=activity.pk, start_dt=activity.start_dt, end_dt=activity.end_dt,
+                        person_pks={person.pk for person in activity.person.all()},
+                        is_volunteer=activity.activity_type_name == const.VOLUNTEER)
+            slots.append(slot)
+            if slot.is_volunteer:
+                volunteer_activities.append((activity, slot))
+
+        self.index = ScheduleIndex(slots)
+        self.person_index = PersonIndex(self.persons)
+        self.columns = [self.build_column(activity, slot) for activity, slot in volunteer_activities]
+        self.sort_columns()
+
+    @classmethod
+    def for_event(cls, event):
+        schedule = common.hydrate(event.get_schedule())
+        return cls(event, schedule, event.get_roster())
+
+    def busy_persons(self, slot):
+        busy = set()
+        for other in self.index.overlapping(slot):
+            busy |= other.person_pks
+        return busy
+
+    def build_column(self, activity, slot):
+        statuses = self.person_index.statuses(slot, self.busy_persons(slot))
+
+        duration = utils.get_duration({'start_dt': slot.start_dt, 'end_dt': slot.end_dt})
+        duration_with_coef = activity.accounted_duration
+        row_data = {'start_dt': slot.start_dt,
+                    'end_dt': slot.end_dt,
+                    'activity': activity.activity.name,
+                    'persons': slot.person_pks,
+                    'need_peoples': activity.activity.need_peoples,
+                    'activity_pk': slot.pk}
+
+        return Column(slot=slot,
+                      activity_dt=utils.date_transform(row_data, duration, duration_with_coef),
+                      activity_name=row_data['activity'],
+                      need_peoples=utils.need_peoples_transform(row_data),
+                      need=row_data['need_peoples'],
+                      assigned=len(slot.person_pks),
+                      duration_with_coef=duration_with_coef,
+                      statuses=statuses)
+
+    def sort_columns(self):
+        self.columns.sort(key=lambda column: (column.slot.start_dt, column.slot.end_dt, column.slot.pk))
+
+    def refresh(self, slot_pks=(), person_pks=()):
+        """
+        Пересчет после изменения активностей slot_pks и людей person_pks.
+        Заново строятся только столбцы измененных активностей и пересекающихся с ними
+        (до и после изменения), у остальных столбцов обновляются только строки измененных людей
+        """
+        affected = set(slot_pks)
+        if slot_pks:
+            old_index = self.index
+            self.index = ScheduleIndex(load_slots(self.event.pk))
+
+        for pk in slot_pks:
+            for index in (old_index, self.index):
+                slot = index.get(pk)
+                if slot is not None:
+                    affected |= {other.pk for other in index.overlapping(slot)}
+
+        if person_pks:
+            self.refresh_persons(set(person_pks))
+
+        if affected:
+            self.refresh_columns(affected)
+
+    def refresh_persons(self, person_pks):
+        """
+        Обновление строк людей person_pks. Люди, выбывшие из состава мероприятия, удаляются,
+        новые вставляются в порядке pk - так же, как при полной сборке
+        """
+        fresh = {person.pk: person for person in self.event.get_roster().filter(pk__in=person_pks)}
+
+        for i in reversed(range(len(self.persons))):
+            if self.persons[i].pk in person_pks and self.persons[i].pk not in fresh:
+                del self.persons[i]
+                for column in self.columns:
+                    del column.statuses[i]
+
+        pks = [person.pk for person in self.persons]
+        for pk in sorted(fresh):
+            i = bisect.bisect_left(pks, pk)
+            if i < len(pks) and pks[i] == pk:
+                self.persons[i] = fresh[pk]
+                continue
+            pks.insert(i, pk)
+            self.persons.insert(i, fresh[pk])
+            for column in self.columns:
+                column.statuses.insert(i, const.UNKNOWN_CODE)
+
+        self.person_index = PersonIndex(self.persons)
+        positions = self.person_index.positions
+        for column in self.columns:
+            slot = self.index.get(column.slot.pk) or column.slot
+            busy = self.busy_persons(slot)
+            for pk in fresh:
+                column.statuses[positions[pk]] = get_status(fresh[pk], slot, busy)
+
+    def refresh_columns(self, slot_pks):
+        self.columns = [column for column in self.columns if column.slot.pk not in slot_pks]
+
+        activities = models.ActivityOnEvent.objects \
+            .filter(pk__in=slot_pks, event=self.event,
+                    activity_type_name=const.VOLUNTEER) \
+            .select_related('activity__category')
+        for activity in activities:
+            self.columns.append(self.build_column(activity, self.index.get(activity.pk)))
+
+        self.sort_columns()
+
+    def headers(self, columns=None):
+        columns = self.columns if columns is None else columns
+        return {'activity_dt': [column.activity_dt for column in columns],
+                'activity_name': [column.activity_name for column in columns],
+                'need_peoples': [column.need_peoples for column in columns]}
+
+    def window(self, offset=0, limit=None, start_dt=None, end_dt=None):
+        """
+        Окно матрицы: столбцы активностей, пересекающихся с [start_dt, end_dt),
+        и строки людей с offset по offset + limit.
+        Учетное время читается из хранимой нагрузки (см. workload.py), а не суммируется по столбцам
+        """
+        columns = [column for column in self.columns
+                   if (start_dt is None or column.slot.end_dt > start_dt)
+                   and (end_dt is None or column.slot.start_dt < end_dt)]
+        persons = self.persons[offset:None if limit is None else offset + limit]
+
+        totals = workload.get_totals(self.event.pk, None if limit is None else [person.pk for person in persons])
+        durations = array('q', (int(totals[person.pk].total_seconds()) if person.pk in totals else 0
+                                for person in persons))
+        rows = [Row(person, array('b', (column.statuses[offset + i] for column in columns)), durations[i])
+                for i, person in enumerate(persons)]
+        return columns, rows
+
+    def rows(self):
+        return self.window()[1]
@@ -18,5 +18,31 @@ def get_other_schedule(event_pk):
     return __get_schedule(event_pk, const.OTHER)
 
 
+def get_person_schedule(event_pk, person, activity_type: str = None):
+    return hydrate(person.get_schedule(event_pk, activity_type))
+
+
+def get_assignments(event):
+    """
+    Все назначения людей на активности мероприятия одним запросом,
+    сгруппированные по людям и отсортированные по времени
+    """
+    return models.ActivityOnEvent.person.through.objects \
+        .filter(activityonevent__event=event) \
+        .select_related('person', 'activityonevent__activity') \
+        .order_by('person__last_name', 'person__first_name', 'person__pk',
+                  'activityonevent__start_dt', 'activityonevent__end_dt')
+
+
+def hydrate(schedule):
+    """
+    Расписание со всеми связанными объектами, которые используются при выводе строк:
+    активность, категория и участники. Количество запросов не зависит от числа строк
+    """
+    return schedule.select_related('activity__category') \
+        .prefetch_related('person') \
+        .order_by('start_dt', 'end_dt', 'pk')
+
+
 def __get_schedule(event_pk, activity_type: str = None):
-    return models.Event.objects.get(pk=event_pk).get_schedule(activity_type)
+    return hydrate(models.Event.objects.get(pk=event_pk).get_schedule(activity_type))
@@ -1,7 +1,22 @@
 OFFICIAL = 'official_schedule'
 VOLUNTEER = 'volunteer_schedule'
 OTHER = 'other'
+# страница покрытия волонтерского расписания, не тип активности
+COVERAGE = 'coverage'
 
 ACTIVITY_TYPE_CHOICES = [(OFFICIAL, 'Официальное расписание'),
                          (VOLUNTEER, 'Волонтерское расписание'),
                          (OTHER, 'Прочее')]
+
+PARTICIPATES = 'Участвует'
+UNAVAILABLE = 'Недоступен'
+UNKNOWN = '?'
+AVAILABLE = 'Доступен'
+
+# коды статусов в матрице доступности, код - индекс статуса в STATUSES
+AVAILABLE_CODE, PARTICIPATES_CODE, UNAVAILABLE_CODE, UNKNOWN_CODE = range(4)
+STATUSES = (AVAILABLE, PARTICIPATES, UNAVAILABLE, UNKNOWN)
+
+# размер окна строк матрицы по умолчанию и максимальный
+VOLUNTEER_WINDOW_LIMIT = 50
+VOLUNTEER_WINDOW_MAX_LIMIT = 500
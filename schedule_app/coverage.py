@@ -0,0 +1,141 @@
+"""
+Покрытие волонтерского расписания мероприятия: недоукомплектованные активности, окна без свободных людей,
+пиковая потребность в людях и заполненность по категориям.
+
+Считается тремя запросами (активности, назначения, состав) и одним проходом по отсортированным
+моментам изменений: начало и конец активностей меняют потребность, приезд и отъезд людей и их занятость -
+число свободных. Свободен человек из состава, который уже приехал, еще не уехал и ничем не занят;
+люди без дат приезда и отъезда свободными не считаются. Интервалы полуоткрытые, как в intervals.py.
+Матрица доступности при этом не строится
+"""
+from collections import defaultdict
+
+import schedule_app.constants as const
+from schedule_app import models
+from schedule_app.intervals import merge
+
+# индексы изменений в моменте времени
+DEMAND, RUNNING, FREE = range(3)
+
+
+class SlotCoverage:
+    __slots__ = ('pk', 'name', 'category', 'start_dt', 'end_dt', 'need', 'assigned')
+
+    def __init__(self, pk, name, category, start_dt, end_dt, need, assigned=0):
+        self.pk = pk
+        self.name = name
+        self.category = category
+        self.start_dt = start_dt
+        self.end_dt = end_dt
+        self.need = need
+        self.assigned = assigned
+
+    @property
+    def missing(self):
+        return max(0, self.need - self.assigned)
+
+    def as_dict(self):
+        return {'pk': self.pk, 'name': self.name, 'category': self.category, 'start_dt': self.start_dt,
+                'end_dt': self.end_dt, 'need': self.need, 'assigned': self.assigned, 'missing': self.missing}
+
+
+class Coverage:
+    def __init__(self, event, slots, assignments, persons):
+        """
+        slots - SlotCoverage волонтерских активностей, assignments - (pk активности, pk человека, начало, конец)
+        по всем активностям мероприятия, persons - (pk, приезд, отъезд) людей из состава
+        """
+        self.event = event
+        self.slots = sorted(slots, key=lambda slot: (slot.start_dt, slot.end_dt, slot.pk))
+
+        by_pk = {slot.pk: slot for slot in self.slots}
+        busy = defaultdict(list)
+        for slot_pk, person_pk, start_dt, end_dt in assignments:
+            if slot_pk in by_pk:
+                by_pk[slot_pk].assigned += 1
+            busy[person_pk].append((start_dt, end_dt))
+
+        changes = defaultdict(lambda: [0, 0, 0])
+        for slot in self.slots:
+            if slot.start_dt < slot.end_dt:
+                changes[slot.start_dt][DEMAND] += slot.need
+                changes[slot.end_dt][DEMAND] -= slot.need
+                changes[slot.start_dt][RUNNING] += 1
+                changes[slot.end_dt][RUNNING] -= 1
+
+        for person_pk, arrival, departure in persons:
+            if arrival is None or departure is None or arrival >= departure:
+                continue
+            changes[arrival][FREE] += 1
+            changes[departure][FREE] -= 1
+            # занятость учитывается только в пределах пребывания
+            for start, end in merge((max(start, arrival), min(end, departure)) for start, end in busy[person_pk]
+                                    if max(start, arrival) < min(end, departure)):
+                changes[start][FREE] -= 1
+                changes[end][FREE] += 1
+
+        self.no_free_windows = []
+        self.peak = None
+        demand = running = free = 0
+        moments = sorted(changes)
+        for moment, following in zip(moments, moments[1:]):
+            change = changes[moment]
+            demand, running, free = demand + change[DEMAND], running + change[RUNNING], free + change[FREE]
+
+            if running and free <= 0:
+                window = self.no_free_windows[-1] if self.no_free_windows else None
+                if window is not None and window['end_dt'] == moment:
+                    window['end_dt'] = following
+                    window['demand'] = max(window['demand'], demand)
+                else:
+                    self.no_free_windows.append({'start_dt': moment, 'end_dt': following, 'demand': demand})
+
+            if running and (self.peak is None or demand > self.peak['need']):
+                self.peak = {'need': demand, 'slots': running, 'start_dt': moment, 'end_dt': following}
+            elif self.peak is not None and self.peak['end_dt'] == moment and demand == self.peak['need']:
+                self.peak['end_dt'] = following
+
+    @classmethod
+    def for_event(cls, event):
+        slots = [SlotCoverage(pk, name, category, start_dt, end_dt, need or 0)
+                 for pk, name, category, start_dt, end_dt, need in models.ActivityOnEvent.objects
+                 .filter(event=event, activity_type_name=const.VOLUNTEER)
+                 .values_list('pk', 'activity__name', 'activity__category__name', 'start_dt', 'end_dt',
+                              'activity__need_peoples')]
+        assignments = models.ActivityOnEvent.person.through.objects \
+            .filter(activityonevent__event=event) \
+            .values_list('activityonevent_id', 'person_id', 'activityonevent__start_dt', 'activityonevent__end_dt')
+        persons = event.get_roster().values_list('pk', 'arrival_datetime', 'departure_datetime')
+        return cls(event, slots, assignments, persons)
+
+    @property
+    def understaffed(self):
+        return [slot for slot in self.slots if slot.missing]
+
+    def categories(self):
+        totals = defaultdict(lambda: {'slots': 0, 'need': 0, 'assigned': 0, 'missing': 0})
+        for slot in self.slots:
+            category = totals[slot.category]
+            category['slots'] += 1
+            category['need'] += slot.need
+            category['assigned'] += slot.assigned
+            category['missing'] += slot.missing
+        return [{'name': name, **values, 'fill_rate': fill_rate(values['need'], values['missing'])}
+                for name, values in sorted(totals.items())]
+
+    def as_dict(self):
+        need = sum(slot.need for slot in self.slots)
+        missing = sum(slot.missing for slot in self.slots)
+        return {'event': self.event.pk,
+                'slots': len(self.slots),
+                'need': need,
+                'missing': missing,
+                'fill_rate': fill_rate(need, missing),
+                'understaffed': [slot.as_dict() for slot in self.understaffed],
+                'no_free_windows': self.no_free_windows,
+                'peak_demand': self.peak,
+                'categories': self.categories()}
+
+
+def fill_rate(need, missing):
+    return (need - missing) / need if need else 1.0
@@ -0,0 +1,81 @@
+"""
+Поиск замены: кто свободен на активность и когда свободен человек.
+
+Занятость людей мероприятия собирается один раз (solver.load_event): у каждого человека - отсортированные
+по началу интервалы занятости, в которых пересечения ищутся бинарным поиском. Собранный индекс хранится
+в кэше по версии мероприятия (versions.py), поэтому поиск стоит запроса версии и чтения из кэша,
+а после любого изменения расписания или людей индекс собирается заново.
+
+Правила подбора те же, что у назначения в админке и у автозаполнения (solver.py): человек присутствует
+все время активности, не исключил категорию, свободен и укладывается в лимит свободного времени.
+Подходящие люди сортируются по solver.cost: сначала наименее загруженные
+"""
+from django.core.cache import cache
+
+import schedule_app.versions as versions
+from schedule_app import models
+from schedule_app.intervals import gaps
+from schedule_app.solver import SolverSlot, cost, load_event
+
+FINDER_KEY = 'free_slot_finder:{event_pk}:{version}'
+FINDER_TIMEOUT = 24 * 60 * 60
+
+
+class FreeSlotFinder:
+    def __init__(self, event):
+        self.event_pk = event.pk
+        self.candidates, slots = load_event(event)
+        self.slots = {slot.pk: slot for slot in slots}
+
+    @classmethod
+    def for_event(cls, event):
+        version = versions.event_version(None, event.pk)
+        key = FINDER_KEY.format(event_pk=event.pk, version=version.isoformat() if version else None)
+        finder = cache.get(key)
+        if finder is None:
+            finder = cls(event)
+            cache.set(key, finder, FINDER_TIMEOUT)
+        return finder
+
+    def make_slot(self, activity, start_dt, end_dt, pk=None):
+        """
+        Активность для подбора, в том числе еще не сохраненная или с измененным временем
+        """
+        category = activity.category
+        row = models.ActivityOnEvent(pk=pk, activity=activity, start_dt=start_dt, end_dt=end_dt,
+                                     activity_type_name=category.activity_type.name,
+                                     accounted_duration=category.accounted_duration(end_dt - start_dt))
+        stored = self.slots.get(pk)
+        return SolverSlot(row, set(stored.person_pks) if stored is not None else set())
+
+    def is_available(self, candidate, slot):
+        # сама активность в занятости не учитывается: ее могли перенести
+        if slot.category_pk in candidate.excluded or candidate.pk in slot.person_pks \
+                or not candidate.is_present(slot):
+            return False
+        if slot.is_volunteer and not candidate.has_time_for(slot):
+            return False
+        return all(busy[2] == slot.pk for busy in candidate.conflicts(slot))
+
+    def candidates_for(self, slot, limit=None):
+        """
+        Свободные на активность люди: [(pk человека, стоимость)] по возрастанию стоимости
+        """
+        ranked = sorted((cost(candidate, slot), candidate.pk) for candidate in self.candidates.values()
+                        if self.is_available(candidate, slot))
+        return [(pk, value) for value, pk in ranked[:limit]]
+
+    def free_windows(self, person_pk, start_dt=None, end_dt=None, min_duration=None):
+        """
+        Свободные промежутки человека в пределах его пребывания и [start_dt, end_dt)
+        """
+        candidate = self.candidates.get(person_pk)
+        if candidate is None or candidate.arrival_datetime is None or candidate.departure_datetime is None:
+            return []
+
+        start = max(candidate.arrival_datetime, start_dt) if start_dt else candidate.arrival_datetime
+        end = min(candidate.departure_datetime, end_dt) if end_dt else candidate.departure_datetime
+        windows = gaps(((busy_start, busy_end) for busy_start, busy_end, _ in candidate.busy), start, end)
+        if min_duration is not None:
+            windows = [(start, end) for start, end in windows if end - start >= min_duration]
+        return windows
@@ -1,11 +1,12 @@
 import datetime as dt
 
 from django.core.exceptions import ValidationError
-from django.forms import ModelForm
+from django.db import OperationalError, transaction
+from django.forms import FileField, Form, ModelForm
 
-import schedule_app.constants as const
+import schedule_app.assignment as assignment
 from schedule_app import models
-from schedule_app.utils import is_intersects, get_duration_with_coef
+from schedule_app.validation import AssignmentValidator
 
 
 class CategoryForm(ModelForm):
@@ -29,7 +30,18 @@ class ActivityForm(ModelForm):
 class EventForm(ModelForm):
     class Meta:
         model = models.Event
-        fields = ('title', 'start_date', 'end_date')
+        fields = ('title', 'start_date', 'end_date', 'participants')
+
+
+class ScheduleImportForm(Form):
+    persons = FileField(required=False, label='Люди (CSV)')
+    schedule = FileField(required=False, label='Расписание (CSV)')
+
+    def clean(self):
+        super(ScheduleImportForm, self).clean()
+        if not self.cleaned_data.get('persons') and not self.cleaned_data.get('schedule'):
+            raise ValidationError('Нужен хотя бы один файл')
+        return self.cleaned_data
 
 
 class PersonForm(ModelForm):
@@ -39,11 +51,6 @@ class PersonForm(ModelForm):
                   'arrival_datetime', 'departure_datetime', 'excluded_categories')
 
 
-def check_excluded_categories(cleaned_data, person):
-    if person.excluded_categories.filter(pk=cleaned_data.get('activity').category.pk):
-        raise ValidationError({'person': f'{person.first_name} не изволит работать с этой категорией активностей.'})
-
-
 def check_person_incoming_dates(cleaned_data, person):
     full_name = f'{person.first_name} {person.last_name}'
 
@@ -64,43 +71,6 @@ def check_person_incoming_dates(cleaned_data, person):
         })
 
 
-def check_intersections(cleaned_data, person, existing_instance):
-    start_dt = cleaned_data.get('start_dt')
-    end_dt = cleaned_data.get('end_dt')
-    activities = person.get_schedule(cleaned_data.get('event').pk)
-
-    for act in activities:
-        if is_intersects(start_dt, end_dt, act, existing_instance):
-            act_detail = f'{act.activity.name} ({act.start_dt.strftime("%H:%M:%S")} - ' \
-                         f'{act.end_dt.strftime("%H:%M:%S")})'
-            raise ValidationError({
-                'start_dt': f'Пересечение с другой активностью: {act_detail})',
-                'end_dt': f'Пересечение с другой активностью: {act_detail})'
-            })
-
-
-def check_free_time_limit(cleaned_data, person):
-    start_dt = cleaned_data.get('start_dt')
-    end_dt = cleaned_data.get('end_dt')
-    activities = person.get_schedule(cleaned_data.get('event').pk, const.VOLUNTEER)
-
-    time_params = {'duration': end_dt - start_dt,
-                   'time_coef': float(cleaned_data.get('activity').category.time_coefficient),
-                   'additional_time': cleaned_data.get('activity').category.additional_time}
-
-    activities_sum = get_duration_with_coef(**time_params)
-
-    for act in activities:
-        time_params = {'duration': act.duration(),
-                       'time_coef': float(act.activity.category.time_coefficient),
-                       'additional_time': act.activity.category.additional_time}
-
-        activities_sum += get_duration_with_coef(**time_params)
-
-    if activities_sum > person.free_time_limit:
-        raise ValidationError({'start_dt': 'Недостаточно свободного времени'})
-
-
 class ActivityOnEventForm(ModelForm):
     class Meta:
         model = models.ActivityOnEvent
@@ -108,20 +78,32 @@ class ActivityOnEventForm(ModelForm):
 
     def __init__(self, *args, **kwargs):
         super(ActivityOnEventForm, self).__init__(*args, **kwargs)
-        latest_event = models.Event.objects.latest('start_date')
+        # начальные значения нужны только новой активности
+        if self.instance.pk is not None:
+            return
+        latest_event = models.Event.objects.order_by('-start_date').first()
+        if latest_event is None:
+            return
         self.fields['event'].initial = latest_event
-        self.fields['start_dt'].initial = dt.datetime.combine(models.Event.objects.latest('start_date').start_date,
-                                                              dt.time(9, 0, 0))
-        self.fields['end_dt'].initial = dt.datetime.combine(models.Event.objects.latest('start_date').start_date,
-                                                            dt.time(10, 0, 0))
+        self.fields['start_dt'].initial = dt.datetime.combine(latest_event.start_date, dt.time(9, 0, 0))
+        self.fields['end_dt'].initial = dt.datetime.combine(latest_event.start_date, dt.time(10, 0, 0))
 
     def clean(self):
         super(ActivityOnEventForm, self).clean()
         persons = self.cleaned_data.get('person')
-        for p in persons:
-            check_excluded_categories(self.cleaned_data, p)
-            if self.cleaned_data.get('activity').activity_type.name == const.VOLUNTEER:
-                check_free_time_limit(self.cleaned_data, p)
-            check_intersections(self.cleaned_data, p, self.instance)
+        required = [self.cleaned_data.get(field) for field in ('event', 'activity', 'start_dt', 'end_dt')]
+        if not persons or not all(required):
+            return self.cleaned_data
+
+        # в админке форма проверяется и сохраняется в одной транзакции, блокировка держится до сохранения.
+        # На SQLite проигравший из одновременных запросов не получает блокировку записи (в режиме WAL - сразу,
+        # транзакция уже читала): повторить можно только новым запросом
+        try:
+            with transaction.atomic():
+                assignment.lock_persons(person.pk for person in persons)
+        except OperationalError:
+            raise ValidationError('Этих людей сейчас назначает другой координатор, сохраните форму еще раз')
+        validator = AssignmentValidator(*required, instance=self.instance)
+        validator.validate(persons)
 
         return self.cleaned_data
@@ -0,0 +1,345 @@
+"""
+Массовый импорт людей, активностей и расписания мероприятия из CSV (выгрузки исходной таблицы).
+
+Файл людей: first_name, last_name, email, arrival, departure, free_time_limit (часы), night_man,
+excluded_categories (названия категорий через ";").
+Файл расписания: activity, category, description, need_peoples, start, end,
+persons ("Фамилия Имя" через ";").
+
+Все строки сначала разбираются и проверяются в памяти по тем же правилам, что и ручное назначение
+в админке: исключенные категории, присутствие на мероприятии, пересечения и лимит свободного времени.
+Существующие данные загружаются постоянным числом запросов, ошибки собираются по всем строкам.
+Проверка и запись выполняются в одной транзакции, а уже существующие люди из файла блокируются
+до чтения их расписаний (assignment.lock_persons), как при назначении в админке.
+Если ошибок нет, все записывается bulk_create
+"""
+import csv
+import datetime
+from collections import defaultdict
+from decimal import Decimal, InvalidOperation
+
+from django.core.exceptions import ValidationError
+from django.db import transaction
+from django.utils.dateparse import parse_datetime
+
+import schedule_app.assignment as assignment
+import schedule_app.constants as const
+import schedule_app.live as live
+import schedule_app.matrix_cache as matrix_cache
+import schedule_app.versions as versions
+import schedule_app.workload as workload
+from schedule_app import models
+from schedule_app.intervals import conflicts
+
+PERSON_COLUMNS = ('first_name', 'last_name', 'email', 'arrival', 'departure', 'free_time_limit', 'night_man',
+                  'excluded_categories')
+SCHEDULE_COLUMNS = ('activity', 'category', 'description', 'need_peoples', 'start', 'end', 'persons')
+DATETIME_FORMATS = ('%Y-%m-%d %H:%M', '%d.%m.%Y %H:%M')
+TRUE_VALUES = ('1', 'да', 'yes', 'true', '+')
+
+
+def parse_dt(value):
+    value = value.strip()
+    for dt_format in DATETIME_FORMATS:
+        try:
+            return datetime.datetime.strptime(value, dt_format)
+        except ValueError:
+            pass
+    parsed = parse_datetime(value)
+    if parsed is None:
+        raise ValueError(f'некорректная дата "{value}"')
+    return parsed
+
+
+def split_list(value):
+    return [item.strip() for item in (value or '').split(';') if item.strip()]
+
+
+def person_key(last_name, first_name):
+    return last_name.strip().lower(), first_name.strip().lower()
+
+
+def bulk_insert(model, objs):
+    """
+    bulk_create с заполнением pk внутри транзакции: SQLite в Django 3.2 не возвращает их из вставки.
+    Новые строки - последние len(objs) по pk: с первой вставки транзакция держит блокировку записи SQLite,
+    и чужие строки не могут появиться ни между пакетами, ни после них до фиксации
+    """
+    if not objs:
+        return objs
+    model.objects.bulk_create(objs)
+    if objs[0].pk is None:
+        pks = model.objects.order_by('-pk').values_list('pk', flat=True)[:len(objs)]
+        for obj, pk in zip(objs, reversed(pks)):
+            obj.pk = pk
+    return objs
+
+
+class ImportedSlot:
+    __slots__ = ('line', 'activity_name', 'activity_key', 'category', 'description', 'need_peoples',
+                 'start_dt', 'end_dt', 'person_keys')
+
+    def __init__(self, line, activity_name, category, description, need_peoples, start_dt, end_dt, person_keys):
+        self.line = line
+        self.activity_name = activity_name
+        self.activity_key = (activity_name.lower(), category.pk)
+        self.category = category
+        self.description = description
+        self.need_peoples = need_peoples
+        self.start_dt = start_dt
+        self.end_dt = end_dt
+        self.person_keys = person_keys
+
+
+class ScheduleImporter:
+    def __init__(self, event):
+        self.event = event
+        self.errors = []
+        self.new_persons = {}
+        self.new_excluded = defaultdict(set)
+        self.slots = []
+
+        self.categories = {category.name.strip().lower(): category
+                           for category in models.Category.objects.select_related('activity_type')}
+        self.persons = defaultdict(list)
+        for person in models.Person.objects.all():
+            self.persons[person_key(person.last_name, person.first_name)].append(person)
+
+    def error(self, source, line, message):
+        self.errors.append(f'{source}, строка {line}: {message}' if line else f'{source}: {message}')
+
+    def read(self, file, columns, source):
+        reader = csv.DictReader(file)
+        missing = [column for column in columns if column not in (reader.fieldnames or [])]
+        if missing:
+            self.error(source, 1, f'нет столбцов {", ".join(missing)}')
+            return []
+        # строка 1 - заголовок
+        return [(line, {key: (value or '').strip() for key, value in row.items() if key})
+                for line, row in enumerate(reader, start=2)]
+
+    def read_persons(self, file):
+        for line, row in self.read(file, PERSON_COLUMNS, 'Люди'):
+            key = person_key(row['last_name'], row['first_name'])
+            if not all(key):
+                self.error('Люди', line, 'не заполнены имя или фамилия')
+                continue
+            if key in self.persons or key in self.new_persons:
+                continue
+
+            try:
+                person = models.Person(first_name=row['first_name'], last_name=row['last_name'],
+                                       email=row['email'] or None,
+                                       night_man=row['night_man'].lower() in TRUE_VALUES,
+                                       arrival_datetime=parse_dt(row['arrival']) if row['arrival'] else None,
+                                       departure_datetime=parse_dt(row['departure']) if row['departure'] else None)
+                if row['free_time_limit']:
+                    person.free_time_limit = datetime.timedelta(hours=float(Decimal(row['free_time_limit'])))
+            except (ValueError, InvalidOperation) as e:
+                self.error('Люди', line, str(e))
+                continue
+
+            for name in split_list(row['excluded_categories']):
+                category = self.categories.get(name.lower())
+                if category is None:
+                    self.error('Люди', line, f'нет категории "{name}"')
+                else:
+                    self.new_excluded[key].add(category.pk)
+            self.new_persons[key] = person
+
+    def read_schedule(self, file):
+        for line, row in self.read(file, SCHEDULE_COLUMNS, 'Расписание'):
+            category = self.categories.get(row['category'].lower())
+            if category is None:
+                self.error('Расписание', line, f'нет категории "{row["category"]}"')
+                continue
+            if not row['activity']:
+                self.error('Расписание', line, 'не заполнено название активности')
+                continue
+
+            try:
+                start_dt, end_dt = parse_dt(row['start']), parse_dt(row['end'])
+                need_peoples = int(row['need_peoples']) if row['need_peoples'] else None
+            except ValueError as e:
+                self.error('Расписание', line, str(e))
+                continue
+            if start_dt >= end_dt:
+                self.error('Расписание', line, 'начало активности не раньше ее окончания')
+                continue
+
+            person_keys = []
+            for name in split_list(row['persons']):
+                last_name, _, first_name = name.partition(' ')
+                key = person_key(last_name, first_name)
+                if key not in self.new_persons and len(self.persons.get(key, ())) != 1:
+                    problem = 'не найден' if key not in self.persons else 'найден несколько раз'
+                    self.error('Расписание', line, f'человек "{name}" {problem}')
+                else:
+                    person_keys.append(key)
+
+            self.slots.append(ImportedSlot(line, row['activity'], category,
+                                           row['description'] or None, need_peoples, start_dt, end_dt, person_keys))
+
+    def people(self):
+        """
+        Все люди из файла расписания: {ключ (фамилия, имя): Person}, новые - еще без pk
+        """
+        return {key: self.new_persons.get(key) or self.persons[key][0]
+                for slot in self.slots for key in slot.person_keys}
+
+    def lock(self):
+        """
+        Блокировка существующих людей из файла расписания до конца транзакции. Их даты и лимиты
+        перечитываются после блокировки, чтобы проверка шла по актуальным данным
+        """
+        existing = {key: person for key, person in self.people().items() if person.pk is not None}
+        person_pks = [person.pk for person in existing.values()]
+        assignment.lock_persons(person_pks)
+        fresh = models.Person.objects.in_bulk(person_pks)
+        for key, person in existing.items():
+            if person.pk in fresh:
+                self.persons[key] = [fresh[person.pk]]
+            else:
+                self.error('Расписание', None, f'{person} удален во время импорта')
+
+    def validate(self):
+        """
+        Проверка всех назначений из файла расписания разом, возвращает список всех ошибок.
+        Выполняется в транзакции записи после lock
+        """
+        people = self.people()
+        keys = {person.pk: key for key, person in people.items() if person.pk is not None}
+        person_pks = list(keys)
+
+        excluded = defaultdict(set, self.new_excluded)
+        for person_pk, category_pk in models.Person.excluded_categories.through.objects \
+                .filter(person_id__in=person_pks).values_list('person_id', 'category_id'):
+            excluded[keys[person_pk]].add(category_pk)
+
+        # занятость: (начало, конец, строка файла или None для уже назначенных, название активности)
+        busy = defaultdict(list)
+        for person_pk, start_dt, end_dt, name in models.ActivityOnEvent.person.through.objects \
+                .filter(person_id__in=person_pks, activityonevent__event=self.event) \
+                .values_list('person_id', 'activityonevent__start_dt', 'activityonevent__end_dt',
+                             'activityonevent__activity__name'):
+            busy[keys[person_pk]].append((start_dt, end_dt, None, name))
+        used = defaultdict(lambda: datetime.timedelta(0))
+        for person_pk, accounted_time in workload.get_totals(self.event.pk, person_pks).items():
+            used[keys[person_pk]] = accounted_time
+
+        existing_slots = {(name.lower(), category_pk, start_dt, end_dt)
+                          for name, category_pk, start_dt, end_dt in models.ActivityOnEvent.objects
+                          .filter(event=self.event)
+                          .values_list('activity__name', 'activity__category_id', 'start_dt', 'end_dt')}
+
+        for slot in self.slots:
+            slot_key = (*slot.activity_key, slot.start_dt, slot.end_dt)
+            if slot_key in existing_slots:
+                self.error('Расписание', slot.line, 'такая активность уже есть в расписании')
+            existing_slots.add(slot_key)
+
+            category = slot.category
+            accounted_time = category.accounted_duration(slot.end_dt - slot.start_dt)
+            for key in slot.person_keys:
+                person = people[key]
+                if category.pk in excluded[key]:
+                    self.error('Расписание', slot.line, f'{person} не изволит работать с категорией {category}')
+                if not person.arrive_and_depart_filled():
+                    self.error('Расписание', slot.line, f'у {person} не заполнено время приезда и отъезда')
+                elif not person.arrival_datetime <= slot.start_dt < slot.end_dt <= person.departure_datetime:
+                    self.error('Расписание', slot.line, f'{person} не будет на {self.event} в это время')
+
+                busy[key].append((slot.start_dt, slot.end_dt, slot.line, slot.activity_name))
+                if category.activity_type.name == const.VOLUNTEER:
+                    used[key] += accounted_time
+
+        # пересечения полуоткрытых интервалов; ошибка приписывается позже начавшейся активности из файла
+        owners, items = [], []
+        for key, intervals in busy.items():
+            owners.extend([key] * len(intervals))
+            items.extend(intervals)
+        for key, pairs in conflicts([item[0] for item in items], [item[1] for item in items], owners).items():
+            for i, j in pairs:
+                other, interval = sorted((items[i], items[j]), key=lambda item: item[:2])
+                if interval[2] is None:
+                    other, interval = interval, other
+                if interval[2] is not None:
+                    self.error('Расписание', interval[2], f'пересечение у {people[key]} с активностью {other[3]} '
+                                                          f'({other[0]:%d.%m %H:%M} - {other[1]:%H:%M})')
+
+        for key, accounted_time in used.items():
+            if accounted_time > people[key].free_time_limit:
+                self.error('Расписание', None, f'недостаточно свободного времени у {people[key]}')
+
+        return self.errors
+
+    def save(self):
+        """
+        Запись разобранных данных в транзакции проверки;
+        возвращает число созданных людей, активностей, слотов и назначений
+        """
+        persons = bulk_insert(models.Person, list(self.new_persons.values()))
+        excluded = models.Person.excluded_categories.through
+        excluded.objects.bulk_create([excluded(person_id=self.new_persons[key].pk, category_id=category_pk)
+                                      for key, category_pks in self.new_excluded.items()
+                                      for category_pk in category_pks])
+        participants = models.Event.participants.through
+        participants.objects.bulk_create([participants(event_id=self.event.pk, person_id=person.pk)
+                                          for person in persons])
+
+        activities = {(activity.name.lower(), activity.category_id): activity
+                      for activity in models.Activity.objects
+                      .filter(category_id__in={slot.category.pk for slot in self.slots})}
+        new_activities = {}
+        for slot in self.slots:
+            if slot.activity_key not in activities and slot.activity_key not in new_activities:
+                new_activities[slot.activity_key] = models.Activity(name=slot.activity_name, category=slot.category,
+                                                                    description=slot.description,
+                                                                    need_peoples=slot.need_peoples)
+        bulk_insert(models.Activity, list(new_activities.values()))
+        activities.update(new_activities)
+
+        # bulk_create не вызывает ActivityOnEvent.save, тип активности и учетное время заполняются здесь
+        rows = bulk_insert(models.ActivityOnEvent, [
+            models.ActivityOnEvent(event=self.event, activity=activities[slot.activity_key],
+                                   activity_type_name=slot.category.activity_type.name,
+                                   accounted_duration=slot.category.accounted_duration(slot.end_dt - slot.start_dt),
+                                   start_dt=slot.start_dt, end_dt=slot.end_dt)
+            for slot in self.slots])
+
+        people = self.people()
+        assignments = models.ActivityOnEvent.person.through
+        links = assignments.objects.bulk_create([assignments(activityonevent_id=row.pk, person_id=people[key].pk)
+                                                 for row, slot in zip(rows, self.slots)
+                                                 for key in slot.person_keys])
+
+        # bulk_create не отправляет сигналы: кэш, нагрузка, версии и живые обновления - явно
+        person_pks = {link.person_id for link in links} | {person.pk for person in persons}
+        workload.recompute([self.event.pk], person_pks)
+        versions.touch([self.event.pk], person_pks)
+        live.publish_slots([self.event.pk], person_pks, [row.pk for row in rows])
+        matrix_cache.invalidate(self.event.pk)
+        return len(persons), len(new_activities), len(rows), len(links)
+
+
+def import_schedule(event, persons_file=None, schedule_file=None, dry_run=False):
+    """
+    Импорт файлов в мероприятие event. При любой ошибке в данных ничего не записывается
+    и выбрасывается ValidationError со всеми ошибками. Файлы - текстовые потоки CSV
+    """
+    importer = ScheduleImporter(event)
+    if persons_file is not None:
+        importer.read_persons(persons_file)
+    if schedule_file is not None:
+        importer.read_schedule(schedule_file)
+
+    with transaction.atomic():
+        importer.lock()
+        importer.validate()
+        if importer.errors:
+            raise ValidationError(importer.errors)
+        counts = importer.save()
+        # пробный прогон записывает все и откатывает транзакцию, чтобы посчитать создаваемое
+        if dry_run:
+            transaction.set_rollback(True)
+    return counts
@@ -0,0 +1,81 @@
+"""
+Пересечения интервалов времени.
+
+Интервалы полуоткрытые, [начало, конец): активности, идущие встык, не пересекаются,
+пустой интервал (начало == конец) не пересекается ни с чем.
+Значения - любые сравнимые между собой метки времени: datetime, секунды, минуты.
+
+Пакетные функции сортируют интервалы по началу один раз, а пары для каждого интервала
+находят бинарным поиском по отсортированным началам, так что время - O(n log n + число пар)
+вместо попарного сравнения всех интервалов
+"""
+import bisect
+from collections import defaultdict
+
+
+def overlaps(start, end, other_start, other_end):
+    return start < other_end and other_start < end and start < end and other_start < other_end
+
+
+def merge(intervals):
+    """
+    Объединение пересекающихся и смежных интервалов: отсортированный список [начало, конец]
+    """
+    merged = []
+    for start, end in sorted(intervals):
+        if merged and start <= merged[-1][1]:
+            merged[-1][1] = max(merged[-1][1], end)
+        else:
+            merged.append([start, end])
+    return merged
+
+
+def gaps(intervals, start, end):
+    """
+    Промежутки внутри [start, end), не покрытые интервалами
+    """
+    result = []
+    for busy_start, busy_end in merge(intervals):
+        if busy_end <= start:
+            continue
+        if busy_start >= end:
+            break
+        if busy_start > start:
+            result.append((start, busy_start))
+        start = max(start, busy_end)
+    if start < end:
+        result.append((start, end))
+    return result
+
+
+def overlapping_pairs(starts, ends):
+    """
+    Все пары пересекающихся интервалов: список (i, j), i < j - индексы в starts и ends
+    """
+    order = sorted((i for i in range(len(starts)) if starts[i] < ends[i]), key=starts.__getitem__)
+    sorted_starts = [starts[i] for i in order]
+
+    pairs = []
+    for position, i in enumerate(order):
+        # интервалы, начавшиеся позже i, пересекаются с ним, пока начинаются до его конца
+        last = bisect.bisect_left(sorted_starts, ends[i], lo=position + 1)
+        pairs.extend((i, j) if i < j else (j, i) for j in order[position + 1:last])
+    return pairs
+
+
+def conflicts(starts, ends, owners):
+    """
+    Пересечения внутри каждого владельца (например, человека): {владелец: [(i, j), ...]}.
+    owners[i] - владелец интервала i; у интервала с несколькими участниками он повторяется
+    в starts, ends и owners по разу на каждого
+    """
+    groups = defaultdict(list)
+    for i, owner in enumerate(owners):
+        groups[owner].append(i)
+
+    result = {}
+    for owner, indexes in groups.items():
+        pairs = overlapping_pairs([starts[i] for i in indexes], [ends[i] for i in indexes])
+        if pairs:
+            result[owner] = [(indexes[i], indexes[j]) for i, j in pairs]
+    return result
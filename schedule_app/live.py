@@ -0,0 +1,110 @@
+"""
+Живые обновления расписаний: публикация изменений активностей и подписка на них.
+
+Изменения ActivityOnEvent и назначений людей (signals.py, массовые операции importer.py и solver.py)
+после фиксации транзакции публикуются в каналы их мероприятий и людей. Страницы расписания
+подписываются на канал через server-sent events (sse.py) и перерисовывают только затронутые строки.
+
+Брокер по умолчанию (LocalBroker) работает внутри процесса, поэтому публикация и подписчики должны быть
+в одном процессе ASGI-сервера. Для нескольких процессов в LIVE_BROKER задается класс с теми же методами
+publish и subscribe поверх локального брокера сообщений
+"""
+import asyncio
+import threading
+from collections import defaultdict
+from contextlib import asynccontextmanager
+
+from django.conf import settings
+from django.db import transaction
+from django.utils.module_loading import import_string
+
+# сообщение отстающему подписчику вместо потерянных: страница перезагружается целиком
+RELOAD = {'reload': True}
+
+_broker = None
+_broker_lock = threading.Lock()
+
+
+def channel(kind, pk):
+    return f'{kind}:{pk}'
+
+
+class Subscription:
+    def __init__(self, loop, maxsize):
+        self.loop = loop
+        self.queue = asyncio.Queue(maxsize)
+
+    def put(self, message):
+        if self.queue.full():
+            while not self.queue.empty():
+                self.queue.get_nowait()
+            message = RELOAD
+        self.queue.put_nowait(message)
+
+    async def get(self):
+        return await self.queue.get()
+
+
+class LocalBroker:
+    """
+    Публикация и подписка внутри процесса. publish вызывается из любого потока (сигналы выполняются
+    в потоках пула), сообщение передается в цикл событий каждого подписчика
+    """
+
+    def __init__(self, queue_size=100):
+        self.queue_size = queue_size
+        self.subscriptions = defaultdict(set)
+        self.lock = threading.Lock()
+
+    def publish(self, name, message):
+        with self.lock:
+            subscriptions = list(self.subscriptions.get(name, ()))
+        for subscription in subscriptions:
+            try:
+                subscription.loop.call_soon_threadsafe(subscription.put, message)
+            except RuntimeError:
+                # цикл событий подписчика уже закрыт
+                pass
+
+    @asynccontextmanager
+    async def subscribe(self, *names):
+        subscription = Subscription(asyncio.get_running_loop(), self.queue_size)
+        with self.lock:
+            for name in names:
+                self.subscriptions[name].add(subscription)
+        try:
+            yield subscription
+        finally:
+            with self.lock:
+                for name in names:
+                    self.subscriptions[name].discard(subscription)
+                    if not self.subscriptions[name]:
+                        del self.subscriptions[name]
+
+
+def get_broker():
+    global _broker
+    with _broker_lock:
+        if _broker is None:
+            _broker = import_string(settings.LIVE_BROKER)()
+        return _broker
+
+
+def publish_slots(event_pks, person_pks, slot_pks):
+    """
+    Изменились активности slot_pks мероприятий event_pks с участием людей person_pks.
+    Сообщение уходит после фиксации транзакции, при откате - не уходит
+    """
+    message = {'events': sorted(set(event_pks) - {None}),
+               'persons': sorted(set(person_pks) - {None}),
+               'slots': sorted(set(slot_pks) - {None})}
+    if message['events'] and message['slots']:
+        transaction.on_commit(lambda: send(message))
+
+
+def send(message):
+    broker = get_broker()
+    for pk in message['events']:
+        broker.publish(channel('event', pk), message)
+    for pk in message['persons']:
+        broker.publish(channel('person', pk), message)
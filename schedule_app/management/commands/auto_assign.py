@@ -0,0 +1,29 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from schedule_app import models
+from schedule_app.solver import auto_assign
+
+
+class Command(BaseCommand):
+    help = 'Автоматически заполняет незаполненные волонтерские активности мероприятия'
+
+    def add_arguments(self, parser):
+        parser.add_argument('event_pk', type=int)
+        parser.add_argument('--dry-run', action='store_true', help='Только показать назначения, не сохраняя их')
+
+    def handle(self, *args, **options):
+        try:
+            event = models.Event.objects.get(pk=options['event_pk'])
+        except models.Event.DoesNotExist:
+            raise CommandError(f'Мероприятие {options["event_pk"]} не найдено')
+
+        assigner, assignments = auto_assign(event, dry_run=options['dry_run'])
+
+        persons = {person.pk: person for person in event.get_roster()}
+        for slot in assigner.slots:
+            if slot.pk in assignments:
+                names = ', '.join(str(persons[pk]) for pk in sorted(assignments[slot.pk]))
+                self.stdout.write(f'{slot.start_dt:%d.%m %H:%M} - {slot.end_dt:%H:%M} (#{slot.pk}): {names}')
+
+        added = sum(len(person_pks) for person_pks in assignments.values())
+        self.stdout.write(self.style.SUCCESS(f'Назначено: {added}, заполненность: {assigner.fill_rate():.0%}'))
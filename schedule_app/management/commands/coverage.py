@@ -0,0 +1,43 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+from django.core.serializers.json import DjangoJSONEncoder
+
+from schedule_app import models
+from schedule_app.coverage import Coverage
+
+
+class Command(BaseCommand):
+    help = 'Показывает покрытие волонтерского расписания мероприятия: кого не хватает и когда'
+
+    def add_arguments(self, parser):
+        parser.add_argument('event_pk', type=int)
+        parser.add_argument('--json', action='store_true', help='Вывести отчет в JSON')
+
+    def handle(self, *args, **options):
+        try:
+            event = models.Event.objects.get(pk=options['event_pk'])
+        except models.Event.DoesNotExist:
+            raise CommandError(f'Мероприятие {options["event_pk"]} не найдено')
+
+        report = Coverage.for_event(event).as_dict()
+        if options['json']:
+            self.stdout.write(json.dumps(report, cls=DjangoJSONEncoder, ensure_ascii=False, indent=2))
+            return
+
+        for category in report['categories']:
+            self.stdout.write(f'{category["name"]}: активностей {category["slots"]}, нужно {category["need"]}, '
+                              f'назначено {category["assigned"]}, не хватает {category["missing"]}')
+        for window in report['no_free_windows']:
+            self.stdout.write(f'Нет свободных людей: {window["start_dt"]:%d.%m %H:%M} - '
+                              f'{window["end_dt"]:%d.%m %H:%M}, нужно {window["demand"]}')
+        for slot in report['understaffed']:
+            self.stdout.write(f'{slot["start_dt"]:%d.%m %H:%M} - {slot["end_dt"]:%H:%M} {slot["name"]} '
+                              f'(#{slot["pk"]}): {slot["assigned"]}/{slot["need"]}')
+
+        peak = report['peak_demand']
+        if peak is not None:
+            self.stdout.write(f'Пик потребности: {peak["need"]} на {peak["slots"]} активностях, '
+                              f'{peak["start_dt"]:%d.%m %H:%M} - {peak["end_dt"]:%d.%m %H:%M}')
+        style = self.style.SUCCESS if not report['missing'] else self.style.WARNING
+        self.stdout.write(style(f'Заполнено {report["fill_rate"]:.0%}, не хватает {report["missing"]}'))
@@ -0,0 +1,40 @@
+from django.core.exceptions import ValidationError
+from django.core.management.base import BaseCommand, CommandError
+
+from schedule_app import models
+from schedule_app.importer import import_schedule
+
+
+class Command(BaseCommand):
+    help = 'Импортирует людей и расписание мероприятия из CSV-файлов (см. schedule_app/importer.py)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('event_pk', type=int)
+        parser.add_argument('--persons', help='CSV с людьми')
+        parser.add_argument('--schedule', help='CSV с расписанием')
+        parser.add_argument('--dry-run', action='store_true', help='Только проверить файлы, ничего не сохраняя')
+
+    def handle(self, *args, **options):
+        try:
+            event = models.Event.objects.get(pk=options['event_pk'])
+        except models.Event.DoesNotExist:
+            raise CommandError(f'Мероприятие {options["event_pk"]} не найдено')
+        if not options['persons'] and not options['schedule']:
+            raise CommandError('Нужен хотя бы один файл: --persons или --schedule')
+
+        files = {name: open(options[name], encoding='utf-8-sig', newline='')
+                 for name in ('persons', 'schedule') if options[name]}
+        try:
+            persons, activities, slots, assignments = import_schedule(event, files.get('persons'),
+                                                                      files.get('schedule'), options['dry_run'])
+        except ValidationError as e:
+            for message in e.messages:
+                self.stderr.write(message)
+            raise CommandError(f'Ошибок: {len(e.messages)}, ничего не сохранено')
+        finally:
+            for file in files.values():
+                file.close()
+
+        prefix = 'Будет создано' if options['dry_run'] else 'Создано'
+        self.stdout.write(self.style.SUCCESS(f'{prefix}: людей {persons}, активностей {activities}, '
+                                             f'слотов {slots}, назначений {assignments}'))
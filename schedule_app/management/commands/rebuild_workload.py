@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from schedule_app import workload
+
+
+class Command(BaseCommand):
+    help = 'Пересчитывает хранимую нагрузку людей по мероприятиям или сверяет ее с расписанием'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--verify', action='store_true', help='Только сверить, ничего не меняя')
+
+    def handle(self, *args, **options):
+        if not options['verify']:
+            workload.recompute()
+
+        mismatches = workload.verify()
+        for (event_pk, person_pk), (stored, expected) in sorted(mismatches.items()):
+            self.stdout.write(f'Мероприятие {event_pk}, человек {person_pk}: хранится {stored}, должно быть {expected}')
+
+        if mismatches:
+            raise CommandError(f'Расхождений: {len(mismatches)}')
+        self.stdout.write(self.style.SUCCESS('Нагрузка совпадает с расписанием'))
@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from schedule_app import models
+
+
+class Command(BaseCommand):
+    help = 'Заполняет ActivityOnEvent.activity_type_name по типам категорий активностей'
+
+    def handle(self, *args, **options):
+        models.ActivityOnEvent.sync_activity_type_name()
+        self.stdout.write(self.style.SUCCESS('Типы активностей в расписании обновлены'))
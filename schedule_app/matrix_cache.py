@@ -0,0 +1,116 @@
+"""
+Кэш волонтерской матрицы мероприятия.
+
+Матрица хранится в кэше Django бессрочно и инвалидируется сигналами (см. signals.py).
+Сигналы только помечают измененные активности и людей, пересчет откладывается до следующего
+запроса страницы и затрагивает лишь помеченные столбцы и строки.
+
+Пометки и сбросы записываются после фиксации транзакции, поэтому пересчет по пометке всегда видит
+зафиксированные данные. Каждая пометка получает номер из счетчика мероприятия (cache.incr) и хранится
+под своим ключом, а матрица - вместе с номером последней примененной пометки. Пометки не удаляются при
+пересчете: одновременные пересчеты не теряют чужих пометок, а матрица, перезаписанная более старой,
+догоняет их при следующем запросе.
+
+Матрица строится и пересчитывается по основной базе, даже если страница читает с реплики: отстающая реплика
+дала бы устаревшую матрицу, которая считалась бы актуальной до следующей пометки
+"""
+from django.core.cache import cache
+from django.db import transaction
+
+from adentro_schedule.db import primary_reads
+
+from schedule_app.availability import VolunteerMatrix
+
+MATRIX_KEY = 'volunteer_matrix:{generation}:{event_pk}'
+DIRTY_KEY = 'volunteer_matrix_dirty:{event_pk}:{number}'
+DIRTY_COUNTER_KEY = 'volunteer_matrix_dirty:{event_pk}'
+GENERATION_KEY = 'volunteer_matrix_generation'
+# пометка старше суток не нужна ни одной матрице; если она пропала, матрица строится заново
+DIRTY_TIMEOUT = 24 * 60 * 60
+# при большем числе пометок матрицу дешевле построить заново
+MAX_MARKS = 1000
+
+
+def get_generation():
+    return cache.get_or_set(GENERATION_KEY, 0, None)
+
+
+def invalidate_all():
+    """
+    Полный сброс матриц всех мероприятий после фиксации транзакции
+    """
+    transaction.on_commit(_increment_generation)
+
+
+def _increment_generation():
+    try:
+        cache.incr(GENERATION_KEY)
+    except ValueError:
+        cache.set(GENERATION_KEY, 1, None)
+
+
+def invalidate(event_pk):
+    """
+    Полный сброс матрицы мероприятия после фиксации транзакции, например при изменении его дат,
+    а с ними и состава
+    """
+    transaction.on_commit(lambda: cache.delete(MATRIX_KEY.format(generation=get_generation(), event_pk=event_pk)))
+
+
+def mark_dirty(event_pks, slot_pks=(), person_pks=()):
+    dirty = {'slots': set(slot_pks), 'persons': set(person_pks)}
+    event_pks = set(event_pks)
+    transaction.on_commit(lambda: _mark(event_pks, dirty))
+
+
+def _mark(event_pks, dirty):
+    for event_pk in event_pks:
+        counter_key = DIRTY_COUNTER_KEY.format(event_pk=event_pk)
+        try:
+            number = cache.incr(counter_key)
+        except ValueError:
+            # счетчик вытеснен из кэша: номера начнутся заново, и матрица не сможет по ним сверяться
+            cache.delete(MATRIX_KEY.format(generation=get_generation(), event_pk=event_pk))
+            cache.add(counter_key, 0, None)
+            number = cache.incr(counter_key)
+        cache.set(DIRTY_KEY.format(event_pk=event_pk, number=number), dirty, DIRTY_TIMEOUT)
+
+
+def get_dirty_number(event_pk):
+    return cache.get(DIRTY_COUNTER_KEY.format(event_pk=event_pk), 0)
+
+
+def get_volunteer_matrix(event):
+    key = MATRIX_KEY.format(generation=get_generation(), event_pk=event.pk)
+
+    cached = cache.get(key)
+    number = get_dirty_number(event.pk)
+    applied, matrix = cached if cached is not None else (None, None)
+
+    if matrix is not None and applied == number:
+        matrix.event = event
+        return matrix
+
+    dirty = None
+    if matrix is not None and applied < number <= applied + MAX_MARKS:
+        keys = [DIRTY_KEY.format(event_pk=event.pk, number=i) for i in range(applied + 1, number + 1)]
+        marks = cache.get_many(keys)
+        if len(marks) == len(keys):
+            dirty = {'slots': set(), 'persons': set()}
+            for mark in marks.values():
+                dirty['slots'] |= mark['slots']
+                dirty['persons'] |= mark['persons']
+
+    with primary_reads():
+        if dirty is None:
+            # нет матрицы, пропали пометки или сброшен счетчик: пометки до number уже учтены в базе
+            matrix = VolunteerMatrix.for_event(event)
+        else:
+            matrix.event = event
+            matrix.refresh(slot_pks=dirty['slots'], person_pks=dirty['persons'])
+
+    # более новую матрицу, сохраненную одновременным запросом, не перезаписываем
+    current = cache.get(key)
+    if current is None or current[0] == applied or current[0] < number:
+        cache.set(key, (number, matrix), None)
+    return matrix
@@ -0,0 +1,35 @@
+"""
+Сериализация окон волонтерской матрицы в JSON.
+
+Отдельно от serializers.py: календарные выгрузки импортируются без настроек Django
+(см. benchmarks/calendar_export.py), а окну нужны ссылки на страницы людей
+"""
+from django.urls import reverse
+
+from schedule_app.utils import human_readable_time
+
+# код статуса -> цифра в строке статусов
+STATUS_DIGITS = bytes.maketrans(bytes(range(10)), b'0123456789')
+
+
+def volunteer_window(event, columns, rows, offset, persons_total):
+    """
+    Окно волонтерской матрицы (см. VolunteerMatrix.window) для JSON-ответа.
+    Статусы строки - цифры кодов const.STATUSES, по символу на столбец
+    """
+    return {
+        'persons_total': persons_total,
+        'offset': offset,
+        'columns': [{'pk': column.slot.pk,
+                     'dt': column.activity_dt,
+                     'name': column.activity_name,
+                     'need_peoples': column.need_peoples,
+                     'need': column.need,
+                     'assigned': column.assigned,
+                     'filled': column.filled} for column in columns],
+        'rows': [{'pk': row.person.pk,
+                  'name': f'{row.person.last_name} {row.person.first_name}',
+                  'url': reverse('person', args=(event.pk, row.person.pk)),
+                  'duration_full': human_readable_time(row.duration // 60),
+                  'statuses': row.statuses.tobytes().translate(STATUS_DIGITS).decode('ascii')}
+                 for row in rows]}
@@ -7,6 +7,7 @@ import datetime
 
 from django.contrib import admin
 from django.db import models
+from django.db.models import Q
 
 import schedule_app.constants as const
 
@@ -23,7 +24,7 @@ class ActivityType(models.Model):
         verbose_name_plural = 'Типы деятельности'
 
     def get_events(self, pk):
-        return ActivityOnEvent.objects.filter(event__pk=pk, activity__activity_type=self)
+        return ActivityOnEvent.objects.filter(event__pk=pk, activity_type_name=self.name)
 
     def __str__(self):
         return self.get_name_display()
@@ -46,6 +47,15 @@ class Category(models.Model):
         verbose_name = 'Категория'
         verbose_name_plural = 'Категории'
 
+    def accounted_duration(self, duration):
+        """
+        Учетное время активности этой категории: продолжительность с коэффициентом и доп. временем
+        """
+        additional_time = datetime.timedelta(hours=self.additional_time.hour, minutes=self.additional_time.minute,
+                                             seconds=self.additional_time.second)
+        return datetime.timedelta(seconds=int(duration.total_seconds())) * float(self.time_coefficient) \
+            + additional_time
+
     def __str__(self):
         return self.name
 
@@ -80,9 +90,14 @@ class Person(models.Model):
     free_time_limit = models.DurationField(default=datetime.timedelta(hours=6),
                                            verbose_name='Лимит свободного времени')
 
+    # версия личного расписания для условных запросов, обновляется и при изменении назначений (см. versions.py)
+    updated_at = models.DateTimeField(auto_now=True, verbose_name='Изменено')
+
     class Meta:
         verbose_name = 'Человек'
         verbose_name_plural = 'Человеки'
+        indexes = [models.Index(fields=['arrival_datetime']),
+                   models.Index(fields=['departure_datetime'])]
 
     def __str__(self):
         return f'{self.first_name} {self.last_name}'
@@ -93,8 +108,7 @@ class Person(models.Model):
     def get_schedule(self, event_pk, activity_type=None):
         if not activity_type:
             return ActivityOnEvent.objects.filter(event__pk=event_pk, person=self)
-        return ActivityOnEvent.objects.filter(event__pk=event_pk, person=self,
-                                              activity__category__activity_type__name=activity_type)
+        return ActivityOnEvent.objects.filter(event__pk=event_pk, person=self, activity_type_name=activity_type)
 
     def arrive_and_depart_filled(self):
         return all([self.arrival_datetime is not None, self.departure_datetime is not None])
@@ -105,6 +119,15 @@ class Event(models.Model):
     start_date = models.DateField(verbose_name='Дата начала')
     end_date = models.DateField(verbose_name='Дата окончания')
 
+    # явно добавленные участники; остальные попадают в состав по датам приезда и отъезда
+    # и по назначениям на активности (см. get_roster)
+    participants = models.ManyToManyField(Person, blank=True, related_name='events', verbose_name='Участники')
+
+    # версия расписания мероприятия для условных запросов, обновляется и при изменении активностей (см. versions.py)
+    updated_at = models.DateTimeField(auto_now=True, verbose_name='Изменено')
+    # время изменения самого мероприятия (названия, дат), входит в версию личных расписаний
+    edited_at = models.DateTimeField(auto_now=True, verbose_name='Изменены данные')
+
     class Meta:
         verbose_name = 'Мероприятие'
         verbose_name_plural = 'Мероприятия'
@@ -115,7 +138,21 @@ class Event(models.Model):
     def get_schedule(self, activity_type=None):
         if not activity_type:
             return ActivityOnEvent.objects.filter(event=self)
-        return ActivityOnEvent.objects.filter(event=self, activity__category__activity_type__name=activity_type)
+        return ActivityOnEvent.objects.filter(event=self, activity_type_name=activity_type)
+
+    def get_roster(self):
+        """
+        Состав мероприятия: явно добавленные участники, люди, чье пребывание пересекается с датами мероприятия,
+        и люди, назначенные на его активности. Условия проверяются по индексам (уникальному индексу таблицы
+        участников, индексу по датам и индексу связей с активностями), поэтому порядок не задается:
+        сортировка по pk заставила бы SQLite читать таблицу людей целиком
+        """
+        start = datetime.datetime.combine(self.start_date, datetime.time.min)
+        end = datetime.datetime.combine(self.end_date + datetime.timedelta(days=1), datetime.time.min)
+        participants = Event.participants.through.objects.filter(event=self).values('person_id')
+        assigned = ActivityOnEvent.person.through.objects.filter(activityonevent__event=self).values('person_id')
+        stays = Q(arrival_datetime__lt=end, departure_datetime__gt=start)
+        return Person.objects.filter(Q(pk__in=participants) | Q(pk__in=assigned) | stays)
 
 
 class ActivityOnEvent(models.Model):
@@ -126,9 +163,50 @@ class ActivityOnEvent(models.Model):
     start_dt = models.DateTimeField(verbose_name='Дата начала')
     end_dt = models.DateTimeField(verbose_name='Дата окончания')
 
+    # Копия activity.category.activity_type.name, чтобы фильтровать расписание по типу без трех джойнов.
+    # Заполняется в save(), при изменении активностей, категорий и типов обновляется сигналами
+    activity_type_name = models.CharField(choices=const.ACTIVITY_TYPE_CHOICES, max_length=120, editable=False,
+                                          default=const.VOLUNTEER, verbose_name='Тип активности')
+    # Category.accounted_duration продолжительности: заполняется в save(), при изменении коэффициента
+    # или доп. времени категории и категории активности обновляется сигналами
+    accounted_duration = models.DurationField(editable=False, default=datetime.timedelta(0),
+                                              verbose_name='Учетное время')
+
     class Meta:
         verbose_name = 'Расписание активностей'
         verbose_name_plural = 'Расписание активностей'
+        indexes = [models.Index(fields=['event', 'start_dt', 'end_dt']),
+                   models.Index(fields=['event', 'activity_type_name', 'start_dt', 'end_dt'])]
+
+    def save(self, *args, **kwargs):
+        category = self.activity.category
+        self.activity_type_name = category.activity_type.name
+        self.accounted_duration = category.accounted_duration(self.end_dt - self.start_dt)
+        super().save(*args, **kwargs)
+
+    @classmethod
+    def sync_activity_type_name(cls, **filters):
+        """
+        Массовое обновление activity_type_name у активностей, выбранных по filters
+        """
+        for name, _ in const.ACTIVITY_TYPE_CHOICES:
+            cls.objects.filter(activity__category__activity_type__name=name, **filters) \
+                .exclude(activity_type_name=name) \
+                .update(activity_type_name=name)
+
+    @classmethod
+    def sync_accounted_duration(cls, batch_size=500, **filters):
+        """
+        Массовое обновление accounted_duration у активностей, выбранных по filters
+        """
+        changed = []
+        for row in cls.objects.filter(**filters).select_related('activity__category'):
+            accounted_duration = row.activity.category.accounted_duration(row.end_dt - row.start_dt)
+            if row.accounted_duration != accounted_duration:
+                row.accounted_duration = accounted_duration
+                changed.append(row)
+        cls.objects.bulk_update(changed, ['accounted_duration'], batch_size=batch_size)
+        return len(changed)
 
     @admin.display(description='Продолжительность')
     def duration(self):
@@ -139,3 +217,21 @@ class ActivityOnEvent(models.Model):
 
     def __str__(self):
         return f'{self.activity.name} ({self.start_dt} - {self.end_dt})'
+
+
+class Workload(models.Model):
+    """
+    Суммарное учетное время человека на волонтерских активностях мероприятия
+    (с коэффициентами и доп. временем категорий). Поддерживается в актуальном состоянии сигналами
+    """
+    event = models.ForeignKey(Event, on_delete=models.CASCADE, verbose_name='Мероприятие')
+    person = models.ForeignKey(Person, on_delete=models.CASCADE, verbose_name='Человек')
+    accounted_time = models.DurationField(default=datetime.timedelta(0), verbose_name='Учетное время')
+
+    class Meta:
+        verbose_name = 'Нагрузка'
+        verbose_name_plural = 'Нагрузка'
+        unique_together = ('event', 'person')
+
+    def __str__(self):
+        return f'{self.person} ({self.event}): {self.accounted_time}'
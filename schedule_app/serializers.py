@@ -0,0 +1,146 @@
+"""
+Выгрузка расписаний в календарные форматы: CSV для импорта в Google Calendar и iCalendar (.ics).
+Строки формируются генераторами и пишутся в поток стандартными средствами,
+без промежуточных таблиц
+"""
+import csv
+import datetime
+import io
+from itertools import groupby
+from zipfile import ZipFile
+
+GOOGLE_CALENDAR_HEADER = ('Subject', 'Start Date', 'Start Time', 'End Date', 'End Time', 'Description')
+
+ICS_DT_FORMAT = '%Y%m%dT%H%M%S'
+ICS_LINE_LIMIT = 75
+
+
+def google_calendar_row(activity):
+    date_format = '%Y-%m-%d'
+    time_format = '%H:%M:%S'
+    return (activity.activity.name,
+            activity.start_dt.strftime(date_format),
+            activity.start_dt.strftime(time_format),
+            activity.end_dt.strftime(date_format),
+            activity.end_dt.strftime(time_format),
+            activity.activity.description)
+
+
+def write_google_calendar_csv(activities, stream):
+    """
+    Запись расписания в текстовый поток в формате Google Calendar.
+    Пустое расписание записывается как пустая строка - так же, как это делала выгрузка через pandas
+    """
+    writer = csv.writer(stream, lineterminator='\n')
+    rows = (google_calendar_row(activity) for activity in activities)
+
+    first_row = next(rows, None)
+    if first_row is None:
+        stream.write('\n')
+        return
+
+    writer.writerow(GOOGLE_CALENDAR_HEADER)
+    writer.writerow(first_row)
+    writer.writerows(rows)
+
+
+def google_calendar_csv(activities):
+    stream = io.StringIO()
+    write_google_calendar_csv(activities, stream)
+    return stream.getvalue()
+
+
+def ics_escape(value):
+    return value.replace('\\', '\\\\').replace(';', '\\;').replace(',', '\\,').replace('\n', '\\n')
+
+
+def ics_fold(line):
+    """
+    Перенос строк длиннее 75 октетов по RFC 5545
+    """
+    encoded = line.encode('utf-8')
+    if len(encoded) <= ICS_LINE_LIMIT:
+        return line
+
+    parts = []
+    limit = ICS_LINE_LIMIT
+    while encoded:
+        cut = min(limit, len(encoded))
+        # не разрываем многобайтовый символ
+        while cut < len(encoded) and (encoded[cut] & 0xC0) == 0x80:
+            cut -= 1
+        parts.append(encoded[:cut].decode('utf-8'))
+        encoded = encoded[cut:]
+        limit = ICS_LINE_LIMIT - 1
+    return '\r\n '.join(parts)
+
+
+def icalendar_lines(activities, stamp=None):
+    stamp = (stamp or datetime.datetime.utcnow()).strftime(ICS_DT_FORMAT) + 'Z'
+
+    yield 'BEGIN:VCALENDAR'
+    yield 'VERSION:2.0'
+    yield 'PRODID:-//adentro_schedule//RU'
+    for activity in activities:
+        yield 'BEGIN:VEVENT'
+        yield f'UID:{activity.pk}@adentro_schedule'
+        yield f'DTSTAMP:{stamp}'
+        yield f'DTSTART:{activity.start_dt.strftime(ICS_DT_FORMAT)}'
+        yield f'DTEND:{activity.end_dt.strftime(ICS_DT_FORMAT)}'
+        yield ics_fold(f'SUMMARY:{ics_escape(activity.activity.name)}')
+        if activity.activity.description:
+            yield ics_fold(f'DESCRIPTION:{ics_escape(activity.activity.description)}')
+        yield 'END:VEVENT'
+    yield 'END:VCALENDAR'
+
+
+def icalendar(activities, stamp=None):
+    return ''.join(f'{line}\r\n' for line in icalendar_lines(activities, stamp))
+
+
+class StreamBuffer:
+    """
+    Буфер без поддержки seek: ZipFile пишет в него архив, а содержимое отдается клиенту частями
+    """
+
+    def __init__(self):
+        self.chunks = []
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def pop(self):
+        data = b''.join(self.chunks)
+        self.chunks.clear()
+        return data
+
+
+def stream_schedules_zip(assignments):
+    """
+    Генератор zip-архива с расписаниями в формате Google Calendar, по файлу на человека.
+    assignments - назначения (person, activityonevent), отсортированные по человеку и времени начала.
+    В памяти держится не больше одного файла архива
+    """
+    buffer = StreamBuffer()
+    filenames = set()
+
+    with ZipFile(buffer, 'w') as zip_file:
+        for person, person_assignments in groupby(assignments, key=lambda assignment: assignment.person):
+            filename = f'{person.last_name} {person.first_name}.csv'
+            if filename in filenames:
+                filename = f'{person.last_name} {person.first_name} ({person.pk}).csv'
+            filenames.add(filename)
+
+            with zip_file.open(filename, 'w') as file:
+                text = io.TextIOWrapper(file, encoding='utf-8', newline='')
+                write_google_calendar_csv((assignment.activityonevent for assignment in person_assignments), text)
+                text.flush()
+                text.detach()
+
+            yield buffer.pop()
+
+    yield buffer.pop()
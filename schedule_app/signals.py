@@ -0,0 +1,180 @@
+"""
+Реакция на изменения в админке: синхронизация ActivityOnEvent.activity_type_name и accounted_duration,
+пересчет хранимой нагрузки (workload.py), инвалидация кэша волонтерской матрицы,
+обновление версий расписаний для условных запросов (versions.py) и живые обновления страниц (live.py).
+
+Затронутые мероприятия, люди и активности определяются один раз в одном обработчике на каждое изменение
+и передаются в slots_changed, поэтому результат не зависит от порядка регистрации обработчиков
+"""
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_delete, pre_save
+from django.dispatch import receiver
+
+import schedule_app.live as live
+import schedule_app.matrix_cache as matrix_cache
+import schedule_app.versions as versions
+import schedule_app.workload as workload
+from schedule_app import models
+
+
+def slots_changed(event_pks, person_pks, slot_pks):
+    """
+    Изменились активности slot_pks мероприятий event_pks с участием людей person_pks.
+    Назначенные люди входят в состав мероприятия, поэтому в матрице помечаются и их строки
+    """
+    event_pks, person_pks, slot_pks = set(event_pks) - {None}, set(person_pks), set(slot_pks)
+    workload.recompute(event_pks, person_pks)
+    versions.touch(event_pks, person_pks)
+    live.publish_slots(event_pks, person_pks, slot_pks)
+    matrix_cache.mark_dirty(event_pks, slot_pks=slot_pks, person_pks=person_pks)
+
+
+def activities_changed(activities):
+    """
+    Изменились активности activities (queryset ActivityOnEvent) и все их участники
+    """
+    slots = list(activities.values_list('event_id', 'pk'))
+    slot_pks = [slot_pk for _, slot_pk in slots]
+    person_pks = models.ActivityOnEvent.person.through.objects \
+        .filter(activityonevent_id__in=slot_pks).values_list('person_id', flat=True)
+    slots_changed({event_pk for event_pk, _ in slots}, person_pks, slot_pks)
+
+
+@receiver(pre_save, sender=models.ActivityOnEvent)
+def remember_previous_event(sender, instance, **kwargs):
+    instance._previous_event_pk = None
+    if instance.pk:
+        instance._previous_event_pk = sender.objects.filter(pk=instance.pk) \
+            .values_list('event_id', flat=True).first()
+
+
+@receiver(post_save, sender=models.ActivityOnEvent)
+def activity_on_event_saved(sender, instance, created, **kwargs):
+    # у новой активности еще нет участников, при переносе затронуты оба мероприятия
+    person_pks = () if created else instance.person.values_list('pk', flat=True)
+    slots_changed({instance.event_id, getattr(instance, '_previous_event_pk', None)}, person_pks, [instance.pk])
+
+
+@receiver(pre_delete, sender=models.ActivityOnEvent)
+def remember_slot_persons(sender, instance, **kwargs):
+    # участники удаляются каскадно, без m2m_changed
+    instance._deleted_person_pks = list(instance.person.values_list('pk', flat=True))
+
+
+@receiver(post_delete, sender=models.ActivityOnEvent)
+def activity_on_event_deleted(sender, instance, **kwargs):
+    slots_changed([instance.event_id], getattr(instance, '_deleted_person_pks', []), [instance.pk])
+
+
+@receiver(m2m_changed, sender=models.ActivityOnEvent.person.through)
+def persons_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    """
+    Прямое изменение: instance - активность, pk_set - люди; обратное, со стороны человека, - наоборот.
+    При очистке pk_set не передается, поэтому состав запоминается до нее
+    """
+    if action == 'pre_clear':
+        instance._cleared = list(instance.activityonevent_set.values_list('event_id', 'pk') if reverse
+                                 else instance.person.values_list('pk', flat=True))
+        return
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+
+    if not reverse:
+        person_pks = getattr(instance, '_cleared', []) if action == 'post_clear' else pk_set
+        if person_pks:
+            slots_changed([instance.event_id], person_pks, [instance.pk])
+        return
+
+    slots = getattr(instance, '_cleared', []) if action == 'post_clear' \
+        else list(models.ActivityOnEvent.objects.filter(pk__in=pk_set).values_list('event_id', 'pk'))
+    if slots:
+        slots_changed({event_pk for event_pk, _ in slots}, [instance.pk], [slot_pk for _, slot_pk in slots])
+
+
+@receiver(pre_save, sender=models.Person)
+def remember_previous_stay(sender, instance, **kwargs):
+    instance._previous_stay = None
+    if instance.pk:
+        instance._previous_stay = sender.objects.filter(pk=instance.pk) \
+            .values_list('arrival_datetime', 'departure_datetime').first()
+
+
+@receiver(post_save, sender=models.Person)
+def person_changed(sender, instance, **kwargs):
+    # имя и даты человека видны у мероприятий, в состав которых он входит до или после изменения
+    stays = [(instance.arrival_datetime, instance.departure_datetime),
+             getattr(instance, '_previous_stay', None) or (None, None)]
+    event_pks = list(versions.person_events(instance.pk, stays))
+    versions.touch(event_pks)
+    matrix_cache.mark_dirty(event_pks, person_pks=[instance.pk])
+
+
+@receiver(pre_delete, sender=models.Person)
+def remember_person_events(sender, instance, **kwargs):
+    # связи с мероприятиями и активностями удаляются каскадно, без m2m_changed
+    instance._deleted_slots = list(instance.activityonevent_set.values_list('event_id', 'pk'))
+    instance._deleted_event_pks = list(versions.person_events(
+        instance.pk, [(instance.arrival_datetime, instance.departure_datetime)]))
+
+
+@receiver(post_delete, sender=models.Person)
+def person_deleted(sender, instance, **kwargs):
+    event_pks = getattr(instance, '_deleted_event_pks', [])
+    versions.touch(event_pks)
+    matrix_cache.mark_dirty(event_pks, person_pks=[instance.pk])
+    slots = getattr(instance, '_deleted_slots', [])
+    live.publish_slots({event_pk for event_pk, _ in slots}, [instance.pk], [slot_pk for _, slot_pk in slots])
+    matrix_cache.mark_dirty({event_pk for event_pk, _ in slots}, slot_pks=[slot_pk for _, slot_pk in slots])
+
+
+@receiver(m2m_changed, sender=models.Event.participants.through)
+def participants_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    # прямое изменение: instance - мероприятие, pk_set - люди; обратное - наоборот
+    if action == 'pre_clear':
+        related = instance.events if reverse else instance.participants
+        instance._cleared_participants = list(related.values_list('pk', flat=True))
+        return
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+
+    pks = getattr(instance, '_cleared_participants', []) if action == 'post_clear' else pk_set
+    if reverse:
+        matrix_cache.mark_dirty(pks, person_pks=[instance.pk])
+        versions.touch(pks)
+    else:
+        matrix_cache.mark_dirty([instance.pk], person_pks=pks)
+        versions.touch([instance.pk])
+
+
+@receiver(post_save, sender=models.Event)
+def event_changed(sender, instance, created, **kwargs):
+    # даты мероприятия определяют его состав
+    if not created:
+        matrix_cache.invalidate(instance.pk)
+
+
+@receiver(post_save, sender=models.Activity)
+def activity_changed(sender, instance, **kwargs):
+    # нагрузка суммирует хранимое учетное время, поэтому оно синхронизируется первым
+    models.ActivityOnEvent.sync_activity_type_name(activity=instance)
+    models.ActivityOnEvent.sync_accounted_duration(activity=instance)
+    activities_changed(models.ActivityOnEvent.objects.filter(activity=instance))
+
+
+@receiver(post_save, sender=models.Category)
+def category_changed(sender, instance, **kwargs):
+    models.ActivityOnEvent.sync_activity_type_name(activity__category=instance)
+    models.ActivityOnEvent.sync_accounted_duration(activity__category=instance)
+    activities_changed(models.ActivityOnEvent.objects.filter(activity__category=instance))
+
+
+@receiver(post_save, sender=models.ActivityType)
+def activity_type_changed(sender, instance, **kwargs):
+    models.ActivityOnEvent.sync_activity_type_name(activity__category__activity_type=instance)
+    activities_changed(models.ActivityOnEvent.objects.filter(activity__category__activity_type=instance))
+    # тип определяет, какие активности попадают в столбцы матрицы
+    matrix_cache.invalidate_all()
+
+
+@receiver(post_delete, sender=models.ActivityType)
+def activity_type_deleted(sender, instance, **kwargs):
+    matrix_cache.invalidate_all()
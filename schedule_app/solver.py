@@ -0,0 +1,295 @@
+"""
+Автоматическое заполнение волонтерских активностей.
+
+Правила те же, что и при ручном назначении в админке (forms.py): человек присутствует на мероприятии
+все время активности, не исключил ее категорию, свободен в это время и не превышает
+лимит свободного времени с учетом коэффициентов категорий.
+
+Сначала места заполняются жадно: активности с наименьшим числом подходящих людей идут первыми,
+среди подходящих выбирается наименее загруженный. Затем локальный поиск пытается заполнить
+оставшиеся места перестановкой: человек переходит на незаполненную активность,
+а его прежнее место занимает другой свободный человек.
+
+Подбор идет без блокировок, поэтому при сохранении люди блокируются (assignment.lock_persons),
+расписания перечитываются, и назначения, ставшие недопустимыми из-за одновременных правок координаторов,
+отбрасываются.
+"""
+import bisect
+import datetime
+from collections import defaultdict
+
+from django.db import transaction
+
+import schedule_app.assignment as assignment
+import schedule_app.constants as const
+import schedule_app.live as live
+import schedule_app.matrix_cache as matrix_cache
+import schedule_app.versions as versions
+import schedule_app.workload as workload
+from schedule_app import models
+
+NIGHT_HOURS = range(0, 6)
+
+
+def is_night(start_dt, end_dt):
+    """
+    Активность захватывает ночные часы
+    """
+    hour = start_dt.replace(minute=0, second=0, microsecond=0)
+    while hour < end_dt:
+        if hour.hour in NIGHT_HOURS:
+            return True
+        hour += datetime.timedelta(hours=1)
+    return False
+
+
+class Candidate:
+    __slots__ = ('pk', 'arrival_datetime', 'departure_datetime', 'free_time_limit', 'night_man',
+                 'excluded', 'starts', 'busy', 'used')
+
+    def __init__(self, person, excluded):
+        self.pk = person.pk
+        self.arrival_datetime = person.arrival_datetime
+        self.departure_datetime = person.departure_datetime
+        self.free_time_limit = person.free_time_limit
+        self.night_man = person.night_man
+        self.excluded = excluded
+        self.starts = []
+        self.busy = []
+        self.used = datetime.timedelta(seconds=0)
+
+    def is_present(self, slot):
+        if self.arrival_datetime is None or self.departure_datetime is None:
+            return False
+        return self.arrival_datetime <= slot.start_dt and slot.end_dt <= self.departure_datetime
+
+    def conflicts(self, slot):
+        """
+        Занятые интервалы человека, пересекающиеся с активностью (полуоткрытые интервалы)
+        """
+        i = bisect.bisect_left(self.starts, slot.end_dt)
+        return [busy for busy in self.busy[:i] if busy[1] > slot.start_dt]
+
+    def occupy(self, slot):
+        i = bisect.bisect_right(self.starts, slot.start_dt)
+        self.starts.insert(i, slot.start_dt)
+        self.busy.insert(i, (slot.start_dt, slot.end_dt, slot.pk))
+        if slot.is_volunteer:
+            self.used += slot.accounted_time
+
+    def release(self, slot):
+        i = self.busy.index((slot.start_dt, slot.end_dt, slot.pk))
+        del self.starts[i]
+        del self.busy[i]
+        if slot.is_volunteer:
+            self.used -= slot.accounted_time
+
+    def has_time_for(self, slot):
+        return self.used + slot.accounted_time <= self.free_time_limit
+
+    def can_take(self, slot):
+        return all([slot.category_pk not in self.excluded,
+                    self.pk not in slot.person_pks,
+                    self.is_present(slot),
+                    self.has_time_for(slot),
+                    not self.conflicts(slot)])
+
+
+class SolverSlot:
+    __slots__ = ('pk', 'start_dt', 'end_dt', 'category_pk', 'is_volunteer', 'accounted_time', 'need_peoples',
+                 'person_pks', 'night')
+
+    def __init__(self, activity, person_pks):
+        category = activity.activity.category
+        self.pk = activity.pk
+        self.start_dt = activity.start_dt
+        self.end_dt = activity.end_dt
+        self.category_pk = category.pk
+        self.is_volunteer = activity.activity_type_name == const.VOLUNTEER
+        self.accounted_time = activity.accounted_duration
+        self.need_peoples = activity.activity.need_peoples or 0
+        self.person_pks = person_pks
+        self.night = is_night(activity.start_dt, activity.end_dt)
+
+    @property
+    def missing(self):
+        return max(0, self.need_peoples - len(self.person_pks))
+
+
+def load_event(event):
+    """
+    Люди из состава мероприятия с занятостью по его расписанию и все активности мероприятия
+    """
+    person_pks = defaultdict(set)
+    assignments = models.ActivityOnEvent.person.through.objects \
+        .filter(activityonevent__event=event) \
+        .values_list('activityonevent_id', 'person_id')
+    for slot_pk, person_pk in assignments:
+        person_pks[slot_pk].add(person_pk)
+
+    excluded = defaultdict(set)
+    for person_pk, category_pk in models.Person.excluded_categories.through.objects \
+            .values_list('person_id', 'category_id'):
+        excluded[person_pk].add(category_pk)
+
+    candidates = {person.pk: Candidate(person, excluded[person.pk]) for person in event.get_roster()}
+
+    slots = []
+    activities = models.ActivityOnEvent.objects.filter(event=event) \
+        .select_related('activity__category') \
+        .order_by('start_dt', 'end_dt', 'pk')
+    for activity in activities:
+        slot = SolverSlot(activity, person_pks[activity.pk])
+        for person_pk in slot.person_pks:
+            if person_pk in candidates:
+                candidates[person_pk].occupy(slot)
+        slots.append(slot)
+    return candidates, slots
+
+
+def cost(candidate, slot):
+    """
+    Чем меньше, тем лучше: доля израсходованного лимита времени и штраф за ночь для дневного человека и наоборот
+    """
+    load = candidate.used / candidate.free_time_limit if candidate.free_time_limit else 1
+    night_penalty = 0 if slot.night == candidate.night_man else 0.5
+    return load + night_penalty
+
+
+class AutoAssigner:
+    """
+    Подбор людей на незаполненные волонтерские активности мероприятия.
+    slot_pks ограничивает заполняемые активности, остальные учитываются только как занятость людей
+    """
+
+    def __init__(self, event, slot_pks=None, swap_attempts=2000):
+        self.event = event
+        self.slot_pks = set(slot_pks) if slot_pks is not None else None
+        self.swap_attempts = swap_attempts
+        self.slots = []
+        self.candidates = {}
+        self.added = defaultdict(set)
+
+    def load(self):
+        self.candidates, slots = load_event(self.event)
+        self.slots = [slot for slot in slots
+                      if slot.is_volunteer and (self.slot_pks is None or slot.pk in self.slot_pks)]
+
+    def assign(self, candidate, slot):
+        candidate.occupy(slot)
+        slot.person_pks.add(candidate.pk)
+        self.added[slot.pk].add(candidate.pk)
+
+    def unassign(self, candidate, slot):
+        candidate.release(slot)
+        slot.person_pks.discard(candidate.pk)
+        self.added[slot.pk].discard(candidate.pk)
+
+    def greedy(self):
+        open_slots = [slot for slot in self.slots if slot.missing]
+        eligible = {slot.pk: sum(1 for candidate in self.candidates.values() if candidate.can_take(slot))
+                    for slot in open_slots}
+        open_slots.sort(key=lambda slot: (eligible[slot.pk], slot.start_dt))
+
+        for slot in open_slots:
+            while slot.missing:
+                options = [candidate for candidate in self.candidates.values() if candidate.can_take(slot)]
+                if not options:
+                    break
+                self.assign(min(options, key=lambda candidate: (cost(candidate, slot), candidate.pk)), slot)
+
+    def local_search(self):
+        """
+        Перестановки вида: человек p уходит с назначенной решателем активности t на незаполненную s,
+        место p на t занимает свободный человек q
+        """
+        slots = {slot.pk: slot for slot in self.slots}
+        attempts = 0
+
+        for slot in [slot for slot in self.slots if slot.missing]:
+            for candidate in list(self.candidates.values()):
+                if not slot.missing or attempts >= self.swap_attempts:
+                    break
+                if slot.category_pk in candidate.excluded or candidate.pk in slot.person_pks \
+                        or not candidate.is_present(slot):
+                    continue
+
+                conflicts = candidate.conflicts(slot)
+                if len(conflicts) > 1:
+                    continue
+                if conflicts:
+                    other = slots.get(conflicts[0][2])
+                else:
+                    # мешает только лимит времени: освобождаем одну из активностей, назначенных решателем
+                    other = next((slots[pk] for _, _, pk in candidate.busy
+                                  if pk in slots and candidate.pk in self.added[pk]
+                                  and candidate.used - slots[pk].accounted_time + slot.accounted_time
+                                  <= candidate.free_time_limit), None)
+                if other is None or candidate.pk not in self.added[other.pk]:
+                    continue
+
+                attempts += 1
+                self.unassign(candidate, other)
+                if not candidate.can_take(slot):
+                    self.assign(candidate, other)
+                    continue
+
+                self.assign(candidate, slot)
+                replacement = next((q for q in self.candidates.values() if q.can_take(other)), None)
+                if replacement is None:
+                    self.unassign(candidate, slot)
+                    self.assign(candidate, other)
+                else:
+                    self.assign(replacement, other)
+
+    def solve(self):
+        """
+        Возвращает новых участников по активностям: {pk активности: {pk людей}}
+        """
+        self.load()
+        self.greedy()
+        self.local_search()
+        return {slot_pk: person_pks for slot_pk, person_pks in self.added.items() if person_pks}
+
+    def fill_rate(self):
+        need = sum(slot.need_peoples for slot in self.slots)
+        filled = sum(min(slot.need_peoples, len(slot.person_pks)) for slot in self.slots)
+        return filled / need if need else 1.0
+
+    @transaction.atomic
+    def apply(self, assignments):
+        """
+        Сохраняет назначения, которые остались допустимыми по расписаниям, перечитанным после блокировки людей.
+        Возвращает сохраненные назначения в том же виде, что и solve
+        """
+        assignment.lock_persons({person_pk for person_pks in assignments.values() for person_pk in person_pks})
+        self.load()
+        self.added = defaultdict(set)
+        slots = {slot.pk: slot for slot in self.slots}
+        for slot_pk, person_pks in assignments.items():
+            slot = slots.get(slot_pk)
+            for person_pk in sorted(person_pks):
+                candidate = self.candidates.get(person_pk)
+                if slot is not None and candidate is not None and slot.missing and candidate.can_take(slot):
+                    self.assign(candidate, slot)
+        assignments = {slot_pk: person_pks for slot_pk, person_pks in self.added.items() if person_pks}
+
+        through = models.ActivityOnEvent.person.through
+        through.objects.bulk_create([through(activityonevent_id=slot_pk, person_id=person_pk)
+                                     for slot_pk, person_pks in assignments.items()
+                                     for person_pk in person_pks],
+                                    ignore_conflicts=True)
+        # bulk_create не отправляет m2m_changed
+        matrix_cache.mark_dirty([self.event.pk], slot_pks=assignments.keys())
+        person_pks = {person_pk for person_pks in assignments.values() for person_pk in person_pks}
+        workload.recompute([self.event.pk], person_pks)
+        versions.touch([self.event.pk], person_pks)
+        live.publish_slots([self.event.pk], person_pks, assignments.keys())
+        return assignments
+
+def auto_assign(event, slot_pks=None, dry_run=False):
+    assigner = AutoAssigner(event, slot_pks)
+    assignments = assigner.solve()
+    if not dry_run:
+        assignments = assigner.apply(assignments)
+    return assigner, assignments
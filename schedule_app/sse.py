@@ -0,0 +1,111 @@
+"""
+Поток server-sent events с живыми обновлениями расписаний (live.py) под ASGI.
+
+Django 3.2 отдает потоковый ответ синхронно прямо в цикле событий, поэтому поток обслуживается отдельным
+ASGI-приложением перед Django (см. adentro_schedule/asgi.py): запросы к адресам live_event и live_person
+перехватываются, остальные передаются Django. Подписка ждет сообщений без потока и соединения с базой,
+база нужна только для проверки входа при подключении.
+
+Под WSGI те же адреса отвечают 204 (views.live_updates), и браузер не переподключается:
+страница работает как раньше, без живых обновлений
+"""
+import asyncio
+import io
+import json
+from importlib import import_module
+
+from django.conf import settings
+from django.contrib import auth
+from django.core.handlers.asgi import ASGIRequest
+from django.urls import Resolver404, resolve
+
+import schedule_app.live as live
+from schedule_app import models
+from schedule_app.async_views import run_sync
+
+LIVE_URL_NAMES = ('live_event', 'live_person')
+KEEPALIVE = 15
+RETRY_MS = 5000
+
+
+def with_live_updates(django_application):
+    async def application(scope, receive, send):
+        if scope['type'] == 'http':
+            try:
+                match = resolve(scope['path'])
+            except Resolver404:
+                match = None
+            if match is not None and match.url_name in LIVE_URL_NAMES:
+                return await stream(scope, receive, send, **match.kwargs)
+        return await django_application(scope, receive, send)
+
+    return application
+
+
+def check_access(scope, event_pk, person_pk=None):
+    """
+    Статус ответа: 403 без входа, как login_required у страниц, 404 для несуществующего мероприятия или человека
+    """
+    request = ASGIRequest(scope, io.BytesIO())
+    engine = import_module(settings.SESSION_ENGINE)
+    request.session = engine.SessionStore(request.COOKIES.get(settings.SESSION_COOKIE_NAME))
+    if not auth.get_user(request).is_authenticated:
+        return 403
+    if not models.Event.objects.filter(pk=event_pk).exists():
+        return 404
+    if person_pk is not None and not models.Person.objects.filter(pk=person_pk).exists():
+        return 404
+    return 200
+
+
+def format_event(name, data):
+    return f'event: {name}\ndata: {json.dumps(data)}\n\n'.encode()
+
+
+async def wait_disconnect(receive):
+    while (await receive())['type'] != 'http.disconnect':
+        pass
+
+
+async def stream(scope, receive, send, event_pk, person_pk=None):
+    status = await run_sync(check_access, scope, event_pk, person_pk)
+    if status != 200:
+        await send({'type': 'http.response.start', 'status': status, 'headers': []})
+        await send({'type': 'http.response.body', 'body': b''})
+        return
+
+    name = live.channel('person', person_pk) if person_pk is not None else live.channel('event', event_pk)
+    async with live.get_broker().subscribe(name) as subscription:
+        await send({'type': 'http.response.start', 'status': 200,
+                    'headers': [(b'content-type', b'text/event-stream'), (b'cache-control', b'no-cache'),
+                                (b'x-accel-buffering', b'no')]})
+        await send({'type': 'http.response.body', 'body': f'retry: {RETRY_MS}\n\n'.encode(), 'more_body': True})
+
+        disconnected = asyncio.ensure_future(wait_disconnect(receive))
+        message = asyncio.ensure_future(subscription.get())
+        try:
+            while True:
+                done, _ = await asyncio.wait({disconnected, message}, timeout=KEEPALIVE,
+                                             return_when=asyncio.FIRST_COMPLETED)
+                if disconnected in done:
+                    break
+                if message not in done:
+                    body = b': keepalive\n\n'
+                elif message.result() is live.RELOAD:
+                    body = format_event('reload', {})
+                elif event_pk in message.result()['events']:
+                    # канал человека получает изменения всех его мероприятий
+                    body = format_event('schedule', {'slots': message.result()['slots']})
+                else:
+                    body = None
+
+                if message in done:
+                    message = asyncio.ensure_future(subscription.get())
+                if body is not None:
+                    await send({'type': 'http.response.body', 'body': body, 'more_body': True})
+        except OSError:
+            # клиент отключился во время отправки
+            pass
+        finally:
+            disconnected.cancel()
+            message.cancel()
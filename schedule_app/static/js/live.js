@@ -0,0 +1,57 @@
+// Живые обновления страницы расписания (server-sent events, см. schedule_app/sse.py).
+// По сообщению страница запрашивается заново (ответ обычно из кэша по версии) и в ней заменяются
+// только строки затронутых активностей; при изменении порядка или состава строк - вся таблица
+(function () {
+    'use strict';
+    const region = document.querySelector('[data-live]');
+    if (!region || !window.EventSource) {
+        return;
+    }
+
+    const rowSelector = pk => 'tr[data-slot="' + pk + '"]';
+    const order = element => Array.from(element.querySelectorAll('tr[data-slot]'), row => row.dataset.slot).join();
+    let pending = new Set();
+    let timer = null;
+
+    async function refresh() {
+        const slots = pending;
+        pending = new Set();
+        timer = null;
+
+        const response = await fetch(window.location.href, {credentials: 'same-origin'});
+        if (!response.ok) {
+            return;
+        }
+        const page = new DOMParser().parseFromString(await response.text(), 'text/html');
+        const fresh = page.querySelector('[data-live]');
+        if (!fresh) {
+            window.location.reload();
+            return;
+        }
+
+        for (const pk of slots) {
+            const current = region.querySelector(rowSelector(pk));
+            const updated = fresh.querySelector(rowSelector(pk));
+            if (current && updated) {
+                current.replaceWith(document.importNode(updated, true));
+            } else if (current) {
+                current.remove();
+            }
+        }
+        if (order(region) !== order(fresh) || !region.querySelector('table') !== !fresh.querySelector('table')) {
+            region.replaceChildren(...Array.from(fresh.childNodes, node => document.importNode(node, true)));
+        }
+    }
+
+    const source = new EventSource(region.dataset.live);
+    source.addEventListener('schedule', event => {
+        // изменения одной транзакции приходят несколькими сообщениями, страница запрашивается один раз
+        for (const pk of JSON.parse(event.data).slots) {
+            pending.add(pk);
+        }
+        if (timer === null) {
+            timer = setTimeout(refresh, 300);
+        }
+    });
+    source.addEventListener('reload', () => window.location.reload());
+})();
@@ -1,3 +1,1348 @@
-from django.test import TestCase
+import asyncio
+import datetime
+import io
+import random
+import tempfile
+from unittest import mock
+from zipfile import ZipFile
 
-# Create your tests here.
+from asgiref.sync import async_to_sync, sync_to_async
+
+from django.conf import settings
+from django.contrib.auth.models import Permission, User
+from django.core.cache import cache
+from django.core.exceptions import ValidationError
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import CommandError, call_command
+from django.db import OperationalError, connection, transaction
+from django.http import HttpResponse, StreamingHttpResponse
+from django.test import (AsyncClient, AsyncRequestFactory, SimpleTestCase, TestCase, TransactionTestCase,
+                         override_settings)
+from django.urls import reverse
+
+from adentro_schedule import db, profiling
+
+import schedule_app.admin as schedule_admin
+import schedule_app.assignment as assignment
+import schedule_app.constants as const
+import schedule_app.coverage as coverage
+import schedule_app.live as live
+import schedule_app.matrix_cache as matrix_cache
+from schedule_app import (async_views, availability, forms, importer, intervals, models, signals, sse, utils,
+                          workload)
+from schedule_app.availability import VolunteerMatrix
+from schedule_app.finder import FreeSlotFinder
+from schedule_app.solver import AutoAssigner, auto_assign
+
+
+class ScheduleFixtureMixin:
+    start = datetime.datetime(2022, 5, 1, 9, 0, 0)
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_superuser('admin', 'admin@example.com', 'admin')
+        self.client.force_login(self.user)
+
+        self.event = models.Event.objects.create(title='Adentro', start_date=datetime.date(2022, 5, 1),
+                                                 end_date=datetime.date(2022, 5, 4))
+        self.categories = {}
+        for name in (const.OFFICIAL, const.VOLUNTEER, const.OTHER):
+            activity_type = models.ActivityType.objects.create(name=name)
+            self.categories[name] = models.Category.objects.create(name=name, activity_type=activity_type)
+
+        self.persons = [models.Person.objects.create(first_name=f'Имя{i}', last_name=f'Фамилия{i}',
+                                                     arrival_datetime=self.start,
+                                                     departure_datetime=self.start + datetime.timedelta(days=3))
+                        for i in range(4)]
+
+    def create_rows(self, count, activity_type, offset=0):
+        for i in range(offset, offset + count):
+            activity = models.Activity.objects.create(name=f'{activity_type} {i}',
+                                                      category=self.categories[activity_type],
+                                                      need_peoples=2)
+            start_dt = self.start + datetime.timedelta(hours=i)
+            row = models.ActivityOnEvent.objects.create(event=self.event, activity=activity, start_dt=start_dt,
+                                                        end_dt=start_dt + datetime.timedelta(minutes=90))
+            row.person.set(self.persons[i % 2:i % 2 + 2])
+
+
+class QueryBudgetTest(ScheduleFixtureMixin, TestCase):
+    """
+    Количество запросов на страницах расписания не зависит от количества строк
+    """
+
+    def assert_constant_queries(self, url, budget, activity_type):
+        self.create_rows(3, activity_type)
+        with self.assertNumQueries(budget):
+            self.assertEqual(self.client.get(url).status_code, 200)
+
+        self.create_rows(12, activity_type, offset=3)
+        cache.clear()
+        with self.assertNumQueries(budget):
+            self.assertEqual(self.client.get(url).status_code, 200)
+
+    def test_volunteer_schedule(self):
+        self.assert_constant_queries(reverse('volunteer_schedule', args=(self.event.pk,)), 7, const.VOLUNTEER)
+
+    def test_official_schedule(self):
+        self.assert_constant_queries(reverse('official_schedule', args=(self.event.pk,)), 7, const.OFFICIAL)
+
+    def test_other_schedule(self):
+        self.assert_constant_queries(reverse('other_schedule', args=(self.event.pk,)), 7, const.OTHER)
+
+    def test_person_schedule(self):
+        self.assert_constant_queries(reverse('person', args=(self.event.pk, self.persons[1].pk)), 6,
+                                     const.VOLUNTEER)
+
+
+class VolunteerScheduleDataTest(ScheduleFixtureMixin, TestCase):
+    """
+    JSON-окна волонтерской матрицы
+    """
+
+    def setUp(self):
+        super().setUp()
+        self.create_rows(30, const.VOLUNTEER)
+        self.url = reverse('volunteer_schedule_data', args=(self.event.pk,))
+
+    def test_window(self):
+        data = self.client.get(self.url, {'offset': 1, 'limit': 2, 'start': '2022-05-01T10:00:00',
+                                          'end': '2022-05-01T12:00:00'}).json()
+
+        self.assertEqual(data['persons_total'], 4)
+        self.assertEqual([column['name'] for column in data['columns']],
+                         [f'volunteer_schedule {i}' for i in range(3)])
+        self.assertEqual([row['name'] for row in data['rows']], ['Фамилия1 Имя1', 'Фамилия2 Имя2'])
+        self.assertEqual(data['rows'][0]['statuses'], '111')
+        self.assertEqual(data['rows'][1]['statuses'], '212')
+        self.assertEqual([(column['need'], column['assigned'], column['filled']) for column in data['columns']],
+                         [(2, 2, True)] * 3)
+
+    def test_window_counts(self):
+        models.Activity.objects.filter(name='volunteer_schedule 0').update(need_peoples=3)
+        data = self.client.get(self.url, {'limit': 1, 'end': '2022-05-01T10:00:00'}).json()
+
+        self.assertEqual([(column['need'], column['assigned'], column['filled']) for column in data['columns']],
+                         [(3, 2, False)])
+
+    def test_constant_queries(self):
+        matrix_cache.get_volunteer_matrix(self.event)
+        for params in ({'limit': 1}, {'limit': 4, 'start': '2022-05-01T00:00:00', 'end': '2022-05-03T00:00:00'}):
+            with self.assertNumQueries(5):
+                self.assertEqual(self.client.get(self.url, params).status_code, 200)
+
+    def test_bad_params(self):
+        self.assertEqual(self.client.get(self.url, {'start': 'завтра'}).status_code, 400)
+        self.assertEqual(self.client.get(self.url, {'offset': -1}).status_code, 400)
+
+
+class MatrixCacheTest(ScheduleFixtureMixin, TestCase):
+    """
+    Точечно обновленная матрица из кэша совпадает с построенной заново
+    """
+
+    def setUp(self):
+        super().setUp()
+        self.create_rows(6, const.VOLUNTEER)
+        self.create_rows(2, const.OFFICIAL, offset=6)
+        matrix_cache.get_volunteer_matrix(self.event)
+
+    def assert_matches_fresh_build(self):
+        cached = matrix_cache.get_volunteer_matrix(self.event)
+        fresh = VolunteerMatrix.for_event(self.event)
+
+        self.assertEqual(cached.headers(), fresh.headers())
+        rows = [(row.person, row.statuses, row.duration) for row in cached.rows()]
+        self.assertEqual(rows, [(row.person, row.statuses, row.duration) for row in fresh.rows()])
+        return [person for person, _, _ in rows]
+
+    def test_cache_hit(self):
+        with self.assertNumQueries(0):
+            matrix_cache.get_volunteer_matrix(self.event)
+
+    def test_assignment_changes(self):
+        row = models.ActivityOnEvent.objects.get(activity__name='volunteer_schedule 2')
+        with self.captureOnCommitCallbacks(execute=True):
+            row.person.add(self.persons[3])
+        self.assert_matches_fresh_build()
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.persons[0].activityonevent_set.clear()
+        self.assert_matches_fresh_build()
+
+    def test_slot_changes(self):
+        row = models.ActivityOnEvent.objects.get(activity__name='volunteer_schedule 2')
+        row.start_dt += datetime.timedelta(hours=3)
+        row.end_dt += datetime.timedelta(hours=3)
+        with self.captureOnCommitCallbacks(execute=True):
+            row.save()
+        self.assert_matches_fresh_build()
+
+        with self.captureOnCommitCallbacks(execute=True):
+            row.delete()
+        self.assert_matches_fresh_build()
+
+    def test_person_changes(self):
+        self.persons[2].arrival_datetime = self.start + datetime.timedelta(hours=4)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.persons[2].save()
+        self.assert_matches_fresh_build()
+
+        with self.captureOnCommitCallbacks(execute=True):
+            models.Person.objects.create(first_name='Новый', last_name='Человек')
+        self.assert_matches_fresh_build()
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.persons[1].delete()
+        self.assert_matches_fresh_build()
+
+    def test_category_changes(self):
+        category = self.categories[const.VOLUNTEER]
+        category.time_coefficient = 1.5
+        category.additional_time = datetime.time(0, 30)
+        with self.captureOnCommitCallbacks(execute=True):
+            category.save()
+        self.assert_matches_fresh_build()
+
+    def test_roster_changes(self):
+        guest = models.Person.objects.create(first_name='Гость', last_name='Без дат')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.event.participants.add(guest)
+        self.assertIn(guest, self.assert_matches_fresh_build())
+
+        self.persons[0].arrival_datetime = datetime.datetime(2022, 6, 1)
+        self.persons[0].departure_datetime = datetime.datetime(2022, 6, 5)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.persons[0].save()
+        # назначенный на активности остается в составе
+        self.assertIn(self.persons[0], self.assert_matches_fresh_build())
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.persons[0].activityonevent_set.clear()
+        self.assertNotIn(self.persons[0], self.assert_matches_fresh_build())
+
+        row = models.ActivityOnEvent.objects.get(activity__name='volunteer_schedule 2')
+        with self.captureOnCommitCallbacks(execute=True):
+            row.person.add(self.persons[0])
+        self.assertIn(self.persons[0], self.assert_matches_fresh_build())
+
+        self.event.end_date = datetime.date(2022, 5, 1)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.event.participants.clear()
+            self.event.save()
+        self.assert_matches_fresh_build()
+
+    def test_marked_after_commit(self):
+        row = models.ActivityOnEvent.objects.get(activity__name='volunteer_schedule 2')
+        number = matrix_cache.get_dirty_number(self.event.pk)
+        with self.captureOnCommitCallbacks(execute=True):
+            with transaction.atomic():
+                row.person.add(self.persons[3])
+                transaction.set_rollback(True)
+            # до фиксации пометки нет: страница, открытая сейчас, не может ее снять
+            row.person.add(self.persons[2])
+            self.assertEqual(matrix_cache.get_dirty_number(self.event.pk), number)
+        self.assertEqual(matrix_cache.get_dirty_number(self.event.pk), number + 1)
+        self.assert_matches_fresh_build()
+
+    def test_stale_matrix_catches_up(self):
+        key = matrix_cache.MATRIX_KEY.format(generation=matrix_cache.get_generation(), event_pk=self.event.pk)
+        stale = cache.get(key)
+        row = models.ActivityOnEvent.objects.get(activity__name='volunteer_schedule 2')
+        with self.captureOnCommitCallbacks(execute=True):
+            row.person.add(self.persons[3])
+        self.assert_matches_fresh_build()
+
+        # одновременный запрос, начатый до пометки, сохраняет матрицу позже
+        cache.set(key, stale, None)
+        self.assert_matches_fresh_build()
+
+    def test_refreshed_from_primary(self):
+        row = models.ActivityOnEvent.objects.get(activity__name='volunteer_schedule 2')
+        with self.captureOnCommitCallbacks(execute=True):
+            row.person.add(self.persons[3])
+
+        # соединения с репликой в тестах нет: чтение с нее завершилось бы ошибкой
+        def view(request):
+            return HttpResponse(len(matrix_cache.get_volunteer_matrix(self.event).persons))
+
+        with override_settings(DATABASE_REPLICA='replica'):
+            self.assertEqual(db.replica_reads(view)(None).status_code, 200)
+        self.assert_matches_fresh_build()
+
+
+class PersonIndexTest(ScheduleFixtureMixin, TestCase):
+    """
+    Заполнение столбца по шаблону и датам дает те же коды, что get_status по каждой ячейке
+    """
+
+    def test_statuses_match_get_status(self):
+        self.create_rows(8, const.VOLUNTEER)
+        self.persons[1].arrival_datetime = self.start + datetime.timedelta(hours=3)
+        self.persons[2].departure_datetime = self.start + datetime.timedelta(hours=5)
+        self.persons[3].arrival_datetime = None
+        for person in self.persons[1:]:
+            person.save()
+        self.event.participants.add(models.Person.objects.create(first_name='Гость', last_name='Без дат'))
+        models.Person.objects.create(first_name='Свободный', last_name='Человек', arrival_datetime=self.start,
+                                     departure_datetime=self.start + datetime.timedelta(days=3))
+
+        matrix = VolunteerMatrix.for_event(self.event)
+        for column in matrix.columns:
+            busy = matrix.busy_persons(column.slot)
+            self.assertEqual(list(column.statuses),
+                             [availability.get_status(person, column.slot, busy) for person in matrix.persons])
+        self.assertEqual({code for column in matrix.columns for code in column.statuses}, set(range(4)))
+
+
+class RosterTest(ScheduleFixtureMixin, TestCase):
+    """
+    Состав мероприятия: явные участники, люди, чье пребывание пересекается с датами мероприятия,
+    и назначенные на его активности
+    """
+
+    def test_roster(self):
+        self.persons[3].arrival_datetime = datetime.datetime(2022, 4, 20)
+        self.persons[3].departure_datetime = datetime.datetime(2022, 4, 30, 23)
+        self.persons[3].save()
+        guest = models.Person.objects.create(first_name='Гость', last_name='Без дат')
+        models.Person.objects.create(first_name='Другой', last_name='Без дат')
+        self.event.participants.add(guest)
+
+        self.assertEqual(sorted(self.event.get_roster(), key=lambda person: person.pk), self.persons[:3] + [guest])
+
+        self.create_rows(1, const.VOLUNTEER)
+        models.ActivityOnEvent.objects.get().person.add(self.persons[3])
+        self.assertIn(self.persons[3], self.event.get_roster())
+
+    def test_assigned_outside_stay_kept(self):
+        self.create_rows(2, const.VOLUNTEER)
+        models.Person.objects.filter(pk__in=[self.persons[2].pk, self.persons[3].pk]) \
+            .update(arrival_datetime=None, departure_datetime=None)
+
+        response = self.client.get(reverse('download', args=(self.event.pk,)))
+        archive = ZipFile(io.BytesIO(b''.join(response.streaming_content)))
+        self.assertEqual(sorted(archive.namelist()), ['Фамилия0 Имя0.csv', 'Фамилия1 Имя1.csv', 'Фамилия2 Имя2.csv'])
+
+        self.assertEqual(VolunteerMatrix.for_event(self.event).persons, self.persons[:3])
+
+
+class ActivityOnEventAdminTest(ScheduleFixtureMixin, TestCase):
+    """
+    Список и форма активностей в админке: число запросов не зависит от числа строк, людей и активностей
+    """
+
+    def assert_constant_queries(self, url, budget, params=None):
+        self.create_rows(3, const.VOLUNTEER)
+        # типы содержимого для журнала админки кэшируются при первом запросе
+        self.client.get(url, params)
+        with self.assertNumQueries(budget):
+            self.assertEqual(self.client.get(url, params).status_code, 200)
+
+        self.create_rows(12, const.OFFICIAL, offset=3)
+        self.persons += [models.Person.objects.create(first_name=f'Имя{i}', last_name=f'Фамилия{i}')
+                         for i in range(4, 20)]
+        with self.assertNumQueries(budget):
+            self.assertEqual(self.client.get(url, params).status_code, 200)
+
+    def test_changelist(self):
+        self.assert_constant_queries(reverse('admin:schedule_app_activityonevent_changelist'), 6)
+
+    def test_filtered_changelist(self):
+        url = reverse('admin:schedule_app_activityonevent_changelist')
+        params = {'event__id__exact': self.event.pk, 'person': self.persons[0].pk}
+        self.assert_constant_queries(url, 6, params)
+
+        response = self.client.get(url, params)
+        rows = response.context['cl'].result_list
+        expected = set(self.persons[0].activityonevent_set.values_list('pk', flat=True))
+        self.assertEqual({row.pk for row in rows}, expected)
+        self.assertEqual({row.persons_count for row in rows}, {2})
+        self.assertContains(response, f'<option value="{self.persons[0].pk}" selected>{self.persons[0]}</option>')
+
+    def test_change_form(self):
+        self.create_rows(1, const.VOLUNTEER)
+        row = models.ActivityOnEvent.objects.get()
+        self.assert_constant_queries(reverse('admin:schedule_app_activityonevent_change', args=(row.pk,)), 10)
+
+    def test_add_form(self):
+        models.Event.objects.create(title='Следующее', start_date=datetime.date(2022, 6, 1),
+                                    end_date=datetime.date(2022, 6, 2))
+        form = forms.ActivityOnEventForm()
+        self.assertEqual(form.fields['start_dt'].initial, datetime.datetime(2022, 6, 1, 9))
+
+        with self.assertNumQueries(1):
+            forms.ActivityOnEventForm()
+
+    def test_lookup(self):
+        outsider = models.Person.objects.create(first_name='Гость', last_name='Фамилия9')
+        url = reverse('admin:schedule_app_activityonevent_lookup', args=('person',))
+
+        results = self.client.get(url, {'term': 'Фамилия'}).json()['results']
+        self.assertEqual(len(results), 5)
+        results = self.client.get(url, {'term': 'Фамилия', 'event': self.event.pk}).json()['results']
+        self.assertNotIn(str(outsider.pk), [result['id'] for result in results])
+        self.assertEqual(self.client.get(url, {'term': 'Имя1'}).json()['results'],
+                         [{'id': str(self.persons[1].pk), 'text': str(self.persons[1])}])
+
+        self.assertEqual(self.client.get(reverse('admin:schedule_app_activityonevent_lookup', args=('event',)))
+                         .status_code, 404)
+
+    def test_estimated_count(self):
+        self.create_rows(3, const.VOLUNTEER)
+        queryset = models.ActivityOnEvent.objects.all()
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE')
+        self.create_rows(1, const.VOLUNTEER, offset=3)
+        self.assertEqual(schedule_admin.estimated_count(queryset), 3)
+
+        # без фильтров - оценка по статистике, с фильтром или на маленькой таблице - точный подсчет
+        paginator = type('Paginator', (schedule_admin.EstimatedCountPaginator,), {'threshold': 1})
+        self.assertEqual(paginator(queryset, 100).count, 3)
+        self.assertEqual(paginator(queryset.filter(event=self.event), 100).count, 4)
+        self.assertEqual(schedule_admin.EstimatedCountPaginator(queryset, 100).count, 4)
+
+
+class ActivityOnEventFormTest(ScheduleFixtureMixin, TestCase):
+    def form(self, persons, hours=1.5):
+        activity = models.Activity.objects.create(name='Новая', category=self.categories[const.VOLUNTEER])
+        return forms.ActivityOnEventForm(data={'event': self.event.pk,
+                                               'activity': activity.pk,
+                                               'person': [person.pk for person in persons],
+                                               'start_dt': self.start,
+                                               'end_dt': self.start + datetime.timedelta(hours=hours)})
+
+    def test_reports_all_violations(self):
+        self.create_rows(1, const.VOLUNTEER)
+        self.persons[2].excluded_categories.add(self.categories[const.VOLUNTEER])
+        form = self.form(self.persons[:3])
+
+        self.assertFalse(form.is_valid())
+        self.assertEqual(len(form.errors['person']), 1)
+        self.assertEqual(len(form.errors['end_dt']), 2)
+
+    def test_free_time_limit(self):
+        form = self.form(self.persons[3:], hours=7)
+
+        self.assertFalse(form.is_valid())
+        self.assertEqual(form.errors['start_dt'], [f'Недостаточно свободного времени у {self.persons[3]}'])
+
+    def test_lock_timeout(self):
+        message = 'Этих людей сейчас назначает другой координатор, сохраните форму еще раз'
+        with mock.patch.object(assignment, 'lock_persons', side_effect=OperationalError('database is locked')):
+            form = self.form(self.persons[:1])
+            self.assertFalse(form.is_valid())
+            self.assertEqual(form.non_field_errors(), [message])
+
+            data = dict(form.data, start_dt_0='2022-05-01', start_dt_1='09:00', end_dt_0='2022-05-01',
+                        end_dt_1='10:00')
+            response = self.client.post(reverse('admin:schedule_app_activityonevent_add'), data)
+        self.assertContains(response, message)
+        self.assertFalse(models.ActivityOnEvent.objects.exists())
+
+    def test_constant_queries(self):
+        self.create_rows(5, const.VOLUNTEER)
+        self.persons += [models.Person.objects.create(first_name=f'Имя{i}', last_name=f'Фамилия{i}')
+                         for i in range(4, 20)]
+
+        for persons in (self.persons[:2], self.persons):
+            form = self.form(persons)
+            # с точкой сохранения вокруг блокировки людей
+            with self.assertNumQueries(13):
+                form.is_valid()
+
+
+class IntervalsTest(SimpleTestCase):
+    """
+    Свойства на случайных интервалах сверяются с переборным определением пересечения по минутам
+    """
+
+    def random_intervals(self, rnd, count):
+        starts = [rnd.randrange(0, 600, rnd.choice((1, 15, 60))) for _ in range(count)]
+        ends = [start + rnd.choice((0, 1, 30, 60, 90, 120, 180)) for start in starts]
+        return starts, ends
+
+    def brute_force(self, start, end, other_start, other_end):
+        return bool(set(range(start, end)) & set(range(other_start, other_end)))
+
+    def test_overlaps(self):
+        rnd = random.Random(0)
+        for _ in range(2000):
+            (start, other_start), (end, other_end) = self.random_intervals(rnd, 2)
+            expected = self.brute_force(start, end, other_start, other_end)
+            self.assertEqual(intervals.overlaps(start, end, other_start, other_end), expected)
+            self.assertEqual(intervals.overlaps(other_start, other_end, start, end), expected)
+
+    def test_overlapping_pairs(self):
+        rnd = random.Random(1)
+        for count in (0, 1, 2, 10, 50):
+            for _ in range(20):
+                starts, ends = self.random_intervals(rnd, count)
+                expected = {(i, j) for i in range(count) for j in range(i + 1, count)
+                            if self.brute_force(starts[i], ends[i], starts[j], ends[j])}
+                pairs = intervals.overlapping_pairs(starts, ends)
+                self.assertEqual(len(pairs), len(expected))
+                self.assertEqual(set(pairs), expected)
+
+    def test_conflicts(self):
+        rnd = random.Random(2)
+        starts, ends = self.random_intervals(rnd, 200)
+        owners = [rnd.randrange(10) for _ in starts]
+        expected = {}
+        for i in range(len(starts)):
+            for j in range(i + 1, len(starts)):
+                if owners[i] == owners[j] and self.brute_force(starts[i], ends[i], starts[j], ends[j]):
+                    expected.setdefault(owners[i], set()).add((i, j))
+
+        result = intervals.conflicts(starts, ends, owners)
+        self.assertEqual({owner: set(pairs) for owner, pairs in result.items()}, expected)
+
+    def test_is_intersects(self):
+        start = datetime.datetime(2022, 5, 1, 9, 0, 0)
+        hour = datetime.timedelta(hours=1)
+        activity = models.ActivityOnEvent(pk=1, start_dt=start, end_dt=start + 2 * hour)
+        checked = models.ActivityOnEvent(pk=2)
+
+        self.assertTrue(utils.is_intersects(start, start + hour, activity, checked))
+        self.assertTrue(utils.is_intersects(start - hour, start + 3 * hour, activity, checked))
+        self.assertFalse(utils.is_intersects(start + 2 * hour, start + 3 * hour, activity, checked))
+        self.assertFalse(utils.is_intersects(start, start + hour, activity, activity))
+
+
+class AssignmentTest(ScheduleFixtureMixin, TestCase):
+    def slot(self, hours=1, start_dt=None):
+        start_dt = start_dt or self.start
+        activity = models.Activity.objects.create(name='Бар', category=self.categories[const.VOLUNTEER])
+        return models.ActivityOnEvent(event=self.event, activity=activity, start_dt=start_dt,
+                                      end_dt=start_dt + datetime.timedelta(hours=hours))
+
+    def test_assign(self):
+        row = assignment.assign(self.slot(), [person.pk for person in self.persons[:2]])
+
+        self.assertEqual(set(row.person.all()), set(self.persons[:2]))
+        self.assertEqual(workload.get_totals(self.event.pk), {person.pk: datetime.timedelta(hours=1)
+                                                               for person in self.persons[:2]})
+
+    def test_rejects_double_booking(self):
+        assignment.assign(self.slot(), [self.persons[0].pk])
+
+        with self.assertRaises(ValidationError):
+            assignment.assign(self.slot(start_dt=self.start + datetime.timedelta(minutes=30)),
+                              [self.persons[0].pk, self.persons[1].pk])
+        self.assertEqual(models.ActivityOnEvent.objects.count(), 1)
+        self.assertEqual(list(self.persons[1].activityonevent_set.all()), [])
+
+    def test_back_to_back(self):
+        assignment.assign(self.slot(), [self.persons[0].pk])
+        assignment.assign(self.slot(start_dt=self.start + datetime.timedelta(hours=1)), [self.persons[0].pk])
+
+        self.assertEqual(self.persons[0].activityonevent_set.count(), 2)
+
+
+class WorkloadTest(ScheduleFixtureMixin, TestCase):
+    """
+    Хранимая нагрузка остается равной пересчитанной по расписанию после любых изменений
+    """
+
+    def setUp(self):
+        super().setUp()
+        self.create_rows(4, const.VOLUNTEER)
+        self.create_rows(2, const.OFFICIAL, offset=4)
+
+    def assert_consistent(self):
+        self.assertEqual(workload.verify(), {})
+
+    def test_initial(self):
+        self.assert_consistent()
+        self.assertEqual(workload.get_total(self.event.pk, self.persons[0].pk), datetime.timedelta(hours=3))
+
+    def test_assignment_changes(self):
+        row = models.ActivityOnEvent.objects.filter(activity_type_name=const.VOLUNTEER).first()
+        row.person.add(self.persons[3])
+        self.assert_consistent()
+
+        row.person.remove(self.persons[0])
+        self.assert_consistent()
+
+        row.person.clear()
+        self.assert_consistent()
+
+        self.persons[1].activityonevent_set.clear()
+        self.assert_consistent()
+
+    def test_slot_changes(self):
+        row = models.ActivityOnEvent.objects.filter(activity_type_name=const.VOLUNTEER).first()
+        row.end_dt += datetime.timedelta(hours=1)
+        row.save()
+        self.assert_consistent()
+
+        row.activity = models.Activity.objects.filter(category=self.categories[const.OFFICIAL]).first()
+        row.save()
+        self.assert_consistent()
+
+        row.delete()
+        self.assert_consistent()
+
+    def test_category_changes(self):
+        category = self.categories[const.VOLUNTEER]
+        category.time_coefficient = 2
+        category.save()
+        self.assert_consistent()
+        self.assertEqual(workload.get_total(self.event.pk, self.persons[0].pk), datetime.timedelta(hours=6))
+
+        category.activity_type = self.categories[const.OTHER].activity_type
+        category.save()
+        self.assert_consistent()
+
+    def test_rebuild_command(self):
+        models.Workload.objects.update(accounted_time=datetime.timedelta(0))
+
+        with self.assertRaises(CommandError):
+            call_command('rebuild_workload', '--verify', stdout=io.StringIO())
+        call_command('rebuild_workload', stdout=io.StringIO())
+        self.assert_consistent()
+
+
+class AccountedDurationTest(ScheduleFixtureMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.create_rows(3, const.VOLUNTEER)
+
+    def accounted(self):
+        return list(models.ActivityOnEvent.objects.order_by('start_dt').values_list('accounted_duration', flat=True))
+
+    def test_stored_on_save_and_category_change(self):
+        self.assertEqual(self.accounted(), [datetime.timedelta(minutes=90)] * 3)
+
+        category = self.categories[const.VOLUNTEER]
+        category.time_coefficient = 1.5
+        category.additional_time = datetime.time(0, 15)
+        category.save()
+        self.assertEqual(self.accounted(), [datetime.timedelta(minutes=150)] * 3)
+        self.assertEqual(workload.verify(), {})
+        self.assertEqual(workload.get_total(self.event.pk, self.persons[1].pk), datetime.timedelta(minutes=450))
+
+        activity = models.Activity.objects.filter(category=category).earliest('pk')
+        activity.category = self.categories[const.OFFICIAL]
+        activity.save()
+        self.assertEqual(self.accounted()[0], datetime.timedelta(minutes=90))
+
+        # массовое изменение категорий без сигналов: пересчет одним чтением и одним UPDATE
+        models.Category.objects.update(time_coefficient=2)
+        with self.assertNumQueries(2):
+            self.assertEqual(models.ActivityOnEvent.sync_accounted_duration(), 3)
+        self.assertEqual(self.accounted(), [datetime.timedelta(hours=3)] + [datetime.timedelta(minutes=195)] * 2)
+
+    def test_admin_column(self):
+        category = models.Category.objects.create(name='Долгая', time_coefficient=2,
+                                                  activity_type=self.categories[const.VOLUNTEER].activity_type)
+        models.Activity.objects.filter(name=f'{const.VOLUNTEER} 1').update(category=category)
+        models.ActivityOnEvent.sync_accounted_duration()
+
+        url = reverse('admin:schedule_app_activityonevent_changelist')
+        response = self.client.get(url, {'o': '-7'})
+        rows = list(response.context['cl'].result_list)
+        self.assertEqual(rows[0].activity.name, f'{const.VOLUNTEER} 1')
+        self.assertContains(response, '3:00:00')
+
+        response = self.client.get(url, {'accounted': '2-4'})
+        self.assertEqual([row.activity.name for row in response.context['cl'].result_list], [f'{const.VOLUNTEER} 1'])
+        self.assertEqual(len(self.client.get(url, {'accounted': '1-2'}).context['cl'].result_list), 2)
+
+
+class AutoAssignTest(ScheduleFixtureMixin, TestCase):
+    def test_fills_slots_within_rules(self):
+        for offset in (0, 2, 4):
+            self.create_rows(1, const.VOLUNTEER, offset=offset)
+        models.ActivityOnEvent.person.through.objects.all().delete()
+        self.persons[0].excluded_categories.add(self.categories[const.VOLUNTEER])
+        self.persons[1].free_time_limit = datetime.timedelta(hours=1)
+        self.persons[1].save()
+
+        assigner, assignments = auto_assign(self.event)
+
+        self.assertEqual(assigner.fill_rate(), 1.0)
+        for row in models.ActivityOnEvent.objects.filter(event=self.event):
+            persons = set(row.person.all())
+            self.assertEqual(len(persons), 2)
+            self.assertNotIn(self.persons[0], persons)
+            self.assertNotIn(self.persons[1], persons)
+
+        for person in self.persons[2:]:
+            schedule = list(person.get_schedule(self.event.pk).order_by('start_dt'))
+            for current, following in zip(schedule, schedule[1:]):
+                self.assertLessEqual(current.end_dt, following.start_dt)
+
+    def test_revalidated_under_lock(self):
+        self.create_rows(1, const.VOLUNTEER)
+        models.ActivityOnEvent.person.through.objects.all().delete()
+        models.Activity.objects.update(need_peoples=3)
+        assigner = AutoAssigner(self.event)
+        planned = assigner.solve()
+        first, second, third = sorted(next(iter(planned.values())))
+
+        # пока решатель считал, другой координатор занял одного человека и урезал лимит другому
+        activity = models.Activity.objects.create(name='Бар', category=self.categories[const.OTHER])
+        assignment.assign(models.ActivityOnEvent(event=self.event, activity=activity, start_dt=self.start,
+                                                 end_dt=self.start + datetime.timedelta(hours=1)), [first])
+        models.Person.objects.filter(pk=second).update(free_time_limit=datetime.timedelta(0))
+
+        with mock.patch.object(assignment, 'lock_persons', wraps=assignment.lock_persons) as lock_persons:
+            applied = assigner.apply(planned)
+        lock_persons.assert_called_once_with({first, second, third})
+
+        slot = models.ActivityOnEvent.objects.get(activity__category=self.categories[const.VOLUNTEER])
+        persons = set(slot.person.values_list('pk', flat=True))
+        self.assertEqual(applied, {slot.pk: {third}})
+        self.assertEqual(persons, {third})
+        self.assertEqual(workload.get_total(self.event.pk, third), datetime.timedelta(minutes=90))
+
+    def test_admin_action_requires_change_permission(self):
+        self.create_rows(1, const.VOLUNTEER)
+        models.ActivityOnEvent.person.through.objects.all().delete()
+        viewer = User.objects.create_user('viewer', is_staff=True)
+        viewer.user_permissions.add(Permission.objects.get(codename='view_activityonevent'))
+        self.client.force_login(viewer)
+        url = reverse('admin:schedule_app_activityonevent_changelist')
+
+        self.assertIsNone(self.client.get(url).context['action_form'])
+        self.client.post(url, {'action': 'fill_automatically',
+                               '_selected_action': list(models.ActivityOnEvent.objects.values_list('pk', flat=True))})
+        self.assertFalse(models.ActivityOnEvent.person.through.objects.exists())
+
+        self.client.force_login(self.user)
+        choices = dict(self.client.get(url).context['action_form'].fields['action'].choices)
+        self.assertIn('fill_automatically', choices)
+
+    def test_dry_run(self):
+        self.create_rows(1, const.VOLUNTEER)
+        models.ActivityOnEvent.person.through.objects.all().delete()
+
+        _, assignments = auto_assign(self.event, dry_run=True)
+
+        self.assertTrue(assignments)
+        self.assertFalse(models.ActivityOnEvent.person.through.objects.exists())
+
+
+class FreeSlotFinderTest(ScheduleFixtureMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        # 9:00 - 10:30 заняты 0 и 1, 10:00 - 11:30 - 1 и 2
+        self.create_rows(2, const.VOLUNTEER)
+        self.activity = models.Activity.objects.create(name='Бар', category=self.categories[const.VOLUNTEER],
+                                                       need_peoples=2)
+
+    def at(self, hour, minute=0):
+        return self.start.replace(hour=hour, minute=minute)
+
+    def test_candidates(self):
+        finder = FreeSlotFinder.for_event(self.event)
+        slot = finder.make_slot(self.activity, self.at(9, 30), self.at(10))
+        # у второго уже полтора часа из лимита
+        self.assertEqual([pk for pk, _ in finder.candidates_for(slot)], [self.persons[3].pk, self.persons[2].pk])
+        self.assertEqual(finder.candidates_for(slot, limit=1), [(self.persons[3].pk, 0.0)])
+
+        # встык с занятостью - свободен
+        slot = finder.make_slot(self.activity, self.at(10, 30), self.at(11))
+        self.assertEqual({pk for pk, _ in finder.candidates_for(slot)}, {self.persons[0].pk, self.persons[3].pk})
+
+        # до приезда никого нет
+        slot = finder.make_slot(self.activity, self.at(8), self.at(9))
+        self.assertEqual(finder.candidates_for(slot), [])
+
+    def test_candidates_for_existing_slot(self):
+        row = models.ActivityOnEvent.objects.filter(event=self.event).earliest('start_dt')
+        finder = FreeSlotFinder.for_event(self.event)
+        # перенос на 9:30 - 10:00: своя активность занятостью не считается, но ее участники не предлагаются
+        slot = finder.make_slot(row.activity, self.at(9, 30), self.at(10), pk=row.pk)
+        self.assertEqual({pk for pk, _ in finder.candidates_for(slot)}, {self.persons[2].pk, self.persons[3].pk})
+
+        self.persons[3].excluded_categories.add(self.categories[const.VOLUNTEER])
+        self.persons[2].free_time_limit = datetime.timedelta(hours=1)
+        self.persons[2].save()
+        finder = FreeSlotFinder.for_event(self.event)
+        self.assertEqual(finder.candidates_for(slot), [])
+
+    def test_free_windows(self):
+        finder = FreeSlotFinder.for_event(self.event)
+        departure = self.start + datetime.timedelta(days=3)
+        self.assertEqual(finder.free_windows(self.persons[1].pk), [(self.at(11, 30), departure)])
+        self.assertEqual(finder.free_windows(self.persons[0].pk, end_dt=self.at(12)), [(self.at(10, 30), self.at(12))])
+        self.assertEqual(finder.free_windows(self.persons[2].pk, end_dt=self.at(12),
+                                             min_duration=datetime.timedelta(hours=1)), [(self.at(9), self.at(10))])
+        self.assertEqual(finder.free_windows(self.persons[2].pk, end_dt=self.at(12)),
+                         [(self.at(9), self.at(10)), (self.at(11, 30), self.at(12))])
+
+    def test_cached_by_event_version(self):
+        FreeSlotFinder.for_event(self.event)
+        with self.assertNumQueries(1):
+            FreeSlotFinder.for_event(self.event)
+
+        models.ActivityOnEvent.objects.filter(event=self.event).earliest('start_dt').person.set([self.persons[3]])
+        finder = FreeSlotFinder.for_event(self.event)
+        self.assertEqual(finder.free_windows(self.persons[0].pk, end_dt=self.at(12)), [(self.at(9), self.at(12))])
+
+    def test_admin_candidates(self):
+        url = reverse('admin:schedule_app_activityonevent_candidates')
+        params = {'event': self.event.pk, 'activity': self.activity.pk, 'start_dt_0': '01.05.2022',
+                  'start_dt_1': '09:30', 'end_dt_0': '01.05.2022', 'end_dt_1': '10:00'}
+        candidates = self.client.get(url, params).json()['candidates']
+        self.assertEqual([candidate['pk'] for candidate in candidates], [self.persons[3].pk, self.persons[2].pk])
+        self.assertEqual(candidates[0]['name'], str(self.persons[3]))
+
+        self.assertEqual(self.client.get(url, {**params, 'end_dt_1': 'полдень'}).json(), {'candidates': []})
+        self.assertEqual(self.client.get(url, {**params, 'object': 'new'}).json(), {'candidates': []})
+        self.assertContains(self.client.get(reverse('admin:schedule_app_activityonevent_add')), 'person-candidates')
+
+        viewer = User.objects.create_user('viewer', is_staff=True)
+        viewer.user_permissions.add(Permission.objects.get(codename='view_activityonevent'))
+        self.client.force_login(viewer)
+        self.assertEqual(self.client.get(url, params).status_code, 403)
+
+
+class ImportScheduleTest(ScheduleFixtureMixin, TestCase):
+    persons_csv = '''first_name,last_name,email,arrival,departure,free_time_limit,night_man,excluded_categories
+Новый,Человек,new@example.com,2022-05-01 09:00,2022-05-03 21:00,2,да,official_schedule
+Имя0,Фамилия0,,2022-05-01 09:00,2022-05-03 21:00,,,
+'''
+    schedule_csv = '''activity,category,description,need_peoples,start,end,persons
+Бар,volunteer_schedule,,2,2022-05-01 10:00,2022-05-01 11:00,Человек Новый;Фамилия0 Имя0
+Бар,volunteer_schedule,,2,2022-05-01 11:00,2022-05-01 12:00,Человек Новый
+Открытие,official_schedule,Начало,,2022-05-01 12:00,2022-05-01 13:00,
+'''
+
+    def run_import(self, persons=persons_csv, schedule=schedule_csv, **kwargs):
+        return importer.import_schedule(self.event, io.StringIO(persons), io.StringIO(schedule), **kwargs)
+
+    def test_import(self):
+        self.assertEqual(self.run_import(), (1, 2, 3, 3))
+
+        person = models.Person.objects.get(last_name='Человек')
+        self.assertTrue(person.night_man)
+        self.assertEqual(person.free_time_limit, datetime.timedelta(hours=2))
+        self.assertEqual(list(person.excluded_categories.all()), [self.categories[const.OFFICIAL]])
+        self.assertIn(person, self.event.participants.all())
+
+        rows = list(self.event.get_schedule().filter(activity__name='Бар').order_by('start_dt'))
+        self.assertEqual(len(rows), 2)
+        self.assertEqual(rows[0].activity, rows[1].activity)
+        self.assertEqual(set(rows[0].person.all()), {person, self.persons[0]})
+        self.assertEqual(self.event.get_schedule(const.OFFICIAL).get().activity.description, 'Начало')
+        self.assertEqual(workload.verify(), {})
+
+    def test_dry_run(self):
+        self.assertEqual(self.run_import(dry_run=True), (1, 2, 3, 3))
+        self.assertFalse(models.Person.objects.filter(last_name='Человек').exists())
+        self.assertFalse(models.ActivityOnEvent.objects.exists())
+
+    def test_error_report(self):
+        self.create_rows(1, const.VOLUNTEER)
+        persons = self.persons_csv.replace(',2,да,', ',1,да,')
+        schedule = self.schedule_csv + '''Бар,volunteer_schedule,,2,2022-05-01 10:30,2022-05-01 11:30,Фамилия0 Имя0
+Сцена,official_schedule,,1,2022-05-01 14:00,2022-05-01 15:00,Человек Новый
+Бар,volunteer_schedule,,2,2022-05-05 10:00,2022-05-05 11:00,Фамилия3 Имя3;Никто Нигде
+Бар,нет такой,,2,2022-05-01 10:00,2022-05-01 11:00,
+'''
+
+        with self.assertRaises(ValidationError) as context:
+            self.run_import(persons, schedule)
+
+        messages = context.exception.messages
+        self.assertEqual(len(messages), 7, messages)
+        self.assertIn('Расписание, строка 8: нет категории "нет такой"', messages)
+        self.assertIn('Расписание, строка 7: человек "Никто Нигде" не найден', messages)
+        # строка 2 пересекается с существующей активностью 9:00 - 10:30, строка 5 - со строкой 2
+        self.assertEqual([message[:21] for message in messages if 'пересечение у Имя0 Фамилия0' in message],
+                         ['Расписание, строка 2:', 'Расписание, строка 5:'])
+        self.assertIn('Расписание, строка 6: Новый Человек не изволит работать с категорией official_schedule',
+                      messages)
+        self.assertIn('Расписание, строка 7: Имя3 Фамилия3 не будет на Adentro в это время', messages)
+        self.assertIn('Расписание: недостаточно свободного времени у Новый Человек', messages)
+        self.assertFalse(models.Person.objects.filter(last_name='Человек').exists())
+        self.assertEqual(models.ActivityOnEvent.objects.count(), 1)
+
+    def test_validated_under_lock(self):
+        schedule = 'activity,category,description,need_peoples,start,end,persons\n' \
+                   'Бар,volunteer_schedule,,2,2022-05-01 10:00,2022-05-01 11:00,Фамилия0 Имя0\n'
+        schedule_importer = importer.ScheduleImporter(self.event)
+        schedule_importer.read_schedule(io.StringIO(schedule))
+        # координатор меняет лимит человека до начала транзакции импорта
+        models.Person.objects.filter(pk=self.persons[0].pk).update(free_time_limit=datetime.timedelta(0))
+
+        with mock.patch.object(assignment, 'lock_persons', wraps=assignment.lock_persons) as lock_persons:
+            schedule_importer.lock()
+        lock_persons.assert_called_once_with([self.persons[0].pk])
+        self.assertEqual(schedule_importer.validate(), ['Расписание: недостаточно свободного времени у Имя0 Фамилия0'])
+
+        with mock.patch.object(assignment, 'lock_persons', wraps=assignment.lock_persons) as lock_persons:
+            with self.assertRaises(ValidationError):
+                importer.import_schedule(self.event, schedule_file=io.StringIO(schedule))
+        lock_persons.assert_called_once_with([self.persons[0].pk])
+
+    def test_bulk_insert_after_concurrent_insert(self):
+        category = self.categories[const.VOLUNTEER]
+        bulk_create = models.Activity.objects.bulk_create
+
+        def concurrent_bulk_create(objs):
+            # строка, вставленная в админке до того, как импорт взял блокировку записи
+            models.Activity.objects.create(name='Из админки', category=category)
+            return bulk_create(objs)
+
+        with mock.patch.object(models.Activity.objects, 'bulk_create', concurrent_bulk_create):
+            with transaction.atomic():
+                activities = importer.bulk_insert(models.Activity, [models.Activity(name=name, category=category)
+                                                                    for name in ('Бар', 'Сцена')])
+        self.assertEqual([models.Activity.objects.get(pk=activity.pk).name for activity in activities],
+                         ['Бар', 'Сцена'])
+
+    def test_command(self):
+        out = io.StringIO()
+        with self.assertRaises(CommandError):
+            call_command('import_schedule', self.event.pk, stdout=out, stderr=out)
+
+        with tempfile.NamedTemporaryFile('w', suffix='.csv', encoding='utf-8-sig') as file:
+            file.write(self.persons_csv)
+            file.flush()
+            call_command('import_schedule', self.event.pk, persons=file.name, stdout=out)
+        self.assertIn('Создано: людей 1, активностей 0, слотов 0, назначений 0', out.getvalue())
+
+    def test_admin_upload(self):
+        url = reverse('admin:schedule_app_event_import', args=(self.event.pk,))
+        self.assertEqual(self.client.get(url).status_code, 200)
+
+        files = {'persons': SimpleUploadedFile('persons.csv', self.persons_csv.encode('utf-8-sig')),
+                 'schedule': SimpleUploadedFile('schedule.csv', self.schedule_csv.encode())}
+        response = self.client.post(url, files)
+        self.assertRedirects(response, reverse('admin:schedule_app_event_change', args=(self.event.pk,)))
+        self.assertEqual(self.event.get_schedule().count(), 3)
+
+
+class CoverageTest(ScheduleFixtureMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.create_rows(3, const.VOLUNTEER)
+        activity = models.Activity.objects.create(name='Бар', category=self.categories[const.VOLUNTEER],
+                                                  need_peoples=4)
+        self.bar = models.ActivityOnEvent.objects.create(event=self.event, activity=activity,
+                                                         start_dt=self.at(9, 30), end_dt=self.at(10))
+        self.create_rows(1, const.OFFICIAL, offset=1)
+        official = models.ActivityOnEvent.objects.get(activity_type_name=const.OFFICIAL)
+        official.person.set([self.persons[3]])
+
+    def at(self, hour, minute=0):
+        return self.start.replace(hour=hour, minute=minute)
+
+    def test_report(self):
+        with self.assertNumQueries(3):
+            report = coverage.Coverage.for_event(self.event).as_dict()
+
+        self.assertEqual((report['slots'], report['need'], report['missing'], report['fill_rate']), (4, 10, 4, 0.6))
+        self.assertEqual([(slot['pk'], slot['missing']) for slot in report['understaffed']], [(self.bar.pk, 4)])
+        # четвертый человек занят на официальной активности 10:00 - 11:30, остальные - на волонтерских
+        self.assertEqual(report['no_free_windows'], [{'start_dt': self.at(10), 'end_dt': self.at(10, 30), 'demand': 4},
+                                                     {'start_dt': self.at(11), 'end_dt': self.at(11, 30), 'demand': 4}])
+        self.assertEqual(report['peak_demand'], {'need': 6, 'slots': 2, 'start_dt': self.at(9, 30),
+                                                 'end_dt': self.at(10)})
+        self.assertEqual(report['categories'], [{'name': const.VOLUNTEER, 'slots': 4, 'need': 10, 'assigned': 6,
+                                                 'missing': 4, 'fill_rate': 0.6}])
+
+    def test_views(self):
+        url = reverse('coverage', args=(self.event.pk,))
+        self.assertEqual(self.client.get(url, {'format': 'json'}).json()['missing'], 4)
+        self.assertContains(self.client.get(url), 'Бар')
+
+        out = io.StringIO()
+        call_command('coverage', self.event.pk, stdout=out)
+        self.assertIn('Заполнено 60%, не хватает 4', out.getvalue())
+
+
+class AsyncViewsTest(ScheduleFixtureMixin, TransactionTestCase):
+    """
+    Асинхронные версии страниц работают с базой из пула потоков и отдают то же, что и синхронные
+    """
+
+    def get(self, view, path, *args):
+        request = AsyncRequestFactory().get(path)
+        request.user = self.user
+        request.session = self.client.session
+        return async_to_sync(view)(request, *args)
+
+    def test_pages(self):
+        self.create_rows(2, const.VOLUNTEER)
+        self.create_rows(2, const.OFFICIAL, offset=2)
+
+        person_url = reverse('person', args=(self.event.pk, self.persons[1].pk))
+        response = self.get(async_views.show_person_schedule, person_url, self.event.pk, self.persons[1].pk)
+        self.assertEqual(response.content, self.client.get(person_url).content)
+
+        official_url = reverse('official_schedule', args=(self.event.pk,))
+        response = self.get(async_views.show_official_schedule, official_url, self.event.pk)
+        self.assertContains(response, 'official_schedule 2')
+
+    def test_download_all(self):
+        self.create_rows(2, const.VOLUNTEER)
+        url = reverse('download', args=(self.event.pk,))
+
+        response = self.get(async_views.download_all, url, self.event.pk)
+
+        archive = ZipFile(io.BytesIO(b''.join(response.streaming_content)))
+        self.assertEqual(len(archive.namelist()), 3)
+        self.assertIn("filename*=utf-8''", response['Content-Disposition'])
+
+
+class LiveUpdatesTest(ScheduleFixtureMixin, TestCase):
+    """
+    Изменения активностей и назначений публикуются в каналы мероприятия и людей после фиксации транзакции
+    """
+
+    def received(self, name, change):
+        async def run():
+            async with live.get_broker().subscribe(name) as subscription:
+                await sync_to_async(change)()
+                await asyncio.sleep(0)
+                messages = []
+                while not subscription.queue.empty():
+                    messages.append(subscription.queue.get_nowait())
+                return messages
+
+        return async_to_sync(run)()
+
+    def committed(self, change):
+        def run():
+            with self.captureOnCommitCallbacks(execute=True):
+                change()
+        return run
+
+    def test_slot_changes(self):
+        self.create_rows(1, const.VOLUNTEER)
+        row = models.ActivityOnEvent.objects.get()
+
+        def move():
+            row.end_dt += datetime.timedelta(hours=1)
+            row.save()
+
+        messages = self.received(live.channel('event', self.event.pk), self.committed(move))
+        self.assertEqual(messages, [{'events': [self.event.pk], 'persons': [self.persons[0].pk, self.persons[1].pk],
+                                     'slots': [row.pk]}])
+
+        messages = self.received(live.channel('person', self.persons[3].pk),
+                                 self.committed(lambda: row.person.add(self.persons[3])))
+        self.assertEqual([message['slots'] for message in messages], [[row.pk]])
+
+        messages = self.received(live.channel('person', self.persons[3].pk),
+                                 self.committed(lambda: self.persons[3].activityonevent_set.clear()))
+        self.assertEqual([message['slots'] for message in messages], [[row.pk]])
+
+        pk = row.pk
+        messages = self.received(live.channel('event', self.event.pk), self.committed(row.delete))
+        self.assertEqual([message['slots'] for message in messages], [[pk]])
+
+    def test_person_side_clear(self):
+        self.create_rows(2, const.VOLUNTEER)
+        slot_pks = set(self.persons[1].activityonevent_set.values_list('pk', flat=True))
+
+        # затронутые активности определяются один раз и передаются нагрузке, версиям, live и кэшу матрицы
+        with mock.patch.object(signals, 'slots_changed', wraps=signals.slots_changed) as slots_changed:
+            messages = self.received(live.channel('person', self.persons[1].pk),
+                                     self.committed(lambda: self.persons[1].activityonevent_set.clear()))
+        slots_changed.assert_called_once()
+        event_pks, person_pks, changed_slot_pks = slots_changed.call_args.args
+        self.assertEqual((set(event_pks), list(person_pks), set(changed_slot_pks)),
+                         ({self.event.pk}, [self.persons[1].pk], slot_pks))
+        self.assertEqual([set(message['slots']) for message in messages], [slot_pks])
+        self.assertEqual(workload.verify(), {})
+        self.assertEqual(matrix_cache.get_dirty_number(self.event.pk), 1)
+
+    def test_rollback(self):
+        self.create_rows(1, const.VOLUNTEER)
+        row = models.ActivityOnEvent.objects.get()
+
+        def rolled_back():
+            with self.captureOnCommitCallbacks(execute=True):
+                with transaction.atomic():
+                    row.person.add(self.persons[3])
+                    transaction.set_rollback(True)
+
+        self.assertEqual(self.received(live.channel('event', self.event.pk), rolled_back), [])
+
+    def test_slow_subscriber(self):
+        async def run():
+            broker = live.LocalBroker(queue_size=2)
+            async with broker.subscribe('event:1') as subscription:
+                for i in range(3):
+                    broker.publish('event:1', {'slots': [i]})
+                await asyncio.sleep(0)
+                return await subscription.get()
+
+        self.assertIs(async_to_sync(run)(), live.RELOAD)
+
+    def test_volunteer_matrix_subscribes(self):
+        self.create_rows(1, const.VOLUNTEER)
+        response = self.client.get(reverse('volunteer_schedule', args=(self.event.pk,)))
+        self.assertContains(response, f'data-live="{reverse("live_event", args=(self.event.pk,))}"')
+
+    def test_fallback_without_asgi(self):
+        self.assertEqual(self.client.get(reverse('live_event', args=(self.event.pk,))).status_code, 204)
+
+
+class LiveStreamTest(ScheduleFixtureMixin, TransactionTestCase):
+    """
+    Поток server-sent events перед Django: проверка входа, сообщения своего мероприятия, остальное - в Django
+    """
+
+    def stream(self, path, messages=(), cookie=True):
+        async def django_application(scope, receive, send):
+            await send({'type': 'http.response.start', 'status': 200, 'headers': []})
+            await send({'type': 'http.response.body', 'body': b'django'})
+
+        async def run():
+            sent = []
+            disconnected = asyncio.Event()
+            started = asyncio.Event()
+
+            async def receive():
+                await disconnected.wait()
+                return {'type': 'http.disconnect'}
+
+            async def send(message):
+                sent.append(message)
+                if message.get('more_body'):
+                    started.set()
+
+            headers = [(b'cookie', f'sessionid={self.client.cookies["sessionid"].value}'.encode())] if cookie else []
+            scope = {'type': 'http', 'method': 'GET', 'path': path, 'query_string': b'', 'headers': headers}
+            task = asyncio.ensure_future(sse.with_live_updates(django_application)(scope, receive, send))
+            await asyncio.wait({task, asyncio.ensure_future(started.wait())}, return_when=asyncio.FIRST_COMPLETED)
+            for message in messages:
+                live.send(message)
+            for _ in range(10):
+                await asyncio.sleep(0)
+            disconnected.set()
+            await task
+            return sent
+
+        return async_to_sync(run)()
+
+    def test_stream(self):
+        path = reverse('live_person', args=(self.event.pk, self.persons[0].pk))
+        other = {'events': [self.event.pk + 1], 'persons': [self.persons[0].pk], 'slots': [7]}
+        message = {'events': [self.event.pk], 'persons': [self.persons[0].pk], 'slots': [5]}
+
+        sent = self.stream(path, [other, message])
+
+        self.assertEqual(sent[0]['status'], 200)
+        self.assertIn((b'content-type', b'text/event-stream'), sent[0]['headers'])
+        body = b''.join(message['body'] for message in sent[1:])
+        self.assertEqual(body, b'retry: 5000\n\nevent: schedule\ndata: {"slots": [5]}\n\n')
+
+    def test_access(self):
+        self.assertEqual(self.stream(reverse('live_event', args=(self.event.pk,)), cookie=False)[0]['status'], 403)
+        self.assertEqual(self.stream(reverse('live_event', args=(self.event.pk + 1,)))[0]['status'], 404)
+        self.assertEqual(self.stream(reverse('events'))[1]['body'], b'django')
+
+
+class ConditionalRequestTest(ScheduleFixtureMixin, TestCase):
+    """
+    Повторные загрузки без изменений: 304 или тело из кэша за один запрос версии (плюс сессия и пользователь)
+    """
+
+    def setUp(self):
+        super().setUp()
+        self.create_rows(4, const.VOLUNTEER)
+
+    def test_not_modified(self):
+        url = reverse('person', args=(self.event.pk, self.persons[0].pk))
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+
+        with self.assertNumQueries(3):
+            not_modified = self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(not_modified.status_code, 304)
+
+        with self.assertNumQueries(3):
+            cached = self.client.get(url)
+        self.assertEqual(cached.content, response.content)
+        self.assertEqual(cached['ETag'], response['ETag'])
+
+    def test_cached_download_keeps_headers(self):
+        url = reverse('download_person_schedule', args=(self.event.pk, self.persons[0].pk))
+        response = self.client.get(url, {'format': 'ics'})
+        cached = self.client.get(url, {'format': 'ics'})
+
+        self.assertEqual(cached.content, response.content)
+        self.assertEqual(cached['Content-Type'], 'text/calendar; charset=utf-8')
+        self.assertEqual(cached['Content-Disposition'], response['Content-Disposition'])
+        self.assertNotEqual(self.client.get(url)['ETag'], response['ETag'])
+
+    def test_versions(self):
+        person_url = reverse('person', args=(self.event.pk, self.persons[0].pk))
+        other_url = reverse('person', args=(self.event.pk, self.persons[3].pk))
+        event_url = reverse('official_schedule', args=(self.event.pk,))
+        etags = {url: self.client.get(url)['ETag'] for url in (person_url, other_url, event_url)}
+
+        row = models.ActivityOnEvent.objects.get(activity__name='volunteer_schedule 1')
+        row.person.add(self.persons[0])
+
+        self.assertNotEqual(self.client.get(person_url)['ETag'], etags[person_url])
+        self.assertNotEqual(self.client.get(event_url)['ETag'], etags[event_url])
+        self.assertEqual(self.client.get(other_url)['ETag'], etags[other_url])
+
+        activity = row.activity
+        activity.name = 'Переименована'
+        activity.save()
+        self.assertContains(self.client.get(person_url), 'Переименована')
+
+    def test_person_change_touches_own_events(self):
+        other = models.Event.objects.create(title='Другое', start_date=datetime.date(2022, 6, 1),
+                                            end_date=datetime.date(2022, 6, 2))
+        urls = [reverse('official_schedule', args=(event.pk,)) for event in (self.event, other)]
+        etags = [self.client.get(url)['ETag'] for url in urls]
+
+        self.persons[3].first_name = 'Переименован'
+        self.persons[3].save()
+        self.assertEqual([self.client.get(url)['ETag'] == etag for url, etag in zip(urls, etags)], [False, True])
+
+        # приезд на другое мероприятие включает человека в его состав
+        etags = [self.client.get(url)['ETag'] for url in urls]
+        self.persons[3].arrival_datetime = datetime.datetime(2022, 6, 1, 9)
+        self.persons[3].departure_datetime = datetime.datetime(2022, 6, 2, 21)
+        self.persons[3].save()
+        self.assertEqual([self.client.get(url)['ETag'] == etag for url, etag in zip(urls, etags)], [False, False])
+
+    def test_event_change_refreshes_person_page(self):
+        url = reverse('person', args=(self.event.pk, self.persons[3].pk))
+        etag = self.client.get(url)['ETag']
+
+        # изменение расписания мероприятия без участия человека его страницу не затрагивает
+        self.create_rows(1, const.OFFICIAL, offset=4)
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+        self.event.title = 'Adentro 2022'
+        self.event.save()
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+
+class DownloadAllTest(ScheduleFixtureMixin, TestCase):
+    def test_streams_one_csv_per_person(self):
+        self.create_rows(4, const.VOLUNTEER)
+        url = reverse('download', args=(self.event.pk,))
+
+        with self.assertNumQueries(5):
+            response = self.client.get(url)
+            archive = ZipFile(io.BytesIO(b''.join(response.streaming_content)))
+
+        self.assertEqual(sorted(archive.namelist()), [f'Фамилия{i} Имя{i}.csv' for i in range(3)])
+        self.assertEqual(archive.read('Фамилия0 Имя0.csv').decode(),
+                         'Subject,Start Date,Start Time,End Date,End Time,Description\n'
+                         'volunteer_schedule 0,2022-05-01,09:00:00,2022-05-01,10:30:00,\n'
+                         'volunteer_schedule 2,2022-05-01,11:00:00,2022-05-01,12:30:00,\n')
+
+
+class DownloadPersonTest(ScheduleFixtureMixin, TestCase):
+    def test_csv(self):
+        self.create_rows(2, const.VOLUNTEER)
+        response = self.client.get(reverse('download_person_schedule', args=(self.event.pk, self.persons[1].pk)))
+
+        self.assertEqual(response.content.decode(),
+                         'Subject,Start Date,Start Time,End Date,End Time,Description\n'
+                         'volunteer_schedule 0,2022-05-01,09:00:00,2022-05-01,10:30:00,\n'
+                         'volunteer_schedule 1,2022-05-01,10:00:00,2022-05-01,11:30:00,\n')
+
+    def test_empty_csv(self):
+        response = self.client.get(reverse('download_person_schedule', args=(self.event.pk, self.persons[0].pk)))
+
+        self.assertEqual(response.content, b'\n')
+
+    def test_ics(self):
+        self.create_rows(1, const.VOLUNTEER)
+        response = self.client.get(reverse('download_person_schedule', args=(self.event.pk, self.persons[0].pk)),
+                                   {'format': 'ics'})
+
+        content = response.content.decode()
+        self.assertTrue(content.startswith('BEGIN:VCALENDAR\r\n'))
+        self.assertIn('DTSTART:20220501T090000\r\nDTEND:20220501T103000\r\nSUMMARY:volunteer_schedule 0\r\n', content)
+
+
+@override_settings(DATABASE_REPLICA='replica')
+class ReplicaRouterTest(SimpleTestCase):
+    def setUp(self):
+        self.router = db.ReplicaRouter()
+
+    def test_report_reads(self):
+        read = db.replica_reads(lambda request: HttpResponse(self.router.db_for_read(models.Event)))
+
+        self.assertEqual(read(None).content, b'replica')
+        self.assertIsNone(self.router.db_for_read(models.Event))
+        self.assertEqual(self.router.db_for_write(models.Event), 'default')
+        self.assertFalse(self.router.allow_migrate('replica', 'schedule_app'))
+
+    def test_streaming(self):
+        def view(request):
+            return StreamingHttpResponse(self.router.db_for_read(models.Event) for _ in range(2))
+
+        response = db.replica_reads(view)(None)
+        self.assertIsNone(self.router.db_for_read(models.Event))
+        self.assertEqual(b''.join(response.streaming_content), b'replicareplica')
+
+    def test_primary_reads(self):
+        def view(request):
+            with db.primary_reads():
+                return HttpResponse(self.router.db_for_read(models.Event) or 'default')
+
+        self.assertEqual(db.replica_reads(view)(None).content, b'default')
+
+    @override_settings(DATABASE_REPLICA=None)
+    def test_without_replica(self):
+        read = db.replica_reads(lambda request: HttpResponse(self.router.db_for_read(models.Event) or 'default'))
+        self.assertEqual(read(None).content, b'default')
+
+
+@override_settings(PROFILING=True, MIDDLEWARE=['adentro_schedule.profiling.ProfilingMiddleware'] + settings.MIDDLEWARE)
+class ProfilingMiddlewareTest(ScheduleFixtureMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        profiling.stats.clear()
+        self.create_rows(3, const.OFFICIAL)
+
+    def test_server_timing_and_stats(self):
+        url = reverse('official_schedule', args=(self.event.pk,))
+        responses = [self.client.get(url) for _ in range(2)]
+
+        timing = dict(metric.split(';', 1) for metric in responses[0]['Server-Timing'].split(', '))
+        self.assertEqual(set(timing), {'total', 'db', 'tpl', 'app'})
+        self.assertIn('7 queries', timing['db'])
+        # повторный запрос берет тело из кэша по версии мероприятия
+        self.assertIn('3 queries', responses[1]['Server-Timing'])
+
+        stats = self.client.get(reverse('profiling_stats')).json()
+        self.assertEqual(stats['official_schedule']['count'], 2)
+        self.assertEqual(stats['official_schedule']['queries'], 5)
+        self.assertGreater(stats['official_schedule']['template_ms'], 0)
+        self.assertLessEqual(stats['official_schedule']['p50_ms'], stats['official_schedule']['p99_ms'])
+
+    def test_duplicates(self):
+        profiling.install_wrapper(connection)
+        recorder = profiling.Recorder()
+        profiling.current.set(recorder)
+        try:
+            for person in self.persons:
+                person.activityonevent_set.count()
+        finally:
+            profiling.current.set(None)
+
+        self.assertEqual(recorder.queries, 4)
+        self.assertEqual(recorder.duplicates, 3)
+        self.assertEqual(recorder.top_duplicate()[1], 4)
+
+    def test_async_handler(self):
+        # соединение тестовой базы открыто до загрузки middleware, connection_created для него уже не придет
+        profiling.install_wrapper(connection)
+        client = AsyncClient()
+        client.force_login(self.user)
+        response = async_to_sync(client.get)(reverse('official_schedule', args=(self.event.pk,)))
+
+        self.assertIn('7 queries', response['Server-Timing'])
+
+    @override_settings(PROFILING=False)
+    def test_stats_disabled(self):
+        self.assertEqual(self.client.get(reverse('profiling_stats')).status_code, 404)
@@ -1,14 +1,24 @@
+from django.conf import settings
 from django.urls import path
 
-from . import views
+from . import async_views, views
+
+# под ASGI страницы расписания отдаются асинхронными версиями (см. adentro_schedule/asgi.py)
+schedule_views = async_views if settings.ASYNC_VIEWS else views
 
 urlpatterns = [
     path('', views.EventsList.as_view(), name='events'),
     path('login', views.login, name='login'),
-    path('<int:pk>/volunteer_schedule', views.show_volunteer_schedule, name='volunteer_schedule'),
-    path('<int:pk>/official_schedule', views.show_official_schedule, name='official_schedule'),
-    path('<int:pk>/other_schedule', views.show_other_schedule, name='other_schedule'),
-    path('<int:pk>/download_schedule', views.download_all, name='download'),
-    path('<int:event_pk>/<int:person_pk>/download_schedule', views.download_person, name='download_person_schedule'),
-    path('<int:event_pk>/<int:person_pk>', views.show_person_schedule, name='person')
+    path('<int:pk>/volunteer_schedule', schedule_views.show_volunteer_schedule, name='volunteer_schedule'),
+    path('<int:pk>/volunteer_schedule/data', schedule_views.volunteer_schedule_data, name='volunteer_schedule_data'),
+    path('<int:pk>/official_schedule', schedule_views.show_official_schedule, name='official_schedule'),
+    path('<int:pk>/other_schedule', schedule_views.show_other_schedule, name='other_schedule'),
+    path('<int:pk>/coverage', schedule_views.show_coverage, name='coverage'),
+    path('<int:pk>/download_schedule', schedule_views.download_all, name='download'),
+    path('<int:event_pk>/<int:person_pk>/download_schedule', schedule_views.download_person,
+         name='download_person_schedule'),
+    path('<int:event_pk>/<int:person_pk>', schedule_views.show_person_schedule, name='person'),
+    # под ASGI эти адреса обслуживает поток живых обновлений (sse.py) до того, как запрос попадет в Django
+    path('<int:event_pk>/live', views.live_updates, name='live_event'),
+    path('<int:event_pk>/<int:person_pk>/live', views.live_updates, name='live_person'),
 ]
@@ -1,10 +1,9 @@
 import datetime
-from collections import namedtuple
-from decimal import Decimal
+from urllib.parse import quote
 
-import pandas as pd
 from django.shortcuts import reverse
 
+from schedule_app.intervals import overlaps
 from schedule_app.models import Event
 
 dt_format = '%d.%m %H:%M'
@@ -59,15 +58,6 @@ def get_duration(value: dict) -> datetime.timedelta:
     return datetime.timedelta(seconds=int((value['end_dt'] - value['start_dt']).total_seconds()))
 
 
-def get_duration_with_coef(duration: datetime.timedelta,
-                           additional_time: datetime.time,
-                           time_coef: Decimal) -> datetime.timedelta:
-    add_time = datetime.timedelta(hours=additional_time.hour,
-                                  minutes=additional_time.minute,
-                                  seconds=additional_time.second)
-    return datetime.timedelta(seconds=int(duration.total_seconds()) * float(time_coef)) + add_time
-
-
 def date_transform(value, duration, duration_with_coef):
     """
     Формирование строки с временем начала и конца активности,
@@ -95,33 +85,21 @@ def human_readable_time(value):
 
 
 def is_intersects(start_dt, end_dt, activity, checked_activity):
-    Range = namedtuple('Range', ['start', 'end'])
-
-    r1 = Range(start=start_dt, end=end_dt)
-    r2 = Range(start=activity.start_dt, end=activity.end_dt)
-    if r1.start > r2.end or r1.end < r2.start:
+    """
+    Интервал [start_dt, end_dt) пересекается с активностью activity, если это не сама checked_activity
+    """
+    if checked_activity == activity or checked_activity.pk == activity.pk:
         return False
+    return overlaps(start_dt, end_dt, activity.start_dt, activity.end_dt)
+
 
-    latest_start = max(r1.start, r2.start)
-    earliest_end = min(r1.end, r2.end)
-    delta = ((earliest_end - latest_start).total_seconds() // 60) % 60
-
-    overlap = max(0, delta)
-    if overlap > 0 and checked_activity != activity and checked_activity.pk != activity.pk:
-        return True
-    return False
-
-
-def create_google_calendar_format_schedule(activities):
-    date_format = '%Y-%m-%d'
-    time_format = '%H:%M:%S'
-    data = []
-    for activity in activities:
-        data.append({'Subject': activity.activity.name,
-                     'Start Date': activity.start_dt.strftime(date_format),
-                     'Start Time': activity.start_dt.strftime(time_format),
-                     'End Date': activity.end_dt.strftime(date_format),
-                     'End Time': activity.end_dt.strftime(time_format),
-                     'Description': activity.activity.description})
-
-    return pd.DataFrame(data, dtype=str)
+def content_disposition(filename):
+    """
+    Заголовок Content-Disposition для скачивания файла, в том числе с кириллическим именем
+    """
+    try:
+        filename.encode('ascii')
+        file_expr = f'filename="{filename}"'
+    except UnicodeEncodeError:
+        file_expr = f"filename*=utf-8''{quote(filename)}"
+    return f'attachment; {file_expr}'
@@ -0,0 +1,85 @@
+"""
+Пакетная проверка назначения людей на активность.
+
+Расписания, исключенные категории и хранимая нагрузка всех выбранных людей загружаются
+постоянным числом запросов, после чего все проверки выполняются в памяти.
+Ошибки собираются по всем людям сразу, а не до первой найденной
+"""
+import datetime
+from collections import defaultdict
+
+from django.core.exceptions import ValidationError
+
+import schedule_app.constants as const
+import schedule_app.workload as workload
+from schedule_app import models
+from schedule_app.utils import is_intersects
+
+
+class AssignmentValidator:
+    def __init__(self, event, activity, start_dt, end_dt, instance=None):
+        self.event = event
+        self.activity = activity
+        self.start_dt = start_dt
+        self.end_dt = end_dt
+        self.instance = instance if instance is not None else models.ActivityOnEvent()
+
+    def load_excluded(self, person_pks):
+        return set(models.Person.excluded_categories.through.objects
+                   .filter(person_id__in=person_pks, category_id=self.activity.category_id)
+                   .values_list('person_id', flat=True))
+
+    def load_schedules(self, person_pks):
+        schedules = defaultdict(list)
+        assignments = models.ActivityOnEvent.person.through.objects \
+            .filter(person_id__in=person_pks, activityonevent__event=self.event) \
+            .select_related('activityonevent__activity__category') \
+            .order_by('activityonevent__start_dt', 'activityonevent__end_dt')
+        for assignment in assignments:
+            schedules[assignment.person_id].append(assignment.activityonevent)
+        return schedules
+
+    def errors(self, persons):
+        """
+        Все нарушения по всем людям в виде {поле формы: [сообщения]}
+        """
+        persons = list(persons)
+        person_pks = [person.pk for person in persons]
+        excluded = self.load_excluded(person_pks)
+        schedules = self.load_schedules(person_pks)
+        totals = workload.get_totals(self.event.pk, person_pks)
+        is_volunteer = self.activity.category.activity_type.name == const.VOLUNTEER
+        accounted_duration = self.activity.category.accounted_duration(self.end_dt - self.start_dt)
+
+        errors = defaultdict(list)
+        for person in persons:
+            if person.pk in excluded:
+                errors['person'].append(f'{person.first_name} не изволит работать с этой категорией активностей.')
+
+            activities = [act for act in schedules[person.pk] if act.pk != self.instance.pk]
+
+            if is_volunteer:
+                # хранимая нагрузка уже включает редактируемую активность в ее прежнем виде
+                activities_sum = totals.get(person.pk, datetime.timedelta(seconds=0)) \
+                    + accounted_duration
+                for act in schedules[person.pk]:
+                    if act.pk == self.instance.pk and act.activity_type_name == const.VOLUNTEER:
+                        activities_sum -= act.accounted_duration
+
+                if activities_sum > person.free_time_limit:
+                    errors['start_dt'].append(f'Недостаточно свободного времени у {person}')
+
+            for act in activities:
+                if is_intersects(self.start_dt, self.end_dt, act, self.instance):
+                    act_detail = f'{act.activity.name} ({act.start_dt.strftime("%H:%M:%S")} - ' \
+                                 f'{act.end_dt.strftime("%H:%M:%S")})'
+                    message = f'Пересечение с другой активностью у {person}: {act_detail}'
+                    errors['start_dt'].append(message)
+                    errors['end_dt'].append(message)
+
+        return dict(errors)
+
+    def validate(self, persons):
+        errors = self.errors(persons)
+        if errors:
+            raise ValidationError(errors)
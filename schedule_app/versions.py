@@ -0,0 +1,113 @@
+"""
+Версии расписаний для условных запросов.
+
+Версия мероприятия - Event.updated_at, версия личного расписания - более поздняя из Person.updated_at
+и Event.edited_at: изменения активностей обновляют версии только своих участников, а изменение самого
+мероприятия - версии всех его личных расписаний.
+Поля обновляются при сохранении самих объектов (auto_now) и сигналами при изменении активностей,
+назначений, категорий и типов (см. signals.py). Страницы и выгрузки, обернутые в conditional,
+отвечают 304 на запрос с совпадающим ETag / If-Modified-Since и берут готовое тело из кэша по версии,
+так что повторная загрузка без изменений стоит одного запроса версии
+"""
+import datetime
+import hashlib
+from functools import wraps
+
+from django.core.cache import cache
+from django.db.models import Q, Subquery
+from django.db.models.functions import Greatest
+from django.http import HttpResponse
+from django.utils.cache import get_conditional_response, patch_cache_control, quote_etag
+from django.utils.http import http_date
+
+from schedule_app import models
+
+RENDERED_KEY = 'rendered:{name}:{digest}'
+RENDERED_TIMEOUT = 24 * 60 * 60
+
+
+def now():
+    return datetime.datetime.now()
+
+
+def touch(event_pks=(), person_pks=()):
+    event_pks, person_pks = set(event_pks) - {None}, set(person_pks) - {None}
+    if event_pks:
+        models.Event.objects.filter(pk__in=event_pks).update(updated_at=now())
+    if person_pks:
+        models.Person.objects.filter(pk__in=person_pks).update(updated_at=now())
+
+
+def person_events(person_pk, stays):
+    """
+    Мероприятия, в состав которых входит человек person_pk (см. Event.get_roster): явное участие,
+    назначения на активности и пребывание stays - пары (приезд, отъезд), например до и после изменения
+    """
+    condition = Q(participants=person_pk) | Q(activityonevent__person=person_pk)
+    for arrival, departure in stays:
+        if arrival is not None and departure is not None:
+            condition |= Q(start_date__lte=departure.date(), end_date__gte=arrival.date())
+    return models.Event.objects.filter(condition).values_list('pk', flat=True).distinct()
+
+
+def event_version(request, pk):
+    return models.Event.objects.filter(pk=pk).values_list('updated_at', flat=True).first()
+
+
+def person_version(request, event_pk, person_pk):
+    event_version = Subquery(models.Event.objects.filter(pk=event_pk).values('edited_at'))
+    return models.Person.objects.filter(pk=person_pk) \
+        .values_list(Greatest('updated_at', event_version), flat=True).first()
+
+
+def conditional(version_func, cache_body=True):
+    """
+    Условные GET-запросы по версии из version_func(request, *args) и кэш отрисованного тела ответа.
+    Ответ зависит от пользователя (шапка страницы), поэтому пользователь входит и в ETag, и в ключ кэша.
+    Потоковые ответы не кэшируются
+    """
+
+    def decorator(view):
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            version = version_func(request, *args, **kwargs)
+            if version is None or request.method not in ('GET', 'HEAD'):
+                return view(request, *args, **kwargs)
+
+            parts = (view.__name__, request.user.pk, args, sorted(kwargs.items()), request.GET.urlencode(),
+                     version.isoformat())
+            digest = hashlib.md5(repr(parts).encode()).hexdigest()
+            etag = quote_etag(digest)
+            last_modified = int(version.timestamp())
+
+            response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+            if response is None:
+                response = rendered(view, request, args, kwargs, digest, cache_body)
+
+            if response.status_code in (200, 304):
+                response['ETag'] = etag
+                response['Last-Modified'] = http_date(last_modified)
+                patch_cache_control(response, private=True, no_cache=True)
+            return response
+
+        return wrapper
+
+    return decorator
+
+
+def rendered(view, request, args, kwargs, digest, cache_body):
+    key = RENDERED_KEY.format(name=view.__name__, digest=digest)
+    cached = cache.get(key) if cache_body else None
+    if cached is not None:
+        content, headers = cached
+        response = HttpResponse(content)
+        for header, value in headers:
+            response[header] = value
+        return response
+
+    response = view(request, *args, **kwargs)
+    if cache_body and response.status_code == 200 and not response.streaming:
+        headers = [(header, value) for header, value in response.items()
+                   if header in ('Content-Type', 'Content-Disposition')]
+        cache.set(key, (response.content, headers), RENDERED_TIMEOUT)
+    return response
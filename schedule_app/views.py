@@ -1,20 +1,22 @@
-import datetime
-import os
-from zipfile import ZipFile
-
 from django.contrib.auth.decorators import login_required
 from django.contrib.auth.mixins import LoginRequiredMixin
 from django.contrib.auth.models import AnonymousUser
-from django.db.models import Q
-from django.http import FileResponse, Http404
+from django.http import HttpResponse, JsonResponse, StreamingHttpResponse
 from django.shortcuts import redirect, render
 from django.urls import reverse_lazy
+from django.utils.dateparse import parse_datetime
 from django.views.generic import ListView
 
+from adentro_schedule.db import replica_reads
+
 import schedule_app.common as common
 import schedule_app.constants as const
+import schedule_app.coverage as coverage
+import schedule_app.matrix_cache as matrix_cache
+import schedule_app.matrix_json as matrix_json
+import schedule_app.serializers as serializers
 import schedule_app.utils as utils
-from adentro_schedule import settings
+import schedule_app.versions as versions
 from schedule_app.models import Event, Person
 
 
@@ -42,53 +44,43 @@ class BaseOperations(LoginRequiredMixin):
 
 
 @login_required
+@replica_reads
+@versions.conditional(versions.event_version, cache_body=False)
 def download_all(_, pk):
-    files_to_zip = {}
     event = Event.objects.get(pk=pk)
 
-    for person in common.get_full_schedule(pk).exclude(person__isnull=True).values('person').distinct():
-        person = Person.objects.get(pk=person['person'])
-
-        activities = person.get_schedule(pk).order_by('start_dt', 'end_dt')
+    assignments = common.get_assignments(event).iterator()
 
-        filename = f'{person.last_name} {person.first_name}.csv'
-        files_to_zip[filename] = utils.create_google_calendar_format_schedule(activities)
-
-    archive_path = os.path.join(settings.MEDIA_ROOT, f'{event.title}_расписание.zip')
-
-    with ZipFile(archive_path, 'w') as zip_file:
-        for file in files_to_zip:
-            zip_file.writestr(file, files_to_zip[file].to_csv(index=False, header=True))
-
-    if os.path.exists(archive_path):
-        response = FileResponse(open(archive_path, 'rb'))
-        return response
-    raise Http404
+    response = StreamingHttpResponse(serializers.stream_schedules_zip(assignments), content_type='application/zip')
+    response['Content-Disposition'] = utils.content_disposition(f'{event.title}_расписание.zip')
+    return response
 
 
 @login_required
-def download_person(_, event_pk, person_pk):
+@replica_reads
+@versions.conditional(versions.person_version)
+def download_person(request, event_pk, person_pk):
     person = Person.objects.get(pk=person_pk)
 
-    activities = person.get_schedule(event_pk).order_by('start_dt', 'end_dt')
-
-    formatted_schedule = utils.create_google_calendar_format_schedule(activities)
-
-    filename = f'{person.last_name} {person.first_name}.csv'
-    file_path = os.path.join(settings.MEDIA_ROOT, filename)
+    activities = common.get_person_schedule(event_pk, person)
 
-    formatted_schedule.to_csv(file_path, header=True, index=False)
-
-    if os.path.exists(file_path):
-        response = FileResponse(open(file_path, 'rb'))
+    filename = f'{person.last_name} {person.first_name}'
+    if request.GET.get('format') == 'ics':
+        response = HttpResponse(serializers.icalendar(activities), content_type='text/calendar; charset=utf-8')
+        response['Content-Disposition'] = utils.content_disposition(f'{filename}.ics')
         return response
-    raise Http404
+
+    response = HttpResponse(serializers.google_calendar_csv(activities), content_type='text/csv; charset=utf-8')
+    response['Content-Disposition'] = utils.content_disposition(f'{filename}.csv')
+    return response
 
 
 @login_required
+@replica_reads
+@versions.conditional(versions.person_version)
 def show_person_schedule(request, event_pk, person_pk):
     person = Person.objects.get(pk=person_pk)
-    objs = person.get_schedule(event_pk, const.VOLUNTEER).order_by('start_dt', 'end_dt')
+    objs = common.get_person_schedule(event_pk, person, const.VOLUNTEER)
 
     return render(request, '../templates/person_detail.html', {'event_pk': event_pk,
                                                                'person': person,
@@ -96,15 +88,18 @@ def show_person_schedule(request, event_pk, person_pk):
 
 
 @login_required
+@replica_reads
+@versions.conditional(versions.event_version)
 def show_official_schedule(request, pk):
-    objs = common.get_official_schedule(pk).order_by('start_dt', 'end_dt')
+    objs = common.get_official_schedule(pk)
     response = utils.ScheduleResponse(current_page_name=const.OFFICIAL, event_pk=pk)
     if not objs:
         return render(request, '../templates/event_detail.html', response.as_dict())
 
     data = []
     for activity in objs:
-        row_data = {'start_dt': activity.start_dt,
+        row_data = {'pk': activity.pk,
+                    'start_dt': activity.start_dt,
                     'end_dt': activity.end_dt,
                     'activity': activity.activity.name,
                     'persons': [f"{person.last_name} {person.first_name}" for person in activity.person.all()]}
@@ -116,8 +111,10 @@ def show_official_schedule(request, pk):
 
 
 @login_required
+@replica_reads
+@versions.conditional(versions.event_version)
 def show_other_schedule(request, pk):
-    objs = common.get_other_schedule(pk).order_by('start_dt', 'end_dt')
+    objs = common.get_other_schedule(pk)
     response = utils.ScheduleResponse(current_page_name=const.OTHER, event_pk=pk)
 
     if not objs:
@@ -125,7 +122,8 @@ def show_other_schedule(request, pk):
 
     data = []
     for activity in objs:
-        row_data = {'start_dt': activity.start_dt,
+        row_data = {'pk': activity.pk,
+                    'start_dt': activity.start_dt,
                     'end_dt': activity.end_dt,
                     'activity': activity.activity.name,
                     'persons': [f"{person.last_name} {person.first_name}" for person in activity.person.all()]}
@@ -137,69 +135,87 @@ def show_other_schedule(request, pk):
 
 
 @login_required
+@replica_reads
+@versions.conditional(versions.event_version)
 def show_volunteer_schedule(request, pk):
-    objs = common.get_full_schedule(pk)
-
+    """
+    Страница отдает только каркас таблицы: строки и столбцы подгружаются окнами из volunteer_schedule_data
+    """
     response = utils.ScheduleResponse(current_page_name=const.VOLUNTEER, event_pk=pk)
+    event = response.event
 
-    if not objs.filter(activity__category__activity_type__name=const.VOLUNTEER):
-        return render(request, '../templates/event_detail.html', response.as_dict())
+    matrix = matrix_cache.get_volunteer_matrix(event)
 
-    headers = {'activity_dt': list(),
-               'activity_name': list(),
-               'need_peoples': list()}
-    persons = Person.objects.all()
-    event = response.event
-    names = {person: {'status': list(),
-                      'duration_full': datetime.timedelta(seconds=0)} for person in persons}
+    if not matrix.columns:
+        return render(request, '../templates/event_detail.html', response.as_dict())
 
-    for activity in objs.filter(activity__category__activity_type__name=const.VOLUNTEER).order_by('start_dt', 'end_dt'):
-        row_data = {'start_dt': activity.start_dt,
-                    'end_dt': activity.end_dt,
-                    'time_coef': activity.activity.category.time_coefficient,
-                    'additional_time': activity.activity.category.additional_time,
-                    'activity': activity.activity.name,
-                    'persons': [person for person in activity.person.all()],
-                    'need_peoples': activity.activity.need_peoples,
-                    'activity_pk': activity.pk}
-
-        not_arrived_persons = Person.objects.filter(Q(arrival_datetime__gte=activity.start_dt) |
-                                                    Q(departure_datetime__lte=activity.end_dt))
-        row_data['unavailable'] = [person for person in not_arrived_persons]
-
-        another_acts = objs.filter(~Q(pk=activity.pk))
-        for another_act in another_acts:
-            if utils.is_intersects(start_dt=another_act.start_dt, end_dt=another_act.end_dt, activity=activity,
-                                   checked_activity=another_act):
-                row_data['unavailable'] += [person for person in another_act.person.all()]
-
-        duration = utils.get_duration(row_data)
-        duration_with_coef = utils.get_duration_with_coef(duration, row_data['additional_time'], row_data['time_coef'])
-
-        headers['activity_dt'].append(utils.date_transform(row_data, duration, duration_with_coef))
-        headers['activity_name'].append(row_data['activity'])
-        headers['need_peoples'].append(utils.need_peoples_transform(row_data))
-
-        for person in persons:
-            if person in row_data['persons']:
-                names[person]['duration_full'] += duration_with_coef
-                names[person]['status'].append('Участвует')
-            elif person in row_data['unavailable']:
-                names[person]['status'].append('Недоступен')
-            elif not person.arrive_and_depart_filled():
-                names[person]['status'].append('?')
-            else:
-                names[person]['status'].append('Доступен')
-
-    for person in list(names.keys()):
-        names[person]['duration_full'] = utils.human_readable_time(
-            int(names[person]['duration_full'].total_seconds()) // 60)
-        names[utils.create_url_for_person(event, person)] = names.pop(person)
-
-    response.content = {'table_headers': headers,
-                        'persons': names}
-
-    return render(request, '../templates/event_detail.html', {'table_headers': headers,
-                                                              'persons': names,
+    days = sorted({column.slot.start_dt.date() for column in matrix.columns})
+    return render(request, '../templates/event_detail.html', {'days': days,
+                                                              'persons_total': len(matrix.persons),
+                                                              'window_limit': const.VOLUNTEER_WINDOW_LIMIT,
                                                               'current_page': const.VOLUNTEER,
                                                               'event': event})
+
+
+def parse_window(params):
+    """
+    Параметры окна матрицы из запроса: смещение и количество строк людей, границы интервала времени
+    """
+    offset = int(params.get('offset', 0))
+    limit = min(int(params.get('limit', const.VOLUNTEER_WINDOW_LIMIT)), const.VOLUNTEER_WINDOW_MAX_LIMIT)
+    if offset < 0 or limit < 0:
+        raise ValueError('Смещение и количество строк не могут быть отрицательными')
+
+    bounds = []
+    for name in ('start', 'end'):
+        value = params.get(name)
+        bound = parse_datetime(value) if value else None
+        if value and bound is None:
+            raise ValueError(f'Некорректная дата {name}: {value}')
+        bounds.append(bound)
+    return offset, limit, bounds[0], bounds[1]
+
+
+@login_required
+@replica_reads
+@versions.conditional(versions.event_version)
+def volunteer_schedule_data(request, pk):
+    """
+    Окно волонтерской матрицы в JSON, см. matrix_json.volunteer_window
+    """
+    event = Event.objects.get(pk=pk)
+    try:
+        offset, limit, start_dt, end_dt = parse_window(request.GET)
+    except ValueError as e:
+        return JsonResponse({'error': str(e)}, status=400)
+
+    matrix = matrix_cache.get_volunteer_matrix(event)
+    columns, rows = matrix.window(offset, limit, start_dt, end_dt)
+
+    return JsonResponse(matrix_json.volunteer_window(event, columns, rows, offset, len(matrix.persons)))
+
+
+@login_required
+@replica_reads
+@versions.conditional(versions.event_version)
+def show_coverage(request, pk):
+    """
+    Покрытие волонтерского расписания без построения матрицы; format=json - то же в JSON
+    """
+    event = Event.objects.get(pk=pk)
+    report = coverage.Coverage.for_event(event).as_dict()
+    if request.GET.get('format') == 'json':
+        return JsonResponse(report)
+
+    return render(request, '../templates/coverage.html', {'event': event,
+                                                          'report': report,
+                                                          'current_page': const.COVERAGE})
+
+
+@login_required
+def live_updates(request, event_pk, person_pk=None):
+    """
+    Поток живых обновлений обслуживается под ASGI (sse.py). Здесь, без него, ответ 204:
+    браузер перестает переподключаться, и страница работает без живых обновлений
+    """
+    return HttpResponse(status=204)
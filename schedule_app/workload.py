@@ -0,0 +1,80 @@
+"""
+Хранимая нагрузка людей по мероприятиям (models.Workload).
+
+Пересчет выполняется для затронутых пар (мероприятие, человек) в той же транзакции, что и изменение,
+поэтому страница расписания, проверка формы и админка читают готовое значение одним запросом
+"""
+import datetime
+from collections import defaultdict
+
+from django.db import transaction
+
+import schedule_app.constants as const
+from schedule_app import models
+
+
+def compute(event_pks=None, person_pks=None):
+    """
+    Нагрузка по расписанию: {(pk мероприятия, pk человека): учетное время}
+    """
+    assignments = models.ActivityOnEvent.person.through.objects \
+        .filter(activityonevent__activity_type_name=const.VOLUNTEER)
+    if event_pks is not None:
+        assignments = assignments.filter(activityonevent__event_id__in=event_pks)
+    if person_pks is not None:
+        assignments = assignments.filter(person_id__in=person_pks)
+
+    totals = defaultdict(lambda: datetime.timedelta(seconds=0))
+    for event_pk, person_pk, accounted_duration in assignments.values_list(
+            'activityonevent__event_id', 'person_id', 'activityonevent__accounted_duration'):
+        totals[(event_pk, person_pk)] += accounted_duration
+    return totals
+
+
+@transaction.atomic
+def recompute(event_pks=None, person_pks=None):
+    """
+    Пересчет хранимой нагрузки для мероприятий event_pks и людей person_pks (None - все)
+    """
+    if event_pks is not None:
+        event_pks = set(event_pks)
+    if person_pks is not None:
+        person_pks = set(person_pks)
+    if event_pks == set() or person_pks == set():
+        return
+
+    stored = models.Workload.objects.all()
+    if event_pks is not None:
+        stored = stored.filter(event_id__in=event_pks)
+    if person_pks is not None:
+        stored = stored.filter(person_id__in=person_pks)
+    stored.delete()
+
+    models.Workload.objects.bulk_create(
+        models.Workload(event_id=event_pk, person_id=person_pk, accounted_time=accounted_time)
+        for (event_pk, person_pk), accounted_time in compute(event_pks, person_pks).items())
+
+
+def get_totals(event_pk, person_pks=None):
+    stored = models.Workload.objects.filter(event_id=event_pk)
+    if person_pks is not None:
+        stored = stored.filter(person_id__in=person_pks)
+    return dict(stored.values_list('person_id', 'accounted_time'))
+
+
+def get_total(event_pk, person_pk):
+    return models.Workload.objects.filter(event_id=event_pk, person_id=person_pk) \
+        .values_list('accounted_time', flat=True).first() or datetime.timedelta(seconds=0)
+
+
+def verify():
+    """
+    Расхождения хранимой нагрузки с расписанием: {(мероприятие, человек): (хранится, должно быть)}
+    """
+    expected = compute()
+    stored = {(event_pk, person_pk): accounted_time for event_pk, person_pk, accounted_time
+              in models.Workload.objects.values_list('event_id', 'person_id', 'accounted_time')}
+    zero = datetime.timedelta(seconds=0)
+    return {key: (stored.get(key, zero), expected.get(key, zero))
+            for key in set(expected) | set(stored)
+            if stored.get(key, zero) != expected.get(key, zero)}